@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DjangoAuxConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'django_aux'
+
+    def ready(self):
+        # registers the ilike_contains/ilike_startswith lookups on CharField and TextField
+        from django_aux import lookups
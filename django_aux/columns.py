@@ -5,7 +5,8 @@ from pandas import isna, Series, DataFrame as DF
 
 # django imports
 from django.utils.html import format_html, mark_safe, format_html_join
-from django.db.models import QuerySet   
+from django.db.models import QuerySet, DateTimeField
+from django.core.exceptions import FieldDoesNotExist
 
 # 3rd party django
 import django_tables2 as tables
@@ -17,7 +18,7 @@ from django.contrib.contenttypes.models import ContentType
 
 
 from django_pandas.io import read_frame
-from django_aux.utils import df_tz_convert
+from django_aux.utils import df_tz_convert, db_tz_convert, db_tz_format, DEFAULT_DATETIME_FORMAT
 
 
 
@@ -311,7 +312,11 @@ class CollapseDataFrameColumn(CollapseColumnBase):
         to_html_kwargs_extra (dict, optional): kwargs to be added to to_html_kwargs. Defaults to {}.
         timezone (str, optional): Timzone to use on tz-aware datetime columns. Defaults to settings.TIME_ZONE
         datetime_format (bool, optional): Whether to String format datetime columns. Defaults to True
-        datetime_format_str (str, optional): What format to use on datetime columns. Defaults to %a %d %b %Y, %I:%M%p 
+        datetime_format_str (str, optional): What format to use on datetime columns. Defaults to %a %d %b %Y, %I:%M%p %Z
+        tz_method (str, optional): How datetime columns are converted/formatted. 'python' uses Series.dt.strftime,
+            'cached' formats each unique timestamp once and 'db' pushes the conversion (AT TIME ZONE) and
+            formatting (to_char) into the query. Defaults to 'python'
+        tz_col_methods (dict, optional): Per field override of tz_method i.e. {'created':'db'}. Defaults to {}
     """  
     def __init__(
         self, *args, 
@@ -330,6 +335,10 @@ class CollapseDataFrameColumn(CollapseColumnBase):
         to_html_kwargs = None, 
         to_html_kwargs_extra = None, 
         timezone = None, 
+        datetime_format = True,
+        datetime_format_str = DEFAULT_DATETIME_FORMAT,
+        tz_method = 'python',
+        tz_col_methods = None,
         **kwargs   
     ):                
         super().__init__(*args, **kwargs)
@@ -337,6 +346,10 @@ class CollapseDataFrameColumn(CollapseColumnBase):
         self.limit = limit
         self.group_by = group_by
         self.timezone = timezone
+        self.datetime_format = datetime_format
+        self.datetime_format_str = datetime_format_str
+        self.tz_method = tz_method
+        self.tz_col_methods = {} if tz_col_methods==None else tz_col_methods
         self.filter_kwargs = {} if filter_kwargs==None else filter_kwargs
         self.filter_args = [] if filter_args==None else filter_args
         self.annotate_kwargs = {} if annotate_kwargs==None else annotate_kwargs
@@ -357,11 +370,41 @@ class CollapseDataFrameColumn(CollapseColumnBase):
         self.to_html_kwargs.update(self.to_html_kwargs_extra)
         self.no_wrap=False
          
-    def get_read_frame_kwargs(self, **kwargs):
+    def get_db_tz_aliases(self, model):
+        """ Returns a dict of {field name: annotation alias} for the datetime fields converted in the query """
+        if self.tz_method == 'db':
+            names = self.values_args if not self.use_read_frame else self.fieldnames
+            if not names:
+                names = [f.name for f in model._meta.concrete_fields]
+            names = [name for name in names if self.tz_col_methods.get(name, 'db') == 'db']
+        else:
+            names = [name for name, method in self.tz_col_methods.items() if method == 'db']
+        aliases = {}
+        for name in names:
+            try:
+                field = model._meta.get_field(name)
+            except FieldDoesNotExist:
+                continue
+            if isinstance(field, DateTimeField):
+                aliases[name] = f'{name}_local'
+        return aliases
+
+    def get_db_tz_annotations(self, model):
+        """ Returns the annotate kwargs that convert/format datetime fields in the query """
+        expr_func = db_tz_format if self.datetime_format else db_tz_convert
+        kwargs = dict(timezone=self.timezone)
+        if self.datetime_format:
+            kwargs['format_str'] = self.datetime_format_str
+        return {
+            alias: expr_func(name, **kwargs) for name, alias in self.get_db_tz_aliases(model).items()
+        }
+
+    def get_read_frame_kwargs(self, model=None, **kwargs):
         """ Reuturns the kwargs to be passed to read_frame function """ 
         kwargs = {}
         if self.fieldnames:
-            kwargs['fieldnames'] = self.fieldnames
+            aliases = self.get_db_tz_aliases(model) if model else {}
+            kwargs['fieldnames'] = [aliases.get(name, name) for name in self.fieldnames]
         if self.column_names:
             kwargs['column_names'] = self.column_names
         return kwargs       
@@ -373,10 +416,15 @@ class CollapseDataFrameColumn(CollapseColumnBase):
         qs = value.filter(
             *self.filter_args, **self.filter_kwargs
         )
+        tz_annotations = self.get_db_tz_annotations(qs.model)
+        if tz_annotations:
+            qs = qs.annotate(**tz_annotations)
         if self.use_read_frame == False:
+            aliases = self.get_db_tz_aliases(qs.model)
+            values_args = [aliases.get(arg, arg) for arg in self.values_args]
             if self.group_by:
                 qs = qs.values(
-                    *self.values_args, **self.values_kwargs
+                    *values_args, **self.values_kwargs
                 ).annotate(
                     **self.annotate_kwargs
                 )
@@ -384,7 +432,7 @@ class CollapseDataFrameColumn(CollapseColumnBase):
                 qs = qs.annotate(
                     **self.annotate_kwargs
                 ).values(
-                    *self.values_args, **self.values_kwargs
+                    *values_args, **self.values_kwargs
                 )
         qs = qs.order_by(*self.order_by_args)
         return qs if self.limit==None else qs[:self.limit]
@@ -392,12 +440,25 @@ class CollapseDataFrameColumn(CollapseColumnBase):
     def get_df_final(self, qs, **kwargs):
         ''' Final steps to pd.DF before render or export '''
         if self.use_read_frame:
-            df = read_frame(qs, **self.get_read_frame_kwargs())
+            df = read_frame(qs, **self.get_read_frame_kwargs(model=qs.model))
         else:
             df = DF(qs)
-            if self.column_names:
-                df.columns = self.column_names
-        df = df_tz_convert(df)
+        # Put the values converted in the query back under their field names
+        for name, alias in self.get_db_tz_aliases(qs.model).items():
+            if alias not in df.columns:
+                continue
+            if name in df.columns:
+                df[name] = df.pop(alias)
+            else:
+                df = df.rename(columns={alias:name})
+        if not self.use_read_frame and self.column_names:
+            df.columns = self.column_names
+        col_methods = {name:None for name, method in self.tz_col_methods.items() if method == 'db'}
+        col_methods.update({name:method for name, method in self.tz_col_methods.items() if method != 'db'})
+        df = df_tz_convert(
+            df, timezone=self.timezone, format=self.datetime_format, format_str=self.datetime_format_str,
+            method='python' if self.tz_method == 'db' else self.tz_method, col_methods=col_methods,
+        )
         return df
 
     def get_df_html(self, qs, **kwargs):
@@ -0,0 +1,348 @@
+import time
+import keyword
+import hashlib
+import logging
+from datetime import timedelta
+from graphlib import TopologicalSorter
+
+from django.apps import apps
+from django.db import connection, models, transaction
+
+from django_aux.utils import create_view_from_qs
+
+logger = logging.getLogger(__name__)
+
+# View columns never have a sequence, the pk is a plain integer
+AUTO_FIELD_MAP = {'AutoField':'IntegerField', 'BigAutoField':'BigIntegerField', 'SmallAutoField':'SmallIntegerField'}
+
+
+def get_default_model_name(view_name):
+    ''' Returns the CamelCased view name i.e. sale_summary -> SaleSummary '''
+    return ''.join(part.capitalize() for part in view_name.split('_'))
+
+
+def get_view_fields(view_name, pk_fields=None):
+    """Introspects the columns of a (materialized) view and returns the Django field specs for them.
+        A single pk column gets primary_key=True. Multiple pk columns are returned for a
+        models.CompositePrimaryKey when available (Django >= 5.2), otherwise the first one is
+        used as the pk (which is then not necessarily unique)
+
+    Args:
+        view_name (str): name of the view
+        pk_fields (list, optional): columns that make up the primary key. Defaults to the columns of
+            the view's unique index (if any), otherwise the first column
+
+    Returns:
+        tuple: list of (attr name, field class name, field kwargs) tuples and the list of composite pk attr names
+    """
+    with connection.cursor() as cursor:
+        description = connection.introspection.get_table_description(cursor, view_name)
+        constraints = connection.introspection.get_constraints(cursor, view_name)
+    if not description:
+        raise LookupError(f'{view_name} does not exist')
+    if pk_fields is None:
+        unique = [c['columns'] for c in constraints.values() if c['unique'] and c['columns']]
+        pk_fields = unique[0] if unique else [description[0].name]
+    if len(pk_fields) > 1 and not hasattr(models, 'CompositePrimaryKey'):
+        pk_fields = pk_fields[:1]
+    specs, composite_pk = [], []
+    for row in description:
+        try:
+            field_type = connection.introspection.get_field_type(row.type_code, row)
+        except KeyError:
+            field_type = 'TextField'
+        field_type = AUTO_FIELD_MAP.get(field_type, field_type)
+        kwargs = {}
+        if field_type == 'CharField':
+            if row.display_size and int(row.display_size) > 0:
+                kwargs['max_length'] = int(row.display_size)
+            else:
+                field_type = 'TextField'
+        if field_type == 'DecimalField':
+            kwargs['max_digits'] = row.precision if row.precision is not None else 1000
+            kwargs['decimal_places'] = row.scale if row.scale is not None else 500
+        name = row.name
+        if not name.isidentifier() or keyword.iskeyword(name) or '__' in name or name == 'pk':
+            name = '_'.join(part for part in ''.join(c if c.isalnum() else '_' for c in name).split('_') if part)
+            name = f'field_{name}'
+            kwargs['db_column'] = row.name
+        if row.name in pk_fields and len(pk_fields) == 1:
+            kwargs['primary_key'] = True
+        elif row.null_ok:
+            kwargs['null'] = True
+        if row.name in pk_fields and len(pk_fields) > 1:
+            composite_pk.append(name)
+        specs.append((name, field_type, kwargs))
+    return specs, composite_pk
+
+
+def get_view_model(view_name, app_label, model_name=None, pk_fields=None, module=None):
+    """Returns an unmanaged model class for a (materialized) view, e.g. one created with create_view_from_qs.
+        The class is registered with the app registry at runtime so it works with django-tables2,
+        django-filter and the plot mixins like any other model. Calling it again returns the registered class.
+
+    Args:
+        view_name (str): name of the view
+        app_label (str): label of the (installed) app the model is registered under
+        model_name (str, optional): Name of the model class. Defaults to the CamelCased view name
+        pk_fields (list, optional): columns that make up the primary key. Defaults to the view's unique index
+            (see get_view_fields)
+        module (str, optional): __module__ of the class. Defaults to f'{app_label}.models'
+    """
+    model_name = model_name or get_default_model_name(view_name)
+    try:
+        return apps.get_registered_model(app_label, model_name)
+    except LookupError:
+        pass
+    specs, composite_pk = get_view_fields(view_name, pk_fields=pk_fields)
+    attrs = {
+        '__module__': module or f'{app_label}.models',
+        'Meta': type('Meta', (), dict(managed=False, db_table=view_name, app_label=app_label)),
+    }
+    for name, field_type, kwargs in specs:
+        attrs[name] = getattr(models, field_type)(**kwargs)
+    if composite_pk:
+        attrs['pk'] = models.CompositePrimaryKey(*composite_pk)
+    return type(model_name, (models.Model,), attrs)
+
+
+def get_view_model_source(view_name, model_name=None, pk_fields=None):
+    """Returns the python source of an unmanaged model class for a (materialized) view
+        (to be pasted into a models.py instead of generating the class at runtime)
+
+    Args:
+        view_name (str): name of the view
+        model_name (str, optional): Name of the model class. Defaults to the CamelCased view name
+        pk_fields (list, optional): columns that make up the primary key. Defaults to the view's unique index
+    """
+    model_name = model_name or get_default_model_name(view_name)
+    specs, composite_pk = get_view_fields(view_name, pk_fields=pk_fields)
+    lines = [f'class {model_name}(models.Model):']
+    if composite_pk:
+        lines.append(f"    pk = models.CompositePrimaryKey({', '.join(repr(f) for f in composite_pk)})")
+    for name, field_type, kwargs in specs:
+        kwstr = ', '.join(f'{k}={v!r}' for k, v in kwargs.items())
+        lines.append(f'    {name} = models.{field_type}({kwstr})')
+    lines += ['', '    class Meta:', '        managed = False', f"        db_table = '{view_name}'", '']
+    return '\n'.join(lines)
+
+
+class DBView:
+    ''' An instance of this class represents a database view declared with ViewRegistry.register '''
+
+    def __init__(
+        self, name, qs, materialized=True, ufields=None, depends_on=None, source_tables=None,
+        owner='postgres', sql_permissions='', read_only_users=None, app_label=None, model_name=None,
+    ):
+        self.name = name
+        self._qs = qs
+        self.materialized = materialized
+        self.ufields = ufields
+        self.depends_on = list(depends_on or [])
+        self._source_tables = source_tables
+        self.owner = owner
+        self.sql_permissions = sql_permissions
+        self.read_only_users = read_only_users
+        self.app_label = app_label
+        self.model_name = model_name
+
+    @property
+    def qs(self):
+        ''' The queryset the view is built from (qs may be declared as a callable so it is evaluated lazily) '''
+        return self._qs() if callable(self._qs) else self._qs
+
+    @property
+    def source_tables(self):
+        ''' Returns the names of the tables/views the view selects from '''
+        if self._source_tables is not None:
+            return sorted(self._source_tables)
+        query = self.qs.query.clone()
+        query.get_compiler(connection=connection).as_sql()
+        return sorted({join.table_name for join in query.alias_map.values()})
+
+    def has_unique_index(self):
+        ''' Returns True if the materialized view has a unique index (required for a concurrent refresh) '''
+        with connection.cursor() as cursor:
+            cursor.execute(
+                ''' SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indrelid
+                    WHERE c.relname = %s AND i.indisunique LIMIT 1 ''',
+                [self.name]
+            )
+            return cursor.fetchone() is not None
+
+    def get_source_signature(self):
+        ''' Returns a hash of the write counters (pg_stat_user_tables) of the source tables.
+            If the hash has not changed the source tables have not been written to. Note the statistics
+            are cumulative and reported with a small delay, they can be used to skip work but not as a lock '''
+        with connection.cursor() as cursor:
+            cursor.execute(
+                ''' SELECT relname, n_tup_ins, n_tup_upd, n_tup_del FROM pg_stat_user_tables
+                    WHERE relname = ANY(%s) ORDER BY relname ''',
+                [self.source_tables]
+            )
+            rows = cursor.fetchall()
+        return hashlib.md5(str(rows).encode()).hexdigest()
+
+    def create(self, swap=False, drop_dependents=None):
+        ''' (Re)creates the view using django_aux.utils.create_view_from_qs '''
+        create_view_from_qs(
+            self.qs, self.name, materialized=self.materialized, ufields=self.ufields, owner=self.owner,
+            sql_permissions=self.sql_permissions, read_only_users=self.read_only_users, swap=swap,
+            drop_dependents=drop_dependents,
+        )
+
+    def get_model(self, app_label=None):
+        ''' Returns the unmanaged model class for the (created) view. The unique index fields are the pk '''
+        app_label = app_label or self.app_label
+        if not app_label:
+            raise ValueError(f'An app_label is required to build a model for {self.name}')
+        return get_view_model(self.name, app_label, model_name=self.model_name, pk_fields=self.ufields)
+
+    def get_model_source(self):
+        ''' Returns the python source of the unmanaged model class for the (created) view '''
+        return get_view_model_source(self.name, model_name=self.model_name, pk_fields=self.ufields)
+
+    def get_row_count(self):
+        with connection.cursor() as cursor:
+            cursor.execute(f''' SELECT count(*) FROM "{self.name}" ''')
+            return cursor.fetchone()[0]
+
+    def refresh(self, concurrently=True, count_rows=True, source_signature=None):
+        """Refreshes the materialized view and records the refresh in the ViewRefresh table
+
+        Args:
+            concurrently (bool, optional): Use REFRESH MATERIALIZED VIEW CONCURRENTLY if the view has
+                a unique index. Defaults to True
+            count_rows (bool, optional): Whether to record the row count of the view. Defaults to True
+            source_signature (str, optional): The signature of the source tables. Computed if not passed
+
+        Returns:
+            ViewRefresh: the bookkeeping instance
+        """
+        from django_aux.models import ViewRefresh
+        concurrently = concurrently and self.has_unique_index()
+        source_signature = source_signature or self.get_source_signature()
+        cstr = 'CONCURRENTLY' if concurrently else ''
+        start = time.monotonic()
+        with connection.cursor() as cursor:
+            cursor.execute(f''' REFRESH MATERIALIZED VIEW {cstr} "{self.name}" ''')
+        duration = timedelta(seconds=time.monotonic() - start)
+        logger.info(f'Refreshed {self.name} in {duration}')
+        return ViewRefresh.objects.create(
+            view_name=self.name, duration=duration, concurrently=concurrently,
+            row_count=self.get_row_count() if count_rows else None, source_signature=source_signature,
+        )
+
+    def __str__(self):
+        return self.name
+
+
+class ViewRegistry:
+    ''' A registry of database views created from querysets. Views are declared once (typically in an
+        app's db_views.py module which is autodiscovered by the refresh_db_views management command)
+        and can then be created and refreshed in dependency order
+
+        i.e.
+        view_registry.register('sale_summary', lambda: Sale.objects.values('category').annotate(n=Count('id')), ufields=['category'])
+    '''
+
+    def __init__(self):
+        self.views = {}
+
+    def register(self, name, qs, **kwargs):
+        """Declares a view, see DBView for the available kwargs
+
+        Args:
+            name (str): The name of the view
+            qs (QuerySet|callable): The queryset (or a callable returning it) the view is built from
+            depends_on (list, optional): names of registered views this view selects from
+        """
+        self.views[name] = DBView(name, qs, **kwargs)
+        return self.views[name]
+
+    def get_view(self, name):
+        if name not in self.views:
+            raise KeyError(f'{name} is not a registered view. Options are {list(self.views)}')
+        return self.views[name]
+
+    def get_dependents(self, name):
+        ''' Returns the set of view names that (transitively) depend on the view "name" '''
+        dependents = set()
+        stack = [name]
+        while stack:
+            current = stack.pop()
+            for view in self.views.values():
+                if current in view.depends_on and view.name not in dependents:
+                    dependents.add(view.name)
+                    stack.append(view.name)
+        return dependents
+
+    def get_ordered_views(self, names=None, include_dependents=True):
+        """Returns the views in dependency order (a view always comes after the views it depends on)
+
+        Args:
+            names (list, optional): names of the views to include. Defaults to all registered views
+            include_dependents (bool, optional): Also include the views that depend on names. Defaults to True
+        """
+        names = set(self.views) if names is None else set(names)
+        for name in list(names):
+            self.get_view(name)
+            if include_dependents:
+                names.update(self.get_dependents(name))
+        graph = {name: [dep for dep in self.get_view(name).depends_on if dep in names] for name in names}
+        return [self.views[name] for name in TopologicalSorter(graph).static_order()]
+
+    def create(self, names=None, swap=False):
+        ''' (Re)creates the views (and their dependents) in dependency order. See create_view_from_qs for swap.
+            With swap the registered dependents of a view are dropped when it is swapped and rebuilt after it
+            (they would keep reading the old view otherwise), all in one transaction so readers never see a
+            missing view (readers of the dependents wait for the commit) '''
+        views = self.get_ordered_views(names)
+        if not swap:
+            for view in views:
+                view.create()
+            return
+        order = [view.name for view in views]
+        with transaction.atomic():
+            for view in views:
+                dependents = self.get_dependents(view.name)
+                view.create(swap=True, drop_dependents=[name for name in reversed(order) if name in dependents])
+
+    def refresh(self, names=None, concurrently=True, skip_unchanged=False, count_rows=True):
+        """Refreshes the materialized views (and their dependents) in dependency order
+
+        Args:
+            names (list, optional): names of the views to refresh. Defaults to all registered views
+            concurrently (bool, optional): Refresh concurrently when a unique index exists. Defaults to True
+            skip_unchanged (bool, optional): Skip views whose source tables have not changed since the
+                last refresh and whose dependencies have not been refreshed since. Defaults to False
+            count_rows (bool, optional): Whether to record the row count of each view. Defaults to True
+
+        Returns:
+            list: list of ViewRefresh instances (one per view, including skipped views)
+        """
+        from django_aux.models import ViewRefresh
+        refreshes = []
+        refreshed = set()
+        for view in self.get_ordered_views(names):
+            if not view.materialized:
+                continue
+            signature = view.get_source_signature()
+            last = ViewRefresh.get_last(view.name)
+            if skip_unchanged and last and last.source_signature == signature:
+                stale_deps = refreshed.intersection(view.depends_on) or any(
+                    dep_last.refreshed_at > last.refreshed_at
+                    for dep_last in [ViewRefresh.get_last(dep) for dep in view.depends_on] if dep_last
+                )
+                if not stale_deps:
+                    logger.info(f'Skipped {view.name}, source tables unchanged')
+                    refreshes.append(ViewRefresh.objects.create(
+                        view_name=view.name, skipped=True, source_signature=signature,
+                    ))
+                    continue
+            refreshes.append(view.refresh(concurrently=concurrently, count_rows=count_rows, source_signature=signature))
+            refreshed.add(view.name)
+        return refreshes
+
+
+view_registry = ViewRegistry()
@@ -4,6 +4,8 @@ from bootstrap_datepicker_plus.widgets import DatePickerInput, DateTimePickerInp
 from crispy_forms.helper import FormHelper
 from django import forms
 from crispy_forms.layout import *
+from django_filters.utils import get_model_field
+from django_aux.lookups import TRIGRAM_LOOKUP_MAP
 
 
 class MetaBase:
@@ -32,9 +34,14 @@ class MetaBase:
 class FilterSetBase(FilterSet):
     ''' A BaseFilter class that initializes a crispy form helper 
     with submit and clear filter buttons '''
+    # If True icontains/istartswith filters on text fields use ILIKE on the bare column so a
+    # pg_trgm index can serve them (see django_aux.lookups and the trigram_indexes command)
+    trigram_lookups = True
 
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
+        if self.trigram_lookups:
+            self.set_trigram_lookups()
         self.form.helper = FormHelper()
         self.form.helper.disable_csrf = True
         self.form.helper.add_input(
@@ -44,6 +51,19 @@ class FilterSetBase(FilterSet):
             Submit('clear_filter', 'Clear Filter', css_class='btn-warning')
         )
 
+    def set_trigram_lookups(self):
+        ''' Swaps the lookup_expr of icontains/istartswith filters for their trigram index friendly equivalent '''
+        model = self._meta.model
+        for fltr in self.filters.values():
+            trgm_lookup = TRIGRAM_LOOKUP_MAP.get(fltr.lookup_expr)
+            if not trgm_lookup or not model:
+                continue
+            field = get_model_field(model, fltr.field_name)
+            if field is not None and field.get_lookup(trgm_lookup):
+                # the default label is derived from the lookup, keep the one of the original lookup
+                fltr.label = fltr.label
+                fltr.lookup_expr = trgm_lookup
+
 
 class PlotSettingsFilterMixin(FilterSet):
     ''' The purpose of this filter is to add in a standard form for plot
@@ -0,0 +1,74 @@
+import os
+
+import pandas as pd
+from django.apps import apps
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
+from django_aux.models import ModelBase
+
+
+def get_history_models(model_labels=None):
+    """Returns the history models of the ModelBase subclasses (or of the models in model_labels)
+
+    Args:
+        model_labels (list, optional): list of "app_label.ModelName" strings. Defaults to every concrete ModelBase subclass
+    """
+    if model_labels:
+        models = [apps.get_model(label) for label in model_labels]
+    else:
+        models = [m for m in apps.get_models() if issubclass(m, ModelBase)]
+    return [m.history.model for m in models if hasattr(m, 'history')]
+
+
+def get_old_history_qs(history_model, days, keep_latest=True):
+    """Returns the queryset of the history rows older than days
+
+    Args:
+        keep_latest (bool, optional): Never include the latest history row of an object. Defaults to True
+    """
+    qs = history_model._default_manager.filter(history_date__lt=timezone.now() - timezone.timedelta(days=days))
+    if keep_latest:
+        newer = history_model._default_manager.filter(
+            id=OuterRef('id'), history_date__gt=OuterRef('history_date'),
+        )
+        qs = qs.filter(Exists(newer))
+    return qs
+
+
+def prune_history(history_model, days, batch_size=10_000, archive_dir=None, keep_latest=True, dry_run=False):
+    """Deletes the history rows older than days in batches of batch_size (one transaction per batch)
+        so the history table is never locked for long.
+
+    Args:
+        history_model (Model): the history model (i.e. MyModel.history.model)
+        days (int): age (in days) after which history rows are pruned
+        batch_size (int, optional): Number of rows deleted per batch. Defaults to 10_000
+        archive_dir (str, optional): If given each batch is appended to <archive_dir>/<history table>.csv.gz before it is deleted
+        keep_latest (bool, optional): Keep the latest history row of each object. Defaults to True
+        dry_run (bool, optional): Only count the rows that would be pruned. Defaults to False
+
+    Returns:
+        int: number of history rows pruned (or that would be pruned)
+    """
+    qs = get_old_history_qs(history_model, days, keep_latest=keep_latest)
+    if dry_run:
+        return qs.count()
+    archive_path = None
+    if archive_dir:
+        os.makedirs(archive_dir, exist_ok=True)
+        archive_path = os.path.join(archive_dir, f'{history_model._meta.db_table}.csv.gz')
+    pruned = 0
+    while True:
+        with transaction.atomic():
+            pks = list(qs.order_by('history_id').values_list('history_id', flat=True)[:batch_size])
+            if not pks:
+                break
+            batch_qs = history_model._default_manager.filter(history_id__in=pks)
+            if archive_path:
+                df = pd.DataFrame.from_records(batch_qs.order_by('history_id').values())
+                df.to_csv(archive_path, mode='a', index=False, header=not os.path.exists(archive_path))
+            batch_qs.delete()
+        pruned += len(pks)
+    return pruned
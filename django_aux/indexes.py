@@ -0,0 +1,151 @@
+import os
+import re
+import hashlib
+from importlib import import_module
+
+from django.db import connection
+from django.db.migrations.loader import MigrationLoader
+from django_filters.utils import get_model_field
+
+from django_aux.filters import FilterSetBase
+from django_aux.lookups import TRIGRAM_LOOKUP_MAP
+
+TRIGRAM_INDEX_RE = re.compile(r'\(\s*"?(\w+)"?\s+gi(?:n|st)_trgm_ops')
+
+MIGRATION_TEMPLATE = '''# Generated by django_aux trigram_indexes
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        %(dependencies)s
+    ]
+
+    operations = [
+        TrigramExtension(),
+%(operations)s
+    ]
+'''
+
+OPERATION_TEMPLATE = '''        migrations.RunSQL(
+            sql=%(sql)r,
+            reverse_sql=%(reverse_sql)r,
+        ),'''
+
+
+def get_filterset_classes(base=FilterSetBase):
+    ''' Returns every (imported) subclass of base that has a model '''
+    classes, stack = [], list(base.__subclasses__())
+    while stack:
+        cls = stack.pop()
+        stack.extend(cls.__subclasses__())
+        if cls._meta.model is not None and cls not in classes:
+            classes.append(cls)
+    return classes
+
+
+def get_trigram_candidates(filterset_classes=None):
+    """Finds the icontains/istartswith filters (on text fields) of the filtersets
+
+    Args:
+        filterset_classes (list, optional): Defaults to every imported FilterSetBase subclass
+
+    Returns:
+        list: list of dicts with keys filterset, filter_name, lookup_expr, model, table and column
+    """
+    filterset_classes = get_filterset_classes() if filterset_classes is None else filterset_classes
+    lookup_exprs = set(TRIGRAM_LOOKUP_MAP) | set(TRIGRAM_LOOKUP_MAP.values())
+    candidates = []
+    for fs_class in filterset_classes:
+        for name, fltr in fs_class.base_filters.items():
+            if fltr.lookup_expr not in lookup_exprs:
+                continue
+            field = get_model_field(fs_class._meta.model, fltr.field_name)
+            if field is None or not field.get_lookup(TRIGRAM_LOOKUP_MAP.get(fltr.lookup_expr, fltr.lookup_expr)):
+                continue
+            candidates.append(dict(
+                filterset=fs_class, filter_name=name, lookup_expr=fltr.lookup_expr,
+                model=field.model, table=field.model._meta.db_table, column=field.column,
+            ))
+    return candidates
+
+
+def get_trigram_indexed_columns(table):
+    ''' Returns the set of columns of table that have a pg_trgm (gin or gist) index '''
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT indexdef FROM pg_indexes WHERE tablename = %s', [table])
+        defs = [row[0] for row in cursor.fetchall()]
+    return {col for idef in defs for col in TRIGRAM_INDEX_RE.findall(idef)}
+
+
+def get_trigram_report(filterset_classes=None):
+    ''' Returns get_trigram_candidates with an added "indexed" key indicating a supporting index exists '''
+    candidates = get_trigram_candidates(filterset_classes)
+    indexed = {}
+    for cand in candidates:
+        if cand['table'] not in indexed:
+            indexed[cand['table']] = get_trigram_indexed_columns(cand['table'])
+        cand['indexed'] = cand['column'] in indexed[cand['table']]
+    return candidates
+
+
+def get_trigram_index_name(table, column):
+    ''' Returns the name of the trigram index (shortened with a hash to fit the 63 character limit) '''
+    name = f'{table}_{column}_trgm'
+    if len(name) > 63:
+        digest = hashlib.md5(name.encode()).hexdigest()[:8]
+        name = f'{name[:49]}_{digest}_trgm'
+    return name
+
+
+def get_trigram_index_sql(table, column, concurrently=True):
+    """Returns the (create, drop) SQL for a pg_trgm GIN index on table.column
+
+    Args:
+        concurrently (bool, optional): Use CREATE/DROP INDEX CONCURRENTLY (no write lock). Defaults to True
+    """
+    cstr = 'CONCURRENTLY ' if concurrently else ''
+    name = get_trigram_index_name(table, column)
+    create = f'CREATE INDEX {cstr}IF NOT EXISTS "{name}" ON "{table}" USING gin ("{column}" gin_trgm_ops);'
+    drop = f'DROP INDEX {cstr}IF EXISTS "{name}";'
+    return create, drop
+
+
+def get_trigram_migrations(candidates):
+    """Builds a migration per app that adds the missing trigram indexes (CREATE INDEX CONCURRENTLY).
+        The indexes are added with RunSQL so they do not become part of the model state.
+
+    Args:
+        candidates (list): output of get_trigram_report (only the unindexed candidates are used)
+
+    Returns:
+        dict: {path: source} of the migration files to write
+    """
+    loader = MigrationLoader(None, ignore_no_migrations=True)
+    by_app = {}
+    for cand in candidates:
+        if cand.get('indexed'):
+            continue
+        key = (cand['table'], cand['column'])
+        by_app.setdefault(cand['model']._meta.app_label, {})[key] = cand
+    migrations = {}
+    for app_label, cands in by_app.items():
+        leaves = loader.graph.leaf_nodes(app_label)
+        if not leaves:
+            continue
+        number = int(leaves[0][1].split('_')[0]) + 1 if leaves[0][1][:4].isdigit() else 1
+        operations = []
+        for table, column in sorted(cands):
+            sql, reverse_sql = get_trigram_index_sql(table, column)
+            operations.append(OPERATION_TEMPLATE % dict(sql=sql, reverse_sql=reverse_sql))
+        source = MIGRATION_TEMPLATE % dict(
+            dependencies=', '.join(repr(leaf) for leaf in leaves), operations='\n'.join(operations),
+        )
+        path = import_module(loader.migrations_module(app_label)[0]).__path__[0]
+        migrations[os.path.join(path, f'{number:04d}_trigram_indexes.py')] = source
+    return migrations
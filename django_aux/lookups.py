@@ -0,0 +1,42 @@
+from django.db.models import CharField, TextField
+from django.db.models.lookups import IContains, IStartsWith
+
+
+class ILikeMixin:
+    ''' Mixin for case insensitive pattern lookups that compare the bare column with ILIKE on PostgreSQL.
+    Django's icontains/istartswith compare UPPER(col::text) with LIKE, which a pg_trgm index on the column
+    cannot serve. Other database backends fall back to the regular lookup '''
+    fallback = None # The django lookup used on other backends
+    pattern_op = '' # key of connection.pattern_ops used when the rhs is an expression
+
+    def get_rhs_op(self, connection, rhs):
+        if self.rhs_is_direct_value():
+            return f'ILIKE {rhs}'
+        pattern = connection.pattern_esc.format(rhs)
+        return connection.pattern_ops[self.pattern_op].format(pattern).replace('LIKE', 'ILIKE', 1)
+
+    def as_sql(self, compiler, connection):
+        return self.fallback(self.lhs, self.rhs).as_sql(compiler, connection)
+
+    def as_postgresql(self, compiler, connection):
+        return super().as_sql(compiler, connection)
+
+
+@CharField.register_lookup
+@TextField.register_lookup
+class ILikeContains(ILikeMixin, IContains):
+    lookup_name = 'ilike_contains'
+    fallback = IContains
+    pattern_op = 'contains'
+
+
+@CharField.register_lookup
+@TextField.register_lookup
+class ILikeStartsWith(ILikeMixin, IStartsWith):
+    lookup_name = 'ilike_startswith'
+    fallback = IStartsWith
+    pattern_op = 'startswith'
+
+
+# Maps the django lookups to their trigram index friendly equivalent
+TRIGRAM_LOOKUP_MAP = {'icontains':ILikeContains.lookup_name, 'istartswith':ILikeStartsWith.lookup_name}
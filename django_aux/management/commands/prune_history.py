@@ -0,0 +1,28 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from django_aux.history import get_history_models, prune_history
+
+
+class Command(BaseCommand):
+    help = 'Prunes (and optionally archives) the history rows of ModelBase subclasses older than a given age'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='app_label.ModelName of the models to prune. Defaults to all ModelBase subclasses')
+        parser.add_argument(
+            '--days', type=int, default=getattr(settings, 'HISTORY_RETENTION_DAYS', 365),
+            help='Prune history older than this many days. Defaults to settings.HISTORY_RETENTION_DAYS or 365',
+        )
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Number of rows deleted per transaction')
+        parser.add_argument('--archive-dir', help='Append the pruned rows to <archive-dir>/<history table>.csv.gz first')
+        parser.add_argument('--prune-latest', action='store_true', help='Also prune the latest history row of each object')
+        parser.add_argument('--dry-run', action='store_true', help='Only report how many rows would be pruned')
+
+    def handle(self, *args, **options):
+        for history_model in get_history_models(options['models']):
+            count = prune_history(
+                history_model, options['days'], batch_size=options['batch_size'], archive_dir=options['archive_dir'],
+                keep_latest=not options['prune_latest'], dry_run=options['dry_run'],
+            )
+            verb = 'Would prune' if options['dry_run'] else 'Pruned'
+            self.stdout.write(f'{verb} {count} rows of {history_model._meta.db_table}')
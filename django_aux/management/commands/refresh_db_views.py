@@ -0,0 +1,39 @@
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from django_aux.db_views import view_registry
+
+
+class Command(BaseCommand):
+    help = 'Creates or refreshes the views declared in the db_views modules of installed apps (in dependency order)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('views', nargs='*', help='Names of the views to refresh. Defaults to all registered views')
+        parser.add_argument('--create', action='store_true', help='(Re)create the views instead of refreshing them')
+        parser.add_argument('--swap', action='store_true', help='With --create, build each view under a temporary name and swap it in')
+        parser.add_argument('--models', action='store_true', help='Print the unmanaged model source for the views')
+        parser.add_argument('--no-concurrently', action='store_true', help='Never use REFRESH ... CONCURRENTLY')
+        parser.add_argument('--skip-unchanged', action='store_true', help='Skip views whose source tables have not changed')
+        parser.add_argument('--no-count', action='store_true', help='Do not record the row count of each view')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('db_views')
+        names = options['views'] or None
+        if options['models']:
+            self.stdout.write('from django.db import models\n\n')
+            for view in view_registry.get_ordered_views(names):
+                self.stdout.write(view.get_model_source())
+            return
+        if options['create']:
+            view_registry.create(names, swap=options['swap'])
+            self.stdout.write(self.style.SUCCESS('Views created'))
+            return
+        refreshes = view_registry.refresh(
+            names, concurrently=not options['no_concurrently'],
+            skip_unchanged=options['skip_unchanged'], count_rows=not options['no_count'],
+        )
+        for refresh in refreshes:
+            if refresh.skipped:
+                self.stdout.write(f'{refresh.view_name}: skipped (unchanged)')
+            else:
+                self.stdout.write(f'{refresh.view_name}: {refresh.row_count} rows in {refresh.duration}')
@@ -0,0 +1,31 @@
+from django.core.management.base import BaseCommand
+from django.utils.module_loading import autodiscover_modules
+
+from django_aux.indexes import get_trigram_report, get_trigram_index_sql, get_trigram_migrations
+
+
+class Command(BaseCommand):
+    help = '''Reports the icontains/istartswith filters of FilterSetBase subclasses (found in the filters
+    modules of installed apps) that lack a supporting pg_trgm index'''
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sql', action='store_true', help='Print the CREATE INDEX CONCURRENTLY statements')
+        parser.add_argument('--makemigrations', action='store_true', help='Write migrations that add the missing indexes')
+
+    def handle(self, *args, **options):
+        autodiscover_modules('filters')
+        report = get_trigram_report()
+        missing = [cand for cand in report if not cand['indexed']]
+        for cand in report:
+            status = 'ok' if cand['indexed'] else 'MISSING'
+            self.stdout.write(
+                f"{status:8}{cand['filterset'].__name__}.{cand['filter_name']} -> {cand['table']}.{cand['column']}"
+            )
+        if options['sql']:
+            for table, column in sorted({(cand['table'], cand['column']) for cand in missing}):
+                self.stdout.write(get_trigram_index_sql(table, column)[0])
+        if options['makemigrations']:
+            for path, source in get_trigram_migrations(missing).items():
+                with open(path, 'w') as f:
+                    f.write(source)
+                self.stdout.write(self.style.SUCCESS(f'Wrote {path}'))
@@ -0,0 +1,31 @@
+# Generated by Django 4.2.30 on 2026-10-19 12:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ViewRefresh',
+            fields=[
+                ('id', models.BigAutoField(primary_key=True, serialize=False)),
+                ('view_name', models.CharField(max_length=63)),
+                ('refreshed_at', models.DateTimeField(auto_now_add=True)),
+                ('duration', models.DurationField(blank=True, null=True)),
+                ('row_count', models.BigIntegerField(blank=True, null=True)),
+                ('concurrently', models.BooleanField(default=False)),
+                ('skipped', models.BooleanField(default=False)),
+                ('source_signature', models.CharField(blank=True, max_length=32, null=True)),
+            ],
+            options={
+                'ordering': ['-refreshed_at'],
+                'indexes': [models.Index(fields=['view_name', '-refreshed_at'], name='django_aux__view_na_735896_idx')],
+            },
+        ),
+    ]
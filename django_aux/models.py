@@ -1,13 +1,61 @@
-from django.db import models
-from django.core.exceptions import ValidationError
-from django.db.models import Q
+from django.db import models, transaction
+from django.core.exceptions import ValidationError, FieldDoesNotExist
+from django.db.models import Q, F, Func
 from simple_history.models import HistoricalRecords
+from simple_history.utils import bulk_create_with_history, bulk_update_with_history, get_history_manager_for_model
+import heapq
 import pandas as pd
 
+class ModelBaseQuerySet(models.QuerySet):
+    ''' QuerySet for ModelBase that can write the history of set based updates '''
+
+    def update_with_history(self, chunk_size=2000, default_user=None, default_change_reason=None, **kwargs):
+        """Same as update(**kwargs) but also writes a history row for every updated object.
+            The objects are updated in chunks, each chunk is read back and its history is
+            written with a single bulk insert.
+
+        Args:
+            chunk_size (int, optional): Number of objects updated per UPDATE. Defaults to 2000
+            default_user (User, optional): history_user of the history rows. Defaults to the request user (middleware)
+            default_change_reason (str, optional): history_change_reason of the history rows
+
+        Returns:
+            int: number of rows updated
+        """
+        history_manager = get_history_manager_for_model(self.model)
+        manager = self.model._default_manager
+        rows = 0
+        with transaction.atomic():
+            pks = list(self.values_list('pk', flat=True))
+            for i in range(0, len(pks), chunk_size):
+                chunk_qs = manager.filter(pk__in=pks[i:i + chunk_size])
+                rows += chunk_qs.update(**kwargs)
+                history_manager.bulk_history_create(
+                    list(chunk_qs), update=True, default_user=default_user,
+                    default_change_reason=default_change_reason,
+                )
+        return rows
+
+
 class ModelBase(models.Model):
     class Meta:
         abstract = True
     history = HistoricalRecords(related_name='log', inherit=True)
+    objects = ModelBaseQuerySet.as_manager()
+
+    @classmethod
+    def bulk_create_with_history(cls, objs, batch_size=None, ignore_conflicts=False, **kwargs):
+        ''' Bulk creates objs and their history rows (one bulk insert per batch),
+        kwargs (default_user, default_change_reason, default_date) are passed to simple_history '''
+        return bulk_create_with_history(
+            objs, cls, batch_size=batch_size, ignore_conflicts=ignore_conflicts, **kwargs
+        )
+
+    @classmethod
+    def bulk_update_with_history(cls, objs, fields, batch_size=None, **kwargs):
+        ''' Bulk updates fields of objs and writes their history rows (one bulk insert per batch),
+        kwargs (default_user, default_change_reason, default_date) are passed to simple_history '''
+        return bulk_update_with_history(objs, cls, fields, batch_size=batch_size, **kwargs)
 
     @classmethod
     def get_field_names(cls):
@@ -15,19 +63,54 @@ class ModelBase(models.Model):
         return [f.name for f in cls._meta.get_fields()]
 
 
+class ViewRefresh(models.Model):
+    ''' An instance of this model records a refresh of a materialized view declared in 
+    django_aux.db_views.view_registry '''
+    id = models.BigAutoField(primary_key=True)
+    view_name = models.CharField(max_length=63)
+    refreshed_at = models.DateTimeField(auto_now_add=True)
+    duration = models.DurationField(null=True, blank=True)
+    row_count = models.BigIntegerField(null=True, blank=True)
+    concurrently = models.BooleanField(default=False)
+    skipped = models.BooleanField(default=False)
+    source_signature = models.CharField(max_length=32, null=True, blank=True)
+
+    class Meta:
+        ordering = ['-refreshed_at']
+        indexes = [models.Index(fields=['view_name', '-refreshed_at'])]
+
+    @classmethod
+    def get_last(cls, view_name):
+        ''' Returns the last (not skipped) refresh of the view or None '''
+        return cls.objects.filter(view_name=view_name, skipped=False).order_by('-refreshed_at').first()
+
+    def __str__(self):
+        return f'{self.view_name} | {self.refreshed_at}'
+
+
 class CheckRangeMixin:
     '''
         This model mixin adds cleaning functionality to a model that will ensure the value of a ending attr 
-        is greater than the value of a start attr. Default will not let them be equal but can be overwritten
+        is greater than the value of a start attr. Default will not let them be equal but can be overwritten.
+        To also enforce the rule in the DB (bulk_create and update skip clean) declare get_range_constraint
+        in Meta.constraints
     '''
     start_attr = '' # Name of the attr that starts the range (must be overwritten)
     end_attr = '' # Name of the attr that ends the range (must be overwritten)
     allow_zero_diff = False
     clean_during_save = True
 
+    @classmethod
+    def get_check_constraint(cls, name=None):
+        ''' Returns the get_range_constraint matching the class settings, name defaults to check_range_<db_table> '''
+        name = name or f'check_range_{cls._meta.db_table}'[:63]
+        return get_range_constraint(name, cls.start_attr, cls.end_attr, allow_zero_diff=cls.allow_zero_diff)
+
     def check_range(self):
-        start = self.cleaned_data.get(f'{self.start_attr}')
-        end = self.cleaned_data.get(f'{self.end_attr}')
+        start = getattr(self, self.start_attr, None)
+        end = getattr(self, self.end_attr, None)
+        if start is None or end is None:
+            return
         if self.allow_zero_diff:
             valid = end >= start
         else:
@@ -58,6 +141,115 @@ class CheckOverlapMixin(CheckRangeMixin):
     include_start_boundary = True
     clean_during_save = True
 
+    @classmethod
+    def get_exclusion_constraint(cls, name=None):
+        ''' Returns the get_overlap_constraint matching the class settings, name defaults to exclude_overlap_<db_table> '''
+        name = name or f'exclude_overlap_{cls._meta.db_table}'[:63]
+        return get_overlap_constraint(
+            name, cls.start_attr, cls.end_attr, cls._meta.get_field(cls.start_attr).get_internal_type(),
+            extra_filter_attrs=cls.extra_filter_attrs, include_start_boundary=cls.include_start_boundary,
+            include_end_boundary=cls.include_end_boundary,
+        )
+
+    @classmethod
+    def get_partition_key(cls, obj):
+        ''' Returns the values of the extra_filter_attrs of obj (FK ids rather than instances) '''
+        key = []
+        for fattr in cls.extra_filter_attrs:
+            try:
+                key.append(getattr(obj, cls._meta.get_field(fattr).attname))
+            except FieldDoesNotExist:
+                key.append(getattr(obj, fattr, None))
+        return tuple(key)
+
+    @classmethod
+    def ranges_overlap(cls, existing_start, existing_end, new_start, new_end):
+        ''' Applies the check_overlap conditions (with the boundary settings) to a pair of ranges '''
+        if cls.include_end_boundary:
+            cond1 = existing_end >= new_start
+        else:
+            cond1 = existing_end > new_start
+        if cls.include_start_boundary:
+            cond2 = existing_start <= new_end
+        else:
+            cond2 = existing_start < new_end
+        return cond1 and cond2
+
+    @classmethod
+    def get_bulk_overlaps(cls, objs):
+        """Finds overlaps among the (unsaved or changed) objs and between objs and the rows in the DB.
+            Objs are grouped by extra_filter_attrs, overlaps within a group are found with a sort and
+            sweep and the DB is checked with a single range query per group.
+
+        Args:
+            objs (iterable): instances of cls
+
+        Returns:
+            list: list of (obj, other) tuples where other is the instance (from objs or the DB) obj overlaps
+        """
+        slu = 'lte' if cls.include_start_boundary else 'lt'
+        elu = 'gte' if cls.include_end_boundary else 'gt'
+        partitions = {}
+        for obj in objs:
+            start, end = getattr(obj, cls.start_attr, None), getattr(obj, cls.end_attr, None)
+            if start is None or end is None:
+                continue
+            partitions.setdefault(cls.get_partition_key(obj), []).append((start, end, obj, False))
+        overlaps = []
+        for key, items in partitions.items():
+            fkwargs = {}
+            for fattr, value in zip(cls.extra_filter_attrs, key):
+                try:
+                    fkwargs[cls._meta.get_field(fattr).attname] = value
+                except FieldDoesNotExist:
+                    fkwargs[fattr] = value
+            fkwargs[f'{cls.end_attr}__{elu}'] = min(item[0] for item in items)
+            fkwargs[f'{cls.start_attr}__{slu}'] = max(item[1] for item in items)
+            pks = [item[2].pk for item in items if item[2].pk is not None]
+            existing = cls.objects.filter(**fkwargs).exclude(pk__in=pks)
+            items = items + [
+                (getattr(e, cls.start_attr), getattr(e, cls.end_attr), e, True) for e in existing
+            ]
+            # Sweep in start order keeping the ranges that can still overlap the current one (end >= its start).
+            # DB rows are always the "existing" side of ranges_overlap like in check_overlap, pairs of objs are
+            # checked in both orders (either could be saved second) and overlaps among DB rows are not reported
+            items.sort(key=lambda item: (item[0], item[3]))
+            active_objs, active_db = [], []
+            for i, item in enumerate(items):
+                start, end, obj, in_db = item
+                for active in [active_objs, active_db]:
+                    while active and active[0][0] < start:
+                        heapq.heappop(active)
+                for _, _, other in sorted(active_objs, key=lambda a: a[1]):
+                    if in_db:
+                        if cls.ranges_overlap(start, end, other[0], other[1]):
+                            overlaps.append((other[2], obj))
+                    elif cls.ranges_overlap(other[0], other[1], start, end) or cls.ranges_overlap(start, end, other[0], other[1]):
+                        overlaps.append((obj, other[2]))
+                if not in_db:
+                    for _, _, other in sorted(active_db, key=lambda a: a[1]):
+                        if cls.ranges_overlap(other[0], other[1], start, end):
+                            overlaps.append((obj, other[2]))
+                heapq.heappush(active_db if in_db else active_objs, (end, i, item))
+        return overlaps
+
+    @classmethod
+    def check_overlap_bulk(cls, objs):
+        ''' Raises a ValidationError if any of objs overlap each other or an existing instance '''
+        overlaps = cls.get_bulk_overlaps(objs)
+        if overlaps:
+            msg = f'{cls.__name__} cannot overlap another instance'
+            if cls.extra_filter_attrs != []:
+                msg = msg + f' with the same {cls.extra_filter_attrs}'
+            raise ValidationError([f'{msg} ({obj} overlaps {other})' for obj, other in overlaps])
+
+    @classmethod
+    def bulk_create_checked(cls, objs, **kwargs):
+        ''' Runs check_overlap_bulk on objs and then bulk creates them, kwargs are passed to bulk_create '''
+        objs = list(objs)
+        cls.check_overlap_bulk(objs)
+        return cls.objects.bulk_create(objs, **kwargs)
+
 
     def check_overlap(self):
         # Overlapping ranges will always meet BOTH of the following conditions
@@ -94,4 +286,54 @@ class CheckOverlapMixin(CheckRangeMixin):
     def save(self, *args, **kwargs):
         if self.clean_during_save:
             self.clean()
-        super().save(*args,**kwargs)
\ No newline at end of file
+        super().save(*args,**kwargs)
+
+
+RANGE_TYPES = {
+    # internal type: (postgres range function, django.contrib.postgres range field)
+    'DateTimeField': ('TSTZRANGE', 'DateTimeRangeField'),
+    'DateField': ('DATERANGE', 'DateRangeField'),
+    'IntegerField': ('INT4RANGE', 'IntegerRangeField'),
+    'BigIntegerField': ('INT8RANGE', 'BigIntegerRangeField'),
+    'DecimalField': ('NUMRANGE', 'DecimalRangeField'),
+}
+
+
+def get_range_constraint(name, start_attr, end_attr, allow_zero_diff=False):
+    """Returns a CheckConstraint enforcing the CheckRangeMixin rule (end_attr > start_attr, >= if allow_zero_diff) in the DB.
+        Declare it in Meta.constraints of the model, i.e.
+        constraints = [get_range_constraint('check_range_shift', 'start', 'end')]
+    """
+    lookup = 'gte' if allow_zero_diff else 'gt'
+    return models.CheckConstraint(
+        check=Q(**{f'{end_attr}__{lookup}': F(start_attr)}),
+        name=name, violation_error_message=f'{end_attr} must be larger than {start_attr}',
+    )
+
+
+def get_overlap_constraint(
+    name, start_attr, end_attr, field_type='DateTimeField', extra_filter_attrs=(), include_start_boundary=True,
+    include_end_boundary=True,
+):
+    """Returns a postgres ExclusionConstraint enforcing the CheckOverlapMixin rule in the DB. Declare it in
+        Meta.constraints of the model with the same settings as the class attributes, i.e.
+        constraints = [get_overlap_constraint('exclude_overlap_booking', 'start', 'end', include_end_boundary=False)]
+        Touching ranges only count as overlapping when both boundaries are included.
+        Requires the btree_gist extension when extra_filter_attrs is used
+        (add django.contrib.postgres.operations.BtreeGistExtension() to a migration).
+
+    Args:
+        field_type (str, optional): internal type of the start/end fields (a key of RANGE_TYPES). Defaults to DateTimeField
+    """
+    from django.contrib.postgres.constraints import ExclusionConstraint
+    from django.contrib.postgres.fields import ranges, RangeOperators
+    if field_type not in RANGE_TYPES:
+        raise ValueError(f'No postgres range type for {field_type}')
+    function, field_name = RANGE_TYPES[field_type]
+    range_expr = Func(
+        F(start_attr), F(end_attr), ranges.RangeBoundary(inclusive_upper=include_start_boundary and include_end_boundary),
+        function=function, output_field=getattr(ranges, field_name)(),
+    )
+    expressions = [(range_expr, RangeOperators.OVERLAPS)]
+    expressions += [(fattr, RangeOperators.EQUAL) for fattr in extra_filter_attrs]
+    return ExclusionConstraint(name=name, expressions=expressions)
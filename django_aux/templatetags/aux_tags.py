@@ -25,6 +25,11 @@ def render_class_name(obj):
     ''' A custom template tag that returns the object's class' name '''
     return obj.__class__.__name__
 
+@register.filter
+def render_verbose_name_plural(model):
+    ''' A custom template tag that returns a model's verbose_name_plural (_meta is not accessible in templates) '''
+    return model._meta.verbose_name_plural
+
 
 
 @register.filter(name='null_default')
@@ -1,9 +1,12 @@
 
-from django.db import connection, ProgrammingError
+from django.db import connection, transaction, ProgrammingError, InternalError
+from django.db.models import PROTECT, CASCADE, F, Func, Value, CharField, DateTimeField
+from django.db.models.deletion import get_candidate_relations_to_delete
 from django.conf import settings
 import string
 import random
 import logging
+from pandas import Series, factorize
 from pandas.core.dtypes.dtypes import DatetimeTZDtype
 from zoneinfo import ZoneInfo
 logger = logging.getLogger(__name__)
@@ -43,22 +46,211 @@ class PasswordUtils:
         return ''.join(random.sample(all, N))
 
 
-def df_tz_convert(df, timezone=None, format=True, format_str='%a %d %b %Y, %I:%M%p %Z'):
+def get_delete_dependents(obj, max_depth=5):
+    """Counts the rows that reference obj (and, following CASCADE relations, the rows that
+    reference those) without loading any of them into memory. Each relation costs one COUNT query.
+
+    Args:
+        obj (django.db.models.Model): The instance that is about to be deleted
+        max_depth (int, optional): How many CASCADE levels to follow. Defaults to 5.
+
+    Returns:
+        list: list of dicts with keys model, field, on_delete, depth and count. Only relations
+            with at least one dependent row are returned
+    """
+    dependents = []
+    root_qs = obj.__class__._base_manager.filter(pk=obj.pk)
+    stack = [(obj.__class__, root_qs, 1)]
+    while stack:
+        model, parent_qs, depth = stack.pop()
+        for rel in get_candidate_relations_to_delete(model._meta):
+            field = rel.field
+            related_qs = rel.related_model._base_manager.filter(**{
+                f'{field.attname}__in': parent_qs.values(field.target_field.attname)
+            })
+            count = related_qs.count()
+            if count == 0:
+                continue
+            dependents.append(dict(
+                model=rel.related_model, field=field.name, on_delete=rel.on_delete.__name__,
+                depth=depth, count=count,
+            ))
+            if rel.on_delete == CASCADE and depth < max_depth:
+                stack.append((rel.related_model, related_qs, depth + 1))
+    return dependents
+
+
+def get_protected_dependents(obj, max_depth=5):
+    """ Returns the subset of get_delete_dependents that would raise a ProtectedError on delete """
+    return [d for d in get_delete_dependents(obj, max_depth=max_depth) if d['on_delete'] == PROTECT.__name__]
+
+
+DEFAULT_DATETIME_FORMAT = '%a %d %b %Y, %I:%M%p %Z'
+
+# strftime directives that have an equivalent PostgreSQL to_char template pattern
+STRFTIME_TO_PG = {
+    '%a':'Dy', '%A':'FMDay', '%b':'Mon', '%B':'FMMonth', '%d':'DD', '%m':'MM', '%y':'YY', '%Y':'YYYY',
+    '%H':'HH24', '%I':'HH12', '%M':'MI', '%S':'SS', '%f':'US', '%p':'AM', '%j':'DDD',
+}
+
+
+def strftime_to_pg(format_str, timezone=None):
+    """Translates a python strftime format string into a PostgreSQL to_char template.
+        Literal text is double quoted. %Z is rendered as the timezone name since a
+        timestamp converted with AT TIME ZONE no longer carries its zone.
+
+    Args:
+        format_str (str): strftime format string i.e. '%a %d %b %Y, %I:%M%p %Z'
+        timezone (str, optional): Timezone name used for %Z. Defaults to settings.TIME_ZONE
+
+    Returns:
+        str: The to_char template
+    """
+    def quote(text):
+        return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+    timezone = timezone or getattr(settings, 'TIME_ZONE')
+    parts, literal, i = [], '', 0
+    while i < len(format_str):
+        token = format_str[i:i+2]
+        if token[0] != '%':
+            literal += token[0]
+            i += 1
+            continue
+        if token == '%%':
+            literal += '%'
+        elif token == '%Z':
+            literal += timezone
+        elif token in STRFTIME_TO_PG:
+            if literal:
+                parts.append(quote(literal))
+                literal = ''
+            parts.append(STRFTIME_TO_PG[token])
+        else:
+            raise ValueError(f'{token} has no PostgreSQL to_char equivalent')
+        i += 2
+    if literal:
+        parts.append(quote(literal))
+    return ''.join(parts)
+
+
+def db_tz_convert(field, timezone=None):
+    """Returns a query expression that converts a tz-aware datetime field to a naive
+        local timestamp in the database (timestamp AT TIME ZONE timezone)
+
+    Args:
+        field (str|Expression): field name or expression to convert
+        timezone (str, optional): Target timezone. Defaults to settings.TIME_ZONE
+    """
+    timezone = timezone or getattr(settings, 'TIME_ZONE')
+    field = F(field) if isinstance(field, str) else field
+    return Func(Value(timezone), field, function='timezone', output_field=DateTimeField())
+
+
+def db_tz_format(field, timezone=None, format_str=DEFAULT_DATETIME_FORMAT):
+    """Returns a query expression that converts a tz-aware datetime field to the timezone
+        and formats it with to_char in the database (see strftime_to_pg for supported directives)
+
+    Args:
+        field (str|Expression): field name or expression to format
+        timezone (str, optional): Target timezone. Defaults to settings.TIME_ZONE
+        format_str (str, optional): strftime format string. Defaults to DEFAULT_DATETIME_FORMAT
+    """
+    pg_format = strftime_to_pg(format_str, timezone=timezone)
+    return Func(
+        db_tz_convert(field, timezone=timezone), Value(pg_format), function='to_char', output_field=CharField()
+    )
+
+
+def strftime_cached(ser, format_str=DEFAULT_DATETIME_FORMAT):
+    """Vectorized strftime that formats each unique timestamp in the series only once.
+        Null values are returned as NaN (same as Series.dt.strftime)
+
+    Args:
+        ser (pd.Series): datetime series
+        format_str (str, optional): strftime format string. Defaults to DEFAULT_DATETIME_FORMAT
+    """
+    codes, uniques = factorize(ser)
+    formatted = Series(uniques.strftime(format_str), dtype=object)
+    return Series(formatted.reindex(codes).to_numpy(), index=ser.index, name=ser.name)
+
+
+def df_tz_convert(df, timezone=None, format=True, format_str=DEFAULT_DATETIME_FORMAT, method='python', col_methods=None):
+    """Converts the tz-aware datetime columns of a DataFrame to timezone and optionally string formats them.
+        Columns that were converted in the database (see db_tz_convert/db_tz_format) are no longer
+        tz-aware and are left untouched.
+
+    Args:
+        df (pd.DataFrame): The DataFrame to convert
+        timezone (str, optional): Target timezone. Defaults to settings.TIME_ZONE
+        format (bool, optional): Whether to string format the columns. Defaults to True
+        format_str (str, optional): strftime format string. Defaults to DEFAULT_DATETIME_FORMAT
+        method (str, optional): 'python' formats every value with Series.dt.strftime,
+            'cached' formats each unique timestamp once (see strftime_cached). Defaults to 'python'
+        col_methods (dict, optional): Per column override of method. A value of None leaves the column as is
+    """
     timezone = timezone or getattr(settings, 'TIME_ZONE')
     if not timezone:
         return df
+    col_methods = col_methods or {}
     tz_obj = ZoneInfo(timezone)
     dtg_cols = df.dtypes[df.dtypes.map(lambda val: isinstance(val, DatetimeTZDtype))].index
     for col in dtg_cols: 
+        col_method = col_methods.get(col, method)
+        if col_method == None:
+            continue
         df[col] = df[col].dt.tz_convert(tz_obj)
-        if format:
+        if format and col_method == 'cached':
+            df[col] = strftime_cached(df[col], format_str)
+        elif format:
             df[col] = df[col].dt.strftime(format_str)
     return df
 
 
 
 
-def create_view_from_qs(qs, view_name, materialized=True, ufields=None, owner='postgres', sql_permissions='', read_only_users=None,):
+def get_relkind(name):
+    """ Returns the pg_class relkind of the relation name ('r' table, 'v' view, 'm' materialized view, 'i' index) or None """
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT relkind FROM pg_class WHERE relname = %s AND pg_table_is_visible(oid)", [name])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def drop_view(view_name):
+    """ Drops the view or materialized view view_name if it exists.
+    Returns False if it could not be dropped (i.e. other views depend on it) """
+    vstr = {'v':'VIEW', 'm':'MATERIALIZED VIEW'}.get(get_relkind(view_name))
+    if not vstr:
+        return True
+    try:
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(f''' DROP {vstr} "{view_name}" ''')
+    except (ProgrammingError, InternalError) as e:
+        logger.warning(f'Could not drop {view_name}: {e}')
+        return False
+    return True
+
+
+def get_dependent_views(name):
+    """ Returns the names of the views and materialized views that depend on the relation name (through pg_depend) """
+    with connection.cursor() as cursor:
+        cursor.execute('''
+            SELECT DISTINCT dependent.relname
+            FROM pg_depend d
+            JOIN pg_rewrite r ON d.objid = r.oid
+            JOIN pg_class dependent ON r.ev_class = dependent.oid
+            JOIN pg_class source ON d.refobjid = source.oid
+            WHERE source.relname = %s AND pg_table_is_visible(source.oid) AND dependent.oid != source.oid
+            ORDER BY dependent.relname
+        ''', [name])
+        return [row[0] for row in cursor.fetchall()]
+
+
+def create_view_from_qs(
+    qs, view_name, materialized=True, ufields=None, owner='postgres', sql_permissions='', read_only_users=None, swap=False,
+    drop_dependents=None,
+):
     """Utility function to create a DB view from a django queryset.
     Args:
         qs (django.db.QuerySet): The queryset to be translated into a view
@@ -68,30 +260,39 @@ def create_view_from_qs(qs, view_name, materialized=True, ufields=None, owner='p
         sql_permissions (str, optional): SQL to be executed after the view is created,
             intended for setting permissions but could be any raw SQL.
             i.e. ALTER TABLE public.{view_name} OWNER TO postgres;
-        read_only_users (list, optional): List of usernames to grant read-only permisions to. 
+        read_only_users (list, optional): List of usernames to grant read-only permisions to.
             these will be added to the sql_permissions paramter. defaults to []
-    """    
+        swap (bool, optional): If True the view, its unique index and grants are built under a temporary
+            name and swapped in by renames in a single transaction so readers never see a missing or
+            empty view. The old view is dropped in the same transaction. Raises a ValueError if other views
+            (not in drop_dependents) depend on the live view (the renames would leave them reading the old one).
+            defaults to False
+        drop_dependents (list, optional): views (dependents first) dropped in the swap transaction so the live view
+            can be swapped, the caller recreates them (in the same outer transaction, see ViewRegistry.create)
+    """
     if not materialized and ufields:
         raise AssertionError("Unique indexes only allowed on materialized views")
+    drop_dependents = list(drop_dependents or [])
+    if swap:
+        dependents = [name for name in get_dependent_views(view_name) if name not in drop_dependents]
+        if dependents:
+            raise ValueError(f'Cannot swap {view_name}, these views depend on it: {", ".join(dependents)}')
     if not read_only_users:
         read_only_users = []
+    # In swap mode everything is built under build_name and renamed at the end
+    build_name = f'{view_name}_swap' if swap else view_name
+    backup_name = f'{view_name}_backup'
     qstr, params = qs.query.sql_with_params()
     vstr = 'MATERIALIZED VIEW' if materialized else 'VIEW'
-    drop_qstr1 = f''' DROP VIEW IF EXISTS "{view_name}" '''
-    drop_qstr2 = f''' DROP MATERIALIZED VIEW IF EXISTS "{view_name}" '''
-    qstr = f''' CREATE {vstr} "{view_name}" AS {qstr} '''
+    qstr = f''' CREATE {vstr} "{build_name}" AS {qstr} '''
     index_qstr = None
     if ufields:
-        index_name = f'unique_{view_name}'
+        index_name = f'unique_{build_name}'
         index_drop = f"DROP INDEX IF EXISTS {index_name}"
-        index_qstr = f"CREATE UNIQUE INDEX {index_name} ON {view_name} ({', '.join(ufields)})"
+        index_qstr = f"CREATE UNIQUE INDEX {index_name} ON {build_name} ({', '.join(ufields)})"
+    # Drop existing view (materialized or regular) with the name build_name
+    drop_view(build_name)
     with connection.cursor() as cursor:
-        # Drop existing view (materialized or regular) with the name view_name
-        for dstr in [drop_qstr1, drop_qstr2]:
-            try:
-                cursor.execute(dstr)
-            except ProgrammingError:
-                pass
         # main view creation
         cursor.execute(qstr, params)
         # unique index creation
@@ -100,15 +301,39 @@ def create_view_from_qs(qs, view_name, materialized=True, ufields=None, owner='p
             cursor.execute(index_qstr)
 
     std_perms = f'''
-        ALTER TABLE public.{view_name} OWNER TO {owner};
-        GRANT ALL ON TABLE public.{view_name} TO {owner};
+        ALTER TABLE public.{build_name} OWNER TO {owner};
+        GRANT ALL ON TABLE public.{build_name} TO {owner};
     '''
+    for ruser in read_only_users:
+        std_perms += f''' GRANT SELECT ON TABLE public.{build_name} TO {ruser}; '''
     with connection.cursor() as cursor:
         cursor.execute(std_perms)
 
-    for ruser in read_only_users:
-        sql_permissions += f''' GRANT SELECT ON TABLE public.{view_name} TO {ruser}; '''  
-
-    if sql_permissions:
+    if swap:
+        vstrs = {'v':'VIEW', 'm':'MATERIALIZED VIEW'}
+        live_vstr = vstrs.get(get_relkind(view_name))
+        live_index = get_relkind(f'unique_{view_name}') == 'i'
+        stale_vstr = vstrs.get(get_relkind(backup_name))
+        # Any failure rolls back every statement, the live view (and a leftover backup) are only dropped
+        # once the new view is in place
+        with transaction.atomic(), connection.cursor() as cursor:
+            if stale_vstr:
+                cursor.execute(f''' DROP {stale_vstr} "{backup_name}" ''')
+            for name in drop_dependents:
+                dependent_vstr = vstrs.get(get_relkind(name))
+                if dependent_vstr:
+                    cursor.execute(f''' DROP {dependent_vstr} "{name}" ''')
+            if live_vstr:
+                cursor.execute(f''' ALTER {live_vstr} "{view_name}" RENAME TO "{backup_name}" ''')
+            if live_index:
+                cursor.execute(f''' ALTER INDEX "unique_{view_name}" RENAME TO "unique_{backup_name}" ''')
+            cursor.execute(f''' ALTER {vstr} "{build_name}" RENAME TO "{view_name}" ''')
+            if index_qstr:
+                cursor.execute(f''' ALTER INDEX "unique_{build_name}" RENAME TO "unique_{view_name}" ''')
+            if sql_permissions:
+                cursor.execute(sql_permissions)
+            if live_vstr:
+                cursor.execute(f''' DROP {live_vstr} "{backup_name}" ''')
+    elif sql_permissions:
         with connection.cursor() as cursor:
             cursor.execute(sql_permissions)
@@ -1,23 +1,28 @@
 from django_tables2 import SingleTableMixin
 from django.shortcuts import redirect
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, QueryDict
+from django.db import transaction
 from django.urls import reverse_lazy, reverse
 from django.db.models import Q, ProtectedError
 from pandas import isna, DataFrame as DF, to_datetime
 import inspect
 from django.contrib import messages
-from django.db.models import F, Count
+from django.db.models import F, Count, Sum
 from django_filters.views import FilterView
 from django_pandas.io import read_frame
 from django.contrib.auth.mixins import UserPassesTestMixin
 import plotly.express as px
 from plotly import offline
 from django.views.generic import DeleteView
+from django_aux.utils import get_protected_dependents
 
 
 class DeleteProtectedView(DeleteView):
     ''' Subclass of django.views.genderic.DeleteView that handles 
-    the attempted deltion of Protected FKs '''
+    the attempted deltion of Protected FKs. Protected relations are counted up front
+    (see django_aux.utils.get_delete_dependents) so the delete is never attempted when it would fail '''
+    preflight_protected = True # If False the delete is attempted and ProtectedError is caught instead
+    preflight_max_depth = 5 # How many CASCADE levels to follow when looking for protected rows
 
     def get_onclick_cancel_action(self, href=None):
         if href == None:
@@ -27,26 +32,147 @@ class DeleteProtectedView(DeleteView):
         else:
             return "history.back()"
 
+    def get_protected_dependents(self):
+        ''' Returns (and caches) the protected relations of self.object that have dependent rows '''
+        if not self.preflight_protected:
+            return []
+        if not hasattr(self, '_protected_dependents'):
+            self._protected_dependents = get_protected_dependents(self.object, max_depth=self.preflight_max_depth)
+        return self._protected_dependents
+
+    def get_protected_summary(self):
+        ''' Returns a summary string of the protected dependents i.e. "blocked by 12,400 sales" '''
+        dependents = self.get_protected_dependents()
+        if not dependents:
+            return ''
+        parts = [f"{d['count']:,} {d['model']._meta.verbose_name_plural}" for d in dependents]
+        return 'blocked by ' + ', '.join(parts)
+
     def get_protected_error_msg(self):
         ''' Returns the error message to be displayed  '''
-        obj = self.get_object()
-        return f"{obj} is associted with exisiting data and cannot be deleted"
+        msg = f"{self.object} is associted with exisiting data and cannot be deleted"
+        summary = self.get_protected_summary()
+        return f"{msg} ({summary})" if summary else msg
+
+    def protected_response(self, request):
+        ''' Adds the protected error message and redirects back to the referring page '''
+        messages.error(request, self.get_protected_error_msg())
+        http_referer = request.META.get('HTTP_REFERER')
+        if http_referer:
+            return HttpResponseRedirect(http_referer)
+        else:
+            return HttpResponseRedirect(self.get_success_url())
 
     def post(self, request, *args, **kwargs):
+        self.object = self.get_object()
+        if self.get_protected_dependents():
+            return self.protected_response(request)
         #Try super but catch ProtectedError
         try:
             return super().post(request, *args, **kwargs)
         except ProtectedError:
-            messages.error(request, self.get_protected_error_msg())
-            http_referer = request.META.get('HTTP_REFERER')
-            if http_referer:
-                return HttpResponseRedirect(http_referer)
-            else:
-                return self.get_success_url()
+            return self.protected_response(request)
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['onclick_cancel_action'] = self.get_onclick_cancel_action()
+        context['protected_dependents'] = self.get_protected_dependents()
+        context['protected_summary'] = self.get_protected_summary()
+        return context
+
+
+class BulkActionMixin:
+    ''' Mixin for FilterView lookups rendered with django_aux/form-table.html. The declared bulk_actions are
+    rendered as submit buttons and run as set based update()/delete() calls (in a transaction, in chunks)
+    on either the checked rows or, when the "apply to all" box is ticked, the whole filtered queryset.
+    bulk_actions = {
+        'make_misc': {'display':'Change Category to Misc', 'update':{'category':'misc'}},
+        'delete': {'display':'Delete', 'delete':True},
+        'recalc': {'display':'Recalculate', 'func':lambda qs: qs.count()}, # func returns the count
+    }
+    Update actions skip the rows that already have the values (so no history is written for them),
+    set 'skip_unchanged':False on the action to update every row '''
+    bulk_actions = {}
+    checkbox_col_name = 'checked_id'
+    bulk_all_name = 'bulk_all'
+    bulk_chunk_size = 5000
+    bulk_success_msg = '{count:,} {verbose_name} {verb}'
+
+    def get_bulk_actions(self):
+        return self.bulk_actions
+
+    def get_submit_buttons(self):
+        return [{'name':name, 'display':action.get('display', name)} for name, action in self.get_bulk_actions().items()]
+
+    def get_bulk_filter_data(self):
+        ''' Returns the filter data of the lookup (the query string or the one saved by SaveFilterMixin) '''
+        if self.request.GET:
+            return self.request.GET
+        qstr = self.request.session.get(f'{self.__class__.__name__}_qstr')
+        return QueryDict(qstr) if qstr else None
+
+    def get_bulk_queryset(self):
+        ''' Returns the queryset of the checked rows or the whole filtered queryset '''
+        if self.request.POST.get(self.bulk_all_name):
+            filterset_class = self.get_filterset_class()
+            kwargs = self.get_filterset_kwargs(filterset_class)
+            kwargs['data'] = self.get_bulk_filter_data()
+            filterset = filterset_class(**kwargs)
+            if not filterset.is_bound or filterset.is_valid() or not self.get_strict():
+                return filterset.qs
+            return filterset.queryset.none()
+        return self.get_queryset().filter(pk__in=self.request.POST.getlist(self.checkbox_col_name))
+
+    def run_bulk_action(self, action, qs):
+        ''' Runs the action on qs in chunks of bulk_chunk_size inside a transaction, returns the number of rows affected '''
+        if 'func' in action:
+            with transaction.atomic():
+                return action['func'](qs)
+        model = qs.model
+        if 'update' in action and action.get('skip_unchanged', True):
+            qs = qs.exclude(**action['update'])
+        pks = list(qs.order_by().values_list('pk', flat=True))
+        count = 0
+        with transaction.atomic():
+            for i in range(0, len(pks), self.bulk_chunk_size):
+                chunk_qs = model._default_manager.filter(pk__in=pks[i:i + self.bulk_chunk_size])
+                if action.get('delete'):
+                    count += chunk_qs.delete()[1].get(model._meta.label, 0)
+                elif hasattr(chunk_qs, 'update_with_history'):
+                    count += chunk_qs.update_with_history(**action['update'])
+                else:
+                    count += chunk_qs.update(**action['update'])
+        return count
+
+    def get_bulk_success_msg(self, action, qs, count):
+        verb = action.get('verb', 'deleted' if action.get('delete') else 'updated')
+        opts = qs.model._meta
+        return self.bulk_success_msg.format(
+            count=count, verbose_name=opts.verbose_name if count == 1 else opts.verbose_name_plural, verb=verb,
+        )
+
+    def get_bulk_success_url(self):
+        return self.request.get_full_path()
+
+    def post(self, request, *args, **kwargs):
+        actions = self.get_bulk_actions()
+        name = next((name for name in actions if name in request.POST), None)
+        if name is not None:
+            action = actions[name]
+            qs = self.get_bulk_queryset()
+            try:
+                count = self.run_bulk_action(action, qs)
+            except ProtectedError:
+                messages.error(request, f"{action.get('display', name)} failed, some of the {qs.model._meta.verbose_name_plural} are associated with existing data")
+            else:
+                messages.success(request, self.get_bulk_success_msg(action, qs, count))
+        return HttpResponseRedirect(self.get_bulk_success_url())
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        context['checkbox_col_name'] = self.checkbox_col_name
+        context['submit_buttons'] = self.get_submit_buttons()
+        context['bulk_all_name'] = self.bulk_all_name
         return context
 
 
@@ -390,9 +516,16 @@ class PlotlyMixin:
         """          
         agg_func = self.yd.get('agg_expr')
         akwargs = {f'{self.y}':agg_func}
-        akwargs['N'] = Count('id', distinct=True)
+        akwargs['N'] = self.get_n_expr()
         return akwargs 
 
+    def get_n_expr(self):
+        ''' Returns the expression of the sample size N, rollup models (see django_aux_timeperiods.rollups) sum their count field '''
+        count_field = getattr(self.object_list.model, 'rollup_count_field', None)
+        if count_field:
+            return Sum(count_field)
+        return Count('id', distinct=True)
+
     def get_grouped_qs(self):
         """Method generates and returns the grouped/aggregated queryset to be used in the plot
 
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DjangoAuxGeoConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'django_aux_geo'
+
+    def ready(self):
+        # connects the signal handlers that invalidate the geo_cache
+        from django_aux_geo import cache
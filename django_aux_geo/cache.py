@@ -0,0 +1,181 @@
+import threading
+
+import pandas as pd
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from django_aux_geo.models import Country, Subdivision
+
+
+def normalize(value):
+    ''' Returns the case-insensitive lookup key of a code or name (ints for numeric codes) '''
+    if value is None:
+        return None
+    if isinstance(value, int):
+        return value
+    value = str(value).strip()
+    if value.isdigit():
+        return int(value)
+    return value.casefold()
+
+
+class GeoIndex:
+    """ One loaded snapshot of the Countries and Subdivisions. It is built completely before GeoCache publishes it
+        and never changes afterwards (except for the lazily filled choices), so readers holding it see consistent dicts
+    """
+
+    def __init__(self, countries, subdivisions):
+        self.countries = {} # id: Country
+        self.country_keys = {} # normalized alpha2/alpha3/num/name: id
+        self.subdivisions = {} # id: Subdivision
+        self.subdivision_keys = {} # normalized iso_code: id
+        self.subdivision_country_keys = {} # (country id, normalized code without prefix or name): id
+        self.choices = {}
+        for country in countries:
+            self.countries[country.id] = country
+            # codes take precedence over names
+            for value in [country.name, country.num, country.alpha3, country.alpha2]:
+                if value is not None:
+                    self.country_keys[normalize(value)] = country.id
+        for sub in subdivisions:
+            self.subdivisions[sub.id] = sub
+            for value in [sub.name, sub.iso_code.split('-', 1)[-1]]:
+                self.subdivision_country_keys[(sub.country_id, normalize(value))] = sub.id
+            self.subdivision_keys[normalize(sub.iso_code)] = sub.id
+
+    def get_country_id(self, value):
+        if isinstance(value, Country):
+            return value.id
+        return self.country_keys.get(normalize(value))
+
+    def get_subdivision_id(self, value, country=None):
+        key = normalize(value)
+        sub_id = self.subdivision_keys.get(key)
+        if sub_id is None and country is not None:
+            sub_id = self.subdivision_country_keys.get((self.get_country_id(country), key))
+        return sub_id
+
+
+class GeoCache:
+    """ Process wide index of the Countries and Subdivisions. The (tiny, nearly immutable) tables are loaded
+        once with a query each, countries can then be resolved by alpha2, alpha3, numeric code or name and
+        subdivisions by iso_code (or code/name within a country) case-insensitively without touching the DB.
+        Saves and deletes clear it (bulk operations do not send signals, call clear() after them).
+        Loads build a new GeoIndex and swap it in with one assignment, every lookup reads a single snapshot.
+        Use the module level geo_cache instance. The cached instances are shared, do not modify them
+    """
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.index = None
+
+    @property
+    def loaded(self):
+        return self.index is not None
+
+    def clear(self):
+        ''' Empties the cache, it is reloaded on the next lookup '''
+        self.index = None
+
+    def load(self):
+        ''' (Re)loads the index, one query per model '''
+        with self.lock:
+            index = GeoIndex(Country.objects.order_by('name'), Subdivision.objects.order_by('name'))
+            self.index = index
+            return index
+
+    def get_index(self):
+        ''' Returns the current GeoIndex, loading it if needed '''
+        index = self.index
+        if index is None:
+            with self.lock:
+                index = self.index or self.load()
+        return index
+
+    def ensure_loaded(self):
+        self.get_index()
+
+    def get_country_id(self, value):
+        ''' Returns the id of the Country with value as alpha2, alpha3, numeric code or name (None if not found) '''
+        return self.get_index().get_country_id(value)
+
+    def get_country(self, value):
+        ''' Returns the Country with value as alpha2, alpha3, numeric code or name (None if not found) '''
+        index = self.get_index()
+        return index.countries.get(index.get_country_id(value))
+
+    def get_country_by_id(self, pk):
+        return self.get_index().countries.get(pk)
+
+    def get_subdivision_by_id(self, pk):
+        return self.get_index().subdivisions.get(pk)
+
+    def get_subdivision_id(self, value, country=None):
+        """Returns the id of the Subdivision matching value (None if not found)
+
+        Args:
+            value (str): the iso_code (i.e. US-VA), or with country the code without the country prefix (VA) or the name
+            country (optional): the Country (or any value get_country_id accepts)
+        """
+        return self.get_index().get_subdivision_id(value, country=country)
+
+    def get_subdivision(self, value, country=None):
+        ''' Returns the Subdivision matching value (None if not found), see get_subdivision_id '''
+        index = self.get_index()
+        return index.subdivisions.get(index.get_subdivision_id(value, country=country))
+
+    def map_country_ids(self, ser):
+        ''' Returns the Country ids (Int64, missing where not found) of a Series of codes/names '''
+        index = self.get_index()
+        uniques = pd.unique(ser.dropna())
+        mapping = {value:index.get_country_id(value) for value in uniques}
+        return ser.map(mapping).astype('Int64')
+
+    def map_subdivision_ids(self, ser, countries=None):
+        ''' Returns the Subdivision ids (Int64, missing where not found) of a Series of codes/names
+            (and optionally a Series of the matching countries) '''
+        index = self.get_index()
+        if countries is None:
+            countries = pd.Series([None] * len(ser), index=ser.index)
+        pairs = pd.DataFrame({'value':ser, 'country':countries})
+        mapping = {
+            (value, country):index.get_subdivision_id(value, country=country)
+            for value, country in pairs.dropna(subset=['value']).drop_duplicates().itertuples(index=False)
+        }
+        ids = [mapping.get((value, country)) for value, country in pairs.itertuples(index=False)]
+        return pd.Series(ids, index=ser.index, dtype='Int64')
+
+    def get_country_choices(self, value_attr='id', label_attr='name'):
+        ''' Returns the (precomputed) list of (value, label) choices of the countries sorted by name '''
+        index = self.get_index()
+        key = ('country', value_attr, label_attr)
+        if key not in index.choices:
+            index.choices[key] = [
+                (getattr(c, value_attr), getattr(c, label_attr)) for c in index.countries.values()
+                if getattr(c, value_attr) is not None
+            ]
+        return index.choices[key]
+
+    def get_subdivision_choices(self, country=None, value_attr='id', label_attr='name'):
+        ''' Returns the (precomputed) list of (value, label) choices of the subdivisions (of country) sorted by name '''
+        index = self.get_index()
+        country_id = index.get_country_id(country) if country is not None else None
+        key = ('subdivision', country_id, value_attr, label_attr)
+        if key not in index.choices:
+            index.choices[key] = [
+                (getattr(s, value_attr), getattr(s, label_attr)) for s in index.subdivisions.values()
+                if country_id is None or s.country_id == country_id
+            ]
+        return index.choices[key]
+
+
+geo_cache = GeoCache()
+
+
+@receiver(post_save, sender=Country)
+@receiver(post_save, sender=Subdivision)
+@receiver(post_delete, sender=Country)
+@receiver(post_delete, sender=Subdivision)
+def clear_geo_cache(sender, **kwargs):
+    ''' Any change to the reference data invalidates the cache '''
+    geo_cache.clear()
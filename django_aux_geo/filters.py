@@ -1,10 +1,16 @@
+import django_filters as filters
 from django_aux.filters import FilterSetBase, MetaBase
 from crispy_forms.layout import Layout, Fieldset, Row, Div
 
 from .models import Country, Subdivision, Address
+from .cache import geo_cache
 
 
 class CountryFilter(FilterSetBase):
+    # choices are callables so they are read from the geo_cache when the form is built
+    alpha2 = filters.ChoiceFilter(choices=lambda: geo_cache.get_country_choices('alpha2', 'alpha2'))
+    alpha3 = filters.ChoiceFilter(choices=lambda: geo_cache.get_country_choices('alpha3', 'alpha3'))
+
     class Meta(MetaBase):
         model = Country
         fields = {
@@ -23,6 +29,33 @@ class CountryFilter(FilterSetBase):
                     Div('name__icontains', css_class='ml-2 col-flex'),
                 ),
             ),
-        ) 
+        )
+
+
+class AddressFilter(FilterSetBase):
+    q = filters.CharFilter(method='filter_search', label='Search')
+    country = filters.ChoiceFilter(field_name='country_id', choices=lambda: geo_cache.get_country_choices())
+
+    class Meta(MetaBase):
+        model = Address
+        fields = {
+            'city': ['icontains'],
+            'postal_code': ['istartswith'],
+        }
 
+    def filter_search(self, queryset, name, value):
+        ''' Full text search of the addresses (ranked, best first), see AddressQuerySet.search '''
+        return queryset.search(value, prefix=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.form.helper.layout = Layout(
+            Fieldset('',
+                Row(
+                    Div('q', css_class='ml-2 col-flex'),
+                    Div('country', css_class='ml-2 col-flex'),
+                    Div('city__icontains', css_class='ml-2 col-flex'),
+                    Div('postal_code__istartswith', css_class='ml-2 col-flex'),
+                ),
+            ),
+        )
@@ -0,0 +1,49 @@
+import re
+import hashlib
+
+# USPS style abbreviations of the common street words
+ABBREVIATIONS = {
+    'street':'st', 'avenue':'ave', 'av':'ave', 'road':'rd', 'boulevard':'blvd', 'drive':'dr', 'lane':'ln',
+    'court':'ct', 'place':'pl', 'parkway':'pkwy', 'highway':'hwy', 'terrace':'ter', 'circle':'cir',
+    'square':'sq', 'trail':'trl', 'way':'wy', 'suite':'ste', 'apartment':'apt', 'building':'bldg',
+    'floor':'fl', 'room':'rm', 'unit':'unit', 'number':'no', 'north':'n', 'south':'s', 'east':'e',
+    'west':'w', 'northeast':'ne', 'northwest':'nw', 'southeast':'se', 'southwest':'sw',
+    'saint':'st', 'mount':'mt', 'fort':'ft', 'post office box':'po box', 'p o box':'po box',
+}
+ABBREVIATION_RE = re.compile(r'\b(' + '|'.join(sorted(map(re.escape, ABBREVIATIONS), key=len, reverse=True)) + r')\b')
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_part(value, abbreviate=True):
+    ''' Returns the case, punctuation, whitespace (and optionally abbreviation) normalized form of an address part '''
+    if value is None or value != value: # None or NaN
+        return ''
+    value = PUNCTUATION_RE.sub(' ', str(value).casefold())
+    value = WHITESPACE_RE.sub(' ', value).strip()
+    if abbreviate:
+        value = ABBREVIATION_RE.sub(lambda m: ABBREVIATIONS[m.group(1)], value)
+    return value
+
+
+def normalize_postal_code(value):
+    ''' Returns the postal code without case, whitespace and punctuation (i.e. "sw1a 1aa" -> "SW1A1AA") '''
+    return re.sub(r'[^0-9A-Z]', '', normalize_part(value, abbreviate=False).upper())
+
+
+def get_fingerprint(street1=None, street2=None, street3=None, city=None, postal_code=None, country=None):
+    """Returns the fingerprint (sha1 hex digest) of the normalized street, city, postal code and country of an address.
+        Addresses that only differ in case, whitespace, punctuation or street abbreviations share a fingerprint
+
+    Args:
+        country (str, optional): the country's alpha3 code
+
+    Returns:
+        str: the fingerprint, None when there is no street, city or postal code (nothing to identify the address by)
+    """
+    street = ' '.join(part for part in [normalize_part(street1), normalize_part(street2), normalize_part(street3)] if part)
+    parts = [street, normalize_part(city), normalize_postal_code(postal_code)]
+    if not any(parts):
+        return None
+    key = '|'.join(parts + [normalize_part(country, abbreviate=False)])
+    return hashlib.sha1(key.encode()).hexdigest()
@@ -0,0 +1,78 @@
+import math
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+EARTH_RADIUS_KM = 6371.0088 # mean earth radius
+MAX_PRECISION = 12
+
+
+def encode(latitude, longitude, precision=MAX_PRECISION):
+    ''' Returns the geohash of a point (nearby points share a prefix, a longer prefix is a smaller cell) '''
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            value = value * 2 + (longitude >= mid)
+            lon_lo, lon_hi = (mid, lon_hi) if longitude >= mid else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            value = value * 2 + (latitude >= mid)
+            lat_lo, lat_hi = (mid, lat_hi) if latitude >= mid else (lat_lo, mid)
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def get_cell_size(precision):
+    ''' Returns the (height, width) in degrees of the cells of a precision '''
+    lon_bits = math.ceil(precision * 5 / 2)
+    lat_bits = precision * 5 - lon_bits
+    return 180 / 2 ** lat_bits, 360 / 2 ** lon_bits
+
+
+def get_covering_cells(south, west, north, east, max_cells=32):
+    """Returns the geohash prefixes of the cells covering a bounding box, at the highest precision needing
+        at most max_cells cells. A box crossing the antimeridian has west > east
+
+    Returns:
+        list: the prefixes (an empty list when the box is too large to prune, i.e. the whole world)
+    """
+    if west > east:
+        west_cells = get_covering_cells(south, west, north, 180, max_cells=max_cells // 2)
+        east_cells = get_covering_cells(south, -180, north, east, max_cells=max_cells // 2)
+        return sorted(set(west_cells + east_cells)) if west_cells and east_cells else []
+    for precision in range(MAX_PRECISION, 0, -1):
+        height, width = get_cell_size(precision)
+        rows = math.floor((north + 90) / height) - math.floor((south + 90) / height) + 1
+        cols = math.floor((east + 180) / width) - math.floor((west + 180) / width) + 1
+        if rows * cols > max_cells:
+            continue
+        cells = set()
+        for row in range(rows):
+            lat = min((math.floor((south + 90) / height) + row + 0.5) * height - 90, 90)
+            for col in range(cols):
+                lon = min((math.floor((west + 180) / width) + col + 0.5) * width - 180, 180)
+                cells.add(encode(lat, lon, precision))
+        return sorted(cells)
+    return []
+
+
+def get_radius_bbox(latitude, longitude, km):
+    ''' Returns the (south, west, north, east) bounding box of the circle of radius km around a point '''
+    latitude, longitude = float(latitude), float(longitude)
+    dlat = math.degrees(km / EARTH_RADIUS_KM)
+    south, north = latitude - dlat, latitude + dlat
+    if south <= -90 or north >= 90 or dlat >= 90:
+        # the circle contains a pole, every longitude is in range
+        return max(south, -90), -180, min(north, 90), 180
+    dlon = math.degrees(math.asin(min(math.sin(km / EARTH_RADIUS_KM) / math.cos(math.radians(latitude)), 1)))
+    west, east = longitude - dlon, longitude + dlon
+    if dlon >= 180 or east - west >= 360:
+        return south, -180, north, 180
+    west = west + 360 if west < -180 else west
+    east = east - 360 if east > 180 else east
+    return south, west, north, east
@@ -0,0 +1,118 @@
+from decimal import Decimal
+
+import pandas as pd
+from django.db import transaction
+
+from django_aux_geo import geohash
+from django_aux_geo.cache import geo_cache
+from django_aux_geo.fingerprint import get_fingerprint
+from django_aux_geo.models import Address, Coordinate
+
+ADDRESS_COLUMNS = ['name', 'attn', 'street1', 'street2', 'street3', 'city', 'postal_code']
+COORDINATE_PLACES = Decimal('0.000001')
+
+
+def iter_batches(data, batch_size):
+    ''' Yields DataFrames of at most batch_size rows of a DataFrame or of an iterable of dicts '''
+    if isinstance(data, pd.DataFrame):
+        for start in range(0, len(data), batch_size):
+            yield data.iloc[start:start + batch_size]
+        return
+    batch, offset = [], 0
+    for row in data:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            yield pd.DataFrame(batch, index=range(offset, offset + len(batch)))
+            offset += len(batch)
+            batch = []
+    if batch:
+        yield pd.DataFrame(batch, index=range(offset, offset + len(batch)))
+
+
+def get_coordinate_ids(points):
+    """Returns the ids of the Coordinates of (latitude, longitude) points, the missing ones are created with a
+        single bulk insert and all are read back with a single (geohash indexed) query
+
+    Returns:
+        dict: {(Decimal latitude, Decimal longitude): id}
+    """
+    points = {(Decimal(str(lat)).quantize(COORDINATE_PLACES), Decimal(str(lon)).quantize(COORDINATE_PLACES)) for lat, lon in points}
+    if not points:
+        return {}
+    Coordinate.objects.bulk_create([Coordinate(latitude=lat, longitude=lon) for lat, lon in points], ignore_conflicts=True)
+    hashes = {geohash.encode(lat, lon) for lat, lon in points}
+    rows = Coordinate.objects.filter(geohash__in=hashes).values_list('latitude', 'longitude', 'id')
+    return {(lat, lon):pk for lat, lon, pk in rows if (lat, lon) in points}
+
+
+def import_address_batch(df, dedupe=True):
+    ''' Imports one batch of addresses, see import_addresses '''
+    df = df.astype(object).where(df.notna(), None)
+    for col in ADDRESS_COLUMNS + ['country', 'subdivision', 'latitude', 'longitude']:
+        if col not in df.columns:
+            df[col] = None
+    country_ids = geo_cache.map_country_ids(df['country'])
+    subdivision_ids = geo_cache.map_subdivision_ids(df['subdivision'], df['country'])
+    alpha3s = [None if pd.isna(pk) else geo_cache.get_country_by_id(int(pk)).alpha3 for pk in country_ids]
+    fingerprints = pd.Series([
+        get_fingerprint(row.street1, row.street2, row.street3, row.city, row.postal_code, alpha3)
+        for row, alpha3 in zip(df.itertuples(), alpha3s)
+    ], index=df.index)
+    if dedupe:
+        # one set-based query, the oldest address wins when there are duplicates already
+        existing = dict(
+            Address.objects.filter(fingerprint__in=set(fingerprints.dropna())).order_by('-id').values_list('fingerprint', 'id')
+        )
+        # rows without a fingerprint (no street, city or postal code) are never deduplicated
+        new = df[fingerprints.isna() | (~fingerprints.isin(existing) & ~fingerprints.duplicated())]
+    else:
+        new = df
+    points = [(row.latitude, row.longitude) for row in new.itertuples() if row.latitude is not None and row.longitude is not None]
+    coordinate_ids = get_coordinate_ids(points)
+    objs = []
+    for row in new.itertuples():
+        coordinate_id = None
+        if row.latitude is not None and row.longitude is not None:
+            key = (Decimal(str(row.latitude)).quantize(COORDINATE_PLACES), Decimal(str(row.longitude)).quantize(COORDINATE_PLACES))
+            coordinate_id = coordinate_ids.get(key)
+        objs.append(Address(
+            **{col:getattr(row, col) for col in ADDRESS_COLUMNS},
+            country_id=None if pd.isna(country_ids[row.Index]) else int(country_ids[row.Index]),
+            subdivision_id=None if pd.isna(subdivision_ids[row.Index]) else int(subdivision_ids[row.Index]),
+            coordinate_id=coordinate_id,
+        ))
+    Address.objects.bulk_create(objs)
+    created = pd.Series(False, index=df.index)
+    created[new.index] = True
+    created_ids = pd.Series([obj.id for obj in objs], index=new.index, dtype='Int64')
+    if dedupe:
+        new_fingerprints = fingerprints[new.index].dropna()
+        existing.update(zip(new_fingerprints, created_ids[new_fingerprints.index]))
+        address_ids = fingerprints.map(existing).astype('Int64').fillna(created_ids)
+    else:
+        address_ids = created_ids
+    return pd.DataFrame({'address_id':address_ids.astype('Int64'), 'created':created})
+
+
+def import_addresses(data, batch_size=5000, dedupe=True):
+    """Bulk imports addresses. Countries and subdivisions are resolved in memory with the geo_cache, the rows
+        are deduplicated (within the data and against the existing rows) by fingerprint with one query per batch,
+        and the new Coordinates and Addresses are created with bulk inserts (one transaction per batch)
+
+    Args:
+        data (pd.DataFrame or iterable of dicts): columns/keys name, attn, street1, street2, street3, city, postal_code,
+            country (alpha2, alpha3, numeric code or name), subdivision (iso_code, or code/name within the country),
+            latitude and longitude (all optional)
+        batch_size (int, optional): Number of rows per batch. Defaults to 5000
+        dedupe (bool, optional): Reuse the existing address with the same fingerprint. Defaults to True
+
+    Returns:
+        pd.DataFrame: indexed like data (or by position for an iterable) with the columns address_id and created
+    """
+    results = []
+    for df in iter_batches(data, batch_size):
+        with transaction.atomic():
+            results.append(import_address_batch(df, dedupe=dedupe))
+    if not results:
+        return pd.DataFrame({'address_id':pd.Series(dtype='Int64'), 'created':pd.Series(dtype=bool)})
+    return pd.concat(results)
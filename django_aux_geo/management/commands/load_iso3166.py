@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from django_aux_geo.models import Country, Subdivision, ISO3166_VERSION
+
+
+class Command(BaseCommand):
+    help = 'Bulk creates the Countries and Subdivisions from the bundled ISO 3166 data (no network access needed)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--update', action='store_true', help='Update the existing rows instead of keeping them')
+        parser.add_argument('--scrape', action='store_true', help='Scrape the countries instead of using the bundled data')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per INSERT')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            countries = Country.create_objs(update=options['update'], scrape=options['scrape'], batch_size=options['batch_size'])
+            subdivisions = Subdivision.create_objs(update=options['update'], batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f'Loaded {len(countries)} countries and {len(subdivisions)} subdivisions (ISO 3166 data {ISO3166_VERSION})'
+        ))
@@ -0,0 +1,29 @@
+import os
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from django_aux_geo.models import Country, Subdivision, ISO3166_DATA_DIR
+
+
+class Command(BaseCommand):
+    help = 'Scrapes the ISO 3166-1/3166-2 data (one request per country, requires network access) and writes the data files'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--output-dir', default=ISO3166_DATA_DIR, help='Defaults to the bundled data directory')
+        parser.add_argument('--countries', nargs='*', help='alpha2 codes of the countries to scrape subdivisions for. Defaults to all')
+
+    def handle(self, *args, **options):
+        os.makedirs(options['output_dir'], exist_ok=True)
+        cdf = Country.scrape_df().sort_values('alpha3')
+        cdf.to_csv(os.path.join(options['output_dir'], 'iso3166-1.csv'), index=False)
+        alpha2s = options['countries'] or cdf.alpha2.dropna().tolist()
+        dfs = []
+        for alpha2 in alpha2s:
+            try:
+                dfs.append(Subdivision.get_scraped_df(Country(alpha2=alpha2)))
+            except Exception as e:
+                self.stderr.write(f'Could not scrape the subdivisions of {alpha2}: {e}')
+        sdf = pd.concat(dfs).sort_values('iso_code') if dfs else pd.DataFrame(columns=['iso_code', 'country', 'name', 'category'])
+        sdf.to_csv(os.path.join(options['output_dir'], 'iso3166-2.csv'), index=False)
+        self.stdout.write(self.style.SUCCESS(f'Wrote {len(cdf)} countries and {len(sdf)} subdivisions to {options["output_dir"]}'))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from django_aux_geo.models import Address
+
+
+class Command(BaseCommand):
+    help = 'Recomputes the full text search vectors of the Addresses with batched set-based UPDATEs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Number of rows updated per statement')
+        parser.add_argument('--only-missing', action='store_true', help='Only update the rows without a search vector')
+
+    def handle(self, *args, **options):
+        count = Address.objects.reindex_search(batch_size=options['batch_size'], only_missing=options['only_missing'])
+        self.stdout.write(f'Reindexed {count} addresses')
@@ -0,0 +1,55 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:26
+
+from django.db import migrations, models
+
+BASE32 = '0123456789bcdefghjkmnpqrstuvwxyz'
+
+
+def encode(latitude, longitude, precision=12):
+    ''' A frozen copy of django_aux_geo.geohash.encode, later changes to it must not change this migration '''
+    lat_lo, lat_hi, lon_lo, lon_hi = -90.0, 90.0, -180.0, 180.0
+    latitude, longitude = float(latitude), float(longitude)
+    chars, bits, value, even = [], 0, 0, True
+    while len(chars) < precision:
+        if even:
+            mid = (lon_lo + lon_hi) / 2
+            value = value * 2 + (longitude >= mid)
+            lon_lo, lon_hi = (mid, lon_hi) if longitude >= mid else (lon_lo, mid)
+        else:
+            mid = (lat_lo + lat_hi) / 2
+            value = value * 2 + (latitude >= mid)
+            lat_lo, lat_hi = (mid, lat_hi) if latitude >= mid else (lat_lo, mid)
+        even = not even
+        bits += 1
+        if bits == 5:
+            chars.append(BASE32[value])
+            bits, value = 0, 0
+    return ''.join(chars)
+
+
+def set_geohashes(apps, schema_editor):
+    Coordinate = apps.get_model('django_aux_geo', 'Coordinate')
+    batch = []
+    for coord in Coordinate.objects.filter(geohash=None).iterator(chunk_size=5000):
+        coord.geohash = encode(coord.latitude, coord.longitude)
+        batch.append(coord)
+        if len(batch) >= 5000:
+            Coordinate.objects.bulk_update(batch, ['geohash'])
+            batch = []
+    Coordinate.objects.bulk_update(batch, ['geohash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_aux_geo', '0002_address_coordinate_coordinate_unique_coord_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coordinate',
+            name='geohash',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=12, null=True),
+        ),
+        migrations.RunPython(set_geohashes, migrations.RunPython.noop),
+    ]
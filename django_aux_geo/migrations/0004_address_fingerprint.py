@@ -0,0 +1,75 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:29
+
+import hashlib
+import re
+
+from django.db import migrations, models
+
+# a frozen copy of django_aux_geo.fingerprint, later changes to it must not change this migration
+ABBREVIATIONS = {
+    'street':'st', 'avenue':'ave', 'av':'ave', 'road':'rd', 'boulevard':'blvd', 'drive':'dr', 'lane':'ln',
+    'court':'ct', 'place':'pl', 'parkway':'pkwy', 'highway':'hwy', 'terrace':'ter', 'circle':'cir',
+    'square':'sq', 'trail':'trl', 'way':'wy', 'suite':'ste', 'apartment':'apt', 'building':'bldg',
+    'floor':'fl', 'room':'rm', 'unit':'unit', 'number':'no', 'north':'n', 'south':'s', 'east':'e',
+    'west':'w', 'northeast':'ne', 'northwest':'nw', 'southeast':'se', 'southwest':'sw',
+    'saint':'st', 'mount':'mt', 'fort':'ft', 'post office box':'po box', 'p o box':'po box',
+}
+ABBREVIATION_RE = re.compile(r'\b(' + '|'.join(sorted(map(re.escape, ABBREVIATIONS), key=len, reverse=True)) + r')\b')
+PUNCTUATION_RE = re.compile(r'[^\w\s]')
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_part(value, abbreviate=True):
+    if value is None or value != value:
+        return ''
+    value = PUNCTUATION_RE.sub(' ', str(value).casefold())
+    value = WHITESPACE_RE.sub(' ', value).strip()
+    if abbreviate:
+        value = ABBREVIATION_RE.sub(lambda m: ABBREVIATIONS[m.group(1)], value)
+    return value
+
+
+def normalize_postal_code(value):
+    return re.sub(r'[^0-9A-Z]', '', normalize_part(value, abbreviate=False).upper())
+
+
+def get_fingerprint(street1=None, street2=None, street3=None, city=None, postal_code=None, country=None):
+    street = ' '.join(part for part in [normalize_part(street1), normalize_part(street2), normalize_part(street3)] if part)
+    parts = [street, normalize_part(city), normalize_postal_code(postal_code)]
+    if not any(parts):
+        return None
+    key = '|'.join(parts + [normalize_part(country, abbreviate=False)])
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def set_fingerprints(apps, schema_editor):
+    Address = apps.get_model('django_aux_geo', 'Address')
+    Country = apps.get_model('django_aux_geo', 'Country')
+    alpha3s = dict(Country.objects.values_list('id', 'alpha3'))
+    batch = []
+    for address in Address.objects.filter(fingerprint=None).iterator(chunk_size=5000):
+        address.fingerprint = get_fingerprint(
+            address.street1, address.street2, address.street3, address.city, address.postal_code,
+            alpha3s.get(address.country_id),
+        )
+        batch.append(address)
+        if len(batch) >= 5000:
+            Address.objects.bulk_update(batch, ['fingerprint'])
+            batch = []
+    Address.objects.bulk_update(batch, ['fingerprint'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_aux_geo', '0003_coordinate_geohash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='fingerprint',
+            field=models.CharField(blank=True, db_index=True, editable=False, max_length=40, null=True),
+        ),
+        migrations.RunPython(set_fingerprints, migrations.RunPython.noop),
+    ]
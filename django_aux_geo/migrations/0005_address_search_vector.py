@@ -0,0 +1,65 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:31
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations, transaction
+from django.db.models import F, OuterRef, Subquery
+from django.contrib.postgres.search import SearchVector
+
+
+# The search vector as of this migration (copied so later changes to the model do not alter it)
+SEARCH_FIELDS = {
+    'A':['name', 'attn'],
+    'B':['street1', 'street2', 'street3'],
+    'C':['city', 'postal_code'],
+    'D':['subdivision__name', 'subdivision__iso_code', 'country__name', 'country__alpha2', 'country__alpha3'],
+}
+
+
+def set_search_vectors(apps, schema_editor):
+    Address = apps.get_model('django_aux_geo', 'Address')
+    related = {
+        'country':(apps.get_model('django_aux_geo', 'Country'), 'country_id'),
+        'subdivision':(apps.get_model('django_aux_geo', 'Subdivision'), 'subdivision_id'),
+    }
+    vector = None
+    for weight, fields in SEARCH_FIELDS.items():
+        exprs = []
+        for field in fields:
+            if '__' in field:
+                rel, attr = field.split('__')
+                model, fk = related[rel]
+                exprs.append(Subquery(model.objects.filter(pk=OuterRef(fk)).values(attr)[:1]))
+            else:
+                exprs.append(F(field))
+        part = SearchVector(*exprs, weight=weight, config='simple')
+        vector = part if vector is None else vector + part
+    last = 0
+    while True:
+        pks = list(Address.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)[:10_000])
+        if not pks:
+            break
+        with transaction.atomic():
+            Address.objects.filter(pk__in=pks).update(search_vector=vector)
+        last = pks[-1]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_aux_geo', '0004_address_fingerprint'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='address',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        # backfill before the index is built so the rows do not pay the GIN maintenance one by one
+        migrations.RunPython(set_search_vectors, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='address',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='address_search_vector_gin'),
+        ),
+    ]
@@ -1,10 +1,26 @@
+import os
+import re
+import math
+
 import pandas as pd
 from pandas import DataFrame as DF
 
-from django.db import models
+from django.db import models, transaction
+from django.db.models import F, Q, Value, FloatField, OuterRef, Subquery
+from django.db.models.functions import Cast, Radians, Sin, Cos, ASin, Sqrt, Power, Least
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import SearchVectorField, SearchVector, SearchQuery, SearchRank
 from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 
+from django_aux_geo import geohash
+from django_aux_geo.fingerprint import get_fingerprint
+
+# The bundled ISO 3166-1/3166-2 files are generated from the Debian iso-codes database,
+# refresh them with the refresh_iso3166 command (which scrapes the sources below) and bump the version
+ISO3166_DATA_DIR = os.path.join(os.path.dirname(__file__), 'data')
+ISO3166_VERSION = '2026.02.16'
+
 
 class Country(models.Model):
     ''' A instance of this class represents a country in the world using the ISO 3166-1 standard '''
@@ -14,21 +30,48 @@ class Country(models.Model):
     num = models.PositiveIntegerField(unique=True)
     name = models.CharField(max_length=250)
 
-    @classmethod
-    def create_objs(cls, update=False):
-        url = 'https://www.iban.com/country-codes'
-        df = pd.read_html(url)[0]
+    @staticmethod
+    def get_bundled_df():
+        ''' Returns the bundled ISO 3166-1 data (alpha2, alpha3, num, name) as a DataFrame '''
+        # keep_default_na=False or Namibia's alpha2 (NA) is read as missing
+        return pd.read_csv(
+            os.path.join(ISO3166_DATA_DIR, 'iso3166-1.csv'), dtype={'num':int}, keep_default_na=False, na_values=[''],
+        )
+
+    @staticmethod
+    def scrape_df():
+        ''' Scrapes the ISO 3166-1 data (alpha2, alpha3, num, name) from iban.com, requires network access '''
+        df = pd.read_html('https://www.iban.com/country-codes', keep_default_na=False, na_values=[''])[0]
         df.columns = ['name', 'alpha2', 'alpha3', 'num']
-        
-        for tup in df.itertuples():
-            alpha2 = None if pd.isna(tup.alpha2) else tup.alpha2
-            goc_method = cls.objects.updated_or_create if update else cls.objects.get_or_create
-            goc_method(
-                alpha3 = tup.alpha3,
-                defaults = dict(
-                    alpha2=alpha2, num=tup.num, name=tup.name
-                )
-            )
+        return df[['alpha2', 'alpha3', 'num', 'name']]
+
+    @classmethod
+    def upsert_df(cls, df, update=False, batch_size=None):
+        """Creates the countries of df (columns alpha2, alpha3, num, name) with a single bulk insert
+
+        Args:
+            df (pd.DataFrame): the countries
+            update (bool, optional): Update the existing countries (matched on alpha3). Defaults to False (existing rows are kept)
+            batch_size (int, optional): passed to bulk_create
+        """
+        objs = [
+            cls(alpha2=None if pd.isna(tup.alpha2) else tup.alpha2, alpha3=tup.alpha3, num=int(tup.num), name=tup.name)
+            for tup in df.itertuples()
+        ]
+        if update:
+            kwargs = dict(update_conflicts=True, unique_fields=['alpha3'], update_fields=['alpha2', 'num', 'name'])
+        else:
+            kwargs = dict(ignore_conflicts=True)
+        objs = cls.objects.bulk_create(objs, batch_size=batch_size, **kwargs)
+        from django_aux_geo.cache import geo_cache # bulk_create sends no signals
+        geo_cache.clear()
+        return objs
+
+    @classmethod
+    def create_objs(cls, update=False, scrape=False, batch_size=None):
+        ''' Classmethod creates every country from the bundled data (or scraped if scrape=True), see upsert_df '''
+        df = cls.scrape_df() if scrape else cls.get_bundled_df()
+        return cls.upsert_df(df, update=update, batch_size=batch_size)
 
     def __str__(self):
         return f'{self.alpha3}'
@@ -67,6 +110,11 @@ class Subdivision(models.Model):
         return df
 
 
+    @staticmethod
+    def get_bundled_df():
+        ''' Returns the bundled ISO 3166-2 data (iso_code, country (alpha2), name, category) as a DataFrame '''
+        return pd.read_csv(os.path.join(ISO3166_DATA_DIR, 'iso3166-2.csv'), keep_default_na=False, na_values=[''])
+
     @classmethod
     def get_create_df(cls, country):
         """ method retreives the data needed to create objects from wikipedia """
@@ -82,33 +130,239 @@ class Subdivision(models.Model):
 
 
     @classmethod
-    def create_objs_from_country(cls, country):
-        ''' Method takes a coutnry object and creates all Subdivisions for that country '''
+    def upsert_df(cls, df, update=False, batch_size=None):
+        """Creates the subdivisions of df (columns iso_code, country (alpha2), name, category) with a single
+            bulk insert. Rows of countries that do not exist are skipped
+
+        Args:
+            df (pd.DataFrame): the subdivisions
+            update (bool, optional): Update the existing subdivisions (matched on iso_code). Defaults to False (existing rows are kept)
+            batch_size (int, optional): passed to bulk_create
+        """
+        country_ids = dict(Country.objects.exclude(alpha2=None).values_list('alpha2', 'id'))
+        objs = [
+            cls(iso_code=tup.iso_code, country_id=country_ids[tup.country], name=tup.name, category=tup.category)
+            for tup in df.itertuples() if tup.country in country_ids
+        ]
+        if update:
+            kwargs = dict(update_conflicts=True, unique_fields=['iso_code'], update_fields=['country', 'name', 'category'])
+        else:
+            kwargs = dict(ignore_conflicts=True)
+        objs = cls.objects.bulk_create(objs, batch_size=batch_size, **kwargs)
+        from django_aux_geo.cache import geo_cache # bulk_create sends no signals
+        geo_cache.clear()
+        return objs
+
+    @classmethod
+    def create_objs(cls, update=False, batch_size=None):
+        ''' Classmethod creates every subdivision (of the existing countries) from the bundled data, see upsert_df '''
+        return cls.upsert_df(cls.get_bundled_df(), update=update, batch_size=batch_size)
+
+    @classmethod
+    def get_scraped_df(cls, country):
+        ''' Returns the scraped subdivisions of country in the upsert_df format, requires network access '''
         df = cls.get_create_df(country)
-        if df.empty: 
-            return
-        for tup in df.itertuples():
-            cls.objects.get_or_create(
-                iso_code = tup.code,
-                defaults = dict(
-                    name = tup.name, category = tup.category, country=country
-                )
-            )
+        if df.empty:
+            return DF(columns=['iso_code', 'country', 'name', 'category'])
+        df = df.rename(columns={'code':'iso_code'})
+        df['country'] = country.alpha2
+        return df[['iso_code', 'country', 'name', 'category']]
+
+    @classmethod
+    def create_objs_from_country(cls, country, update=False):
+        ''' Method takes a country object and creates (scrapes) all Subdivisions for that country '''
+        return cls.upsert_df(cls.get_scraped_df(country), update=update)
 
     def __str__(self):
         return f'{self.iso_code} | {self.name}'
 
 
+def get_haversine_expression(latitude, longitude, prefix=''):
+    """Returns an expression computing (in SQL) the great circle distance in km between a point and the
+        latitude/longitude columns
+
+    Args:
+        latitude (float): latitude of the point in degrees
+        longitude (float): longitude of the point in degrees
+        prefix (str, optional): the lookup path to the columns i.e. "coordinate__". Defaults to ''
+    """
+    lat, lon = math.radians(float(latitude)), math.radians(float(longitude))
+    lat2 = Radians(Cast(F(f'{prefix}latitude'), FloatField()))
+    lon2 = Radians(Cast(F(f'{prefix}longitude'), FloatField()))
+    a = Power(Sin((lat2 - Value(lat)) / 2), 2) + Value(math.cos(lat)) * Cos(lat2) * Power(Sin((lon2 - Value(lon)) / 2), 2)
+    return Value(2 * geohash.EARTH_RADIUS_KM) * ASin(Sqrt(Least(a, Value(1.0))))
+
+
+class CoordinateQuerySetMixin:
+    ''' Spatial queries (plain SQL, no PostGIS) for querysets of Coordinate or of models with a Coordinate FK.
+        Candidates are pruned with the indexed geohash prefixes and refined with the exact haversine distance '''
+    coordinate_prefix = '' # lookup path to the Coordinate i.e. "coordinate__"
+
+    def within_bbox(self, south, west, north, east, max_cells=32):
+        """Filters the coordinates inside a bounding box (in degrees, west > east crosses the antimeridian)
+
+        Args:
+            max_cells (int, optional): maximum number of geohash prefixes used to prune candidates. Defaults to 32
+        """
+        prefix = self.coordinate_prefix
+        q = Q()
+        for cell in geohash.get_covering_cells(south, west, north, east, max_cells=max_cells):
+            q |= Q(**{f'{prefix}geohash__startswith':cell})
+        qs = self.filter(q, **{f'{prefix}latitude__gte':south, f'{prefix}latitude__lte':north})
+        if west <= east:
+            return qs.filter(**{f'{prefix}longitude__gte':west, f'{prefix}longitude__lte':east})
+        return qs.filter(Q(**{f'{prefix}longitude__gte':west}) | Q(**{f'{prefix}longitude__lte':east}))
+
+    def annotate_distance(self, latitude, longitude, name='distance'):
+        ''' Annotates the haversine distance (km) to the point '''
+        return self.annotate(**{name:get_haversine_expression(latitude, longitude, prefix=self.coordinate_prefix)})
+
+    def within_radius(self, latitude, longitude, km, name='distance'):
+        ''' Filters the coordinates within km of the point, annotated with their distance '''
+        qs = self.within_bbox(*geohash.get_radius_bbox(latitude, longitude, km))
+        return qs.annotate_distance(latitude, longitude, name=name).filter(**{f'{name}__lte':km})
+
+    def nearest(self, latitude, longitude, k=10, max_km=None, start_km=1, name='distance'):
+        """Returns the k nearest coordinates to the point ordered by distance. The search radius starts
+            at start_km and grows until it holds k candidates (or reaches max_km)
+
+        Args:
+            k (int, optional): number of neighbours. Defaults to 10
+            max_km (float, optional): never return neighbours further than this. Defaults to no limit
+            start_km (float, optional): initial search radius. Defaults to 1
+        """
+        limit = max_km or math.pi * geohash.EARTH_RADIUS_KM # half the circumference covers the globe
+        km = min(start_km, limit)
+        while True:
+            qs = self.within_radius(latitude, longitude, km, name=name)
+            if km >= limit or qs.count() >= k:
+                return qs.order_by(name)[:k]
+            km = min(km * 4, limit)
+
+
+class CoordinateQuerySet(CoordinateQuerySetMixin, models.QuerySet):
+    ''' QuerySet of Coordinates, bulk_create sets the geohashes '''
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.set_geohash()
+        return super().bulk_create(objs, *args, **kwargs)
+
+
 class Coordinate(models.Model):
+    ''' A point on earth. The geohash (kept in sync on save and bulk_create, not by queryset.update)
+        indexes the point for the spatial queries of CoordinateQuerySet '''
     id = models.BigAutoField(primary_key=True)
     latitude = models.DecimalField(max_digits=8, decimal_places=6)
     longitude = models.DecimalField(max_digits=9, decimal_places=6)
+    geohash = models.CharField(max_length=12, null=True, blank=True, db_index=True, editable=False)
+
+    objects = CoordinateQuerySet.as_manager()
 
     class Meta:
         constraints = [
             models.UniqueConstraint(fields=['latitude', 'longitude'], name='unique_coord')
         ]
 
+    def set_geohash(self):
+        if self.latitude is None or self.longitude is None:
+            self.geohash = None
+        else:
+            self.geohash = geohash.encode(self.latitude, self.longitude)
+
+    def save(self, *args, **kwargs):
+        self.set_geohash()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'geohash'}
+        super().save(*args, **kwargs)
+
+
+# weight: fields of the address search vector, the related names are read from the geo_cache on save
+ADDRESS_SEARCH_FIELDS = {
+    'A':['name', 'attn'],
+    'B':['street1', 'street2', 'street3'],
+    'C':['city', 'postal_code'],
+    'D':['subdivision__name', 'subdivision__iso_code', 'country__name', 'country__alpha2', 'country__alpha3'],
+}
+ADDRESS_SEARCH_CONFIG = 'simple' # no stemming or stop words, street and place names are not prose
+
+
+def get_address_search_vector(country_model=None, subdivision_model=None):
+    """Returns the expression computing the search vector of the addresses in SQL (for set-based UPDATEs,
+        the related names are subqueries as UPDATE cannot join)
+
+    Args:
+        country_model, subdivision_model (optional): the (historical) models. Default to Country and Subdivision
+    """
+    related = {
+        'country':(country_model or Country, 'country_id'),
+        'subdivision':(subdivision_model or Subdivision, 'subdivision_id'),
+    }
+    vector = None
+    for weight, fields in ADDRESS_SEARCH_FIELDS.items():
+        exprs = []
+        for field in fields:
+            if '__' in field:
+                rel, attr = field.split('__')
+                model, fk = related[rel]
+                exprs.append(Subquery(model.objects.filter(pk=OuterRef(fk)).values(attr)[:1]))
+            else:
+                exprs.append(F(field))
+        part = SearchVector(*exprs, weight=weight, config=ADDRESS_SEARCH_CONFIG)
+        vector = part if vector is None else vector + part
+    return vector
+
+
+class AddressQuerySet(CoordinateQuerySetMixin, models.QuerySet):
+    ''' QuerySet of Addresses, the spatial queries use the Address's coordinate.
+        bulk_create sets the fingerprints and search vectors '''
+    coordinate_prefix = 'coordinate__'
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        for obj in objs:
+            obj.set_fingerprint()
+            obj.set_search_vector()
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def search(self, text, prefix=False):
+        """Filters the addresses matching text (GIN indexed full text search), annotated with their rank and
+            ordered by it
+
+        Args:
+            text (str): websearch syntax i.e. 'main st -suite "new york"'
+            prefix (bool, optional): match every word of text as a prefix (for search as you type). Defaults to False
+        """
+        if prefix:
+            words = re.findall(r'\w+', text or '')
+            if not words:
+                return self.none()
+            query = SearchQuery(' & '.join(f'{word}:*' for word in words), search_type='raw', config=ADDRESS_SEARCH_CONFIG)
+        else:
+            query = SearchQuery(text or '', search_type='websearch', config=ADDRESS_SEARCH_CONFIG)
+        return self.filter(search_vector=query).annotate(rank=SearchRank(F('search_vector'), query)).order_by('-rank', 'id')
+
+    def reindex_search(self, batch_size=10_000, only_missing=False):
+        """Recomputes the search vectors with one set-based UPDATE per batch of batch_size rows (keyset paginated
+            by pk, one transaction per batch). Needed after Country/Subdivision renames or queryset.update calls
+
+        Returns:
+            int: number of rows updated
+        """
+        qs = self.filter(search_vector=None) if only_missing else self
+        vector = get_address_search_vector()
+        updated, last = 0, None
+        while True:
+            batch_qs = qs.order_by('pk') if last is None else qs.filter(pk__gt=last).order_by('pk')
+            pks = list(batch_qs.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                updated += self.model._default_manager.filter(pk__in=pks).update(search_vector=vector)
+            last = pks[-1]
+        return updated
+
 
 class Address(models.Model):
     id = models.BigAutoField(primary_key=True)
@@ -127,6 +381,53 @@ class Address(models.Model):
     content_type = models.ForeignKey(ContentType, on_delete=models.CASCADE, null=True, blank=True)
     object_id = models.CharField(max_length=255, null=True, blank=True)
     fk_object = GenericForeignKey("content_type", "object_id")
+    # normalized street/city/postal code/country hash (see django_aux_geo.fingerprint, None without street, city and postal code),
+    # kept in sync on save and bulk_create
+    fingerprint = models.CharField(max_length=40, null=True, blank=True, db_index=True, editable=False)
+    # full text search vector (see ADDRESS_SEARCH_FIELDS), kept in sync on save and bulk_create
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = AddressQuerySet.as_manager()
+
+    class Meta:
+        indexes = [GinIndex(fields=['search_vector'], name='address_search_vector_gin')]
+
+    def get_fingerprint(self):
+        from django_aux_geo.cache import geo_cache
+        country = geo_cache.get_country_by_id(self.country_id)
+        return get_fingerprint(
+            self.street1, self.street2, self.street3, self.city, self.postal_code, country.alpha3 if country else None,
+        )
+
+    def set_fingerprint(self):
+        self.fingerprint = self.get_fingerprint()
+
+    def get_search_vector(self):
+        ''' Returns the search vector expression of the instance's values (no column references so it also works in bulk inserts) '''
+        from django_aux_geo.cache import geo_cache
+        related = {'country':geo_cache.get_country_by_id(self.country_id), 'subdivision':geo_cache.get_subdivision_by_id(self.subdivision_id)}
+        vector = None
+        for weight, fields in ADDRESS_SEARCH_FIELDS.items():
+            values = []
+            for field in fields:
+                if '__' in field:
+                    rel, attr = field.split('__')
+                    values.append(getattr(related[rel], attr, None))
+                else:
+                    values.append(getattr(self, field))
+            part = SearchVector(*[Value(value or '') for value in values], weight=weight, config=ADDRESS_SEARCH_CONFIG)
+            vector = part if vector is None else vector + part
+        return vector
+
+    def set_search_vector(self):
+        self.search_vector = self.get_search_vector()
+
+    def save(self, *args, **kwargs):
+        self.set_fingerprint()
+        self.set_search_vector()
+        if kwargs.get('update_fields') is not None:
+            kwargs['update_fields'] = {*kwargs['update_fields'], 'fingerprint', 'search_vector'}
+        super().save(*args, **kwargs)
 
 
     def __str__(self):
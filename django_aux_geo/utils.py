@@ -0,0 +1,201 @@
+import numpy as np
+import pandas as pd
+
+from django_aux_geo.geohash import EARTH_RADIUS_KM
+
+DEFAULT_MAX_BYTES = 256 * 1024**2
+
+
+def get_coordinate_arrays(qs):
+    """Loads the coordinates of a queryset of Coordinates (or of Addresses, see CoordinateQuerySetMixin.coordinate_prefix)
+        with a single query. Rows without a coordinate are skipped
+
+    Returns:
+        tuple: (pks, points) int64 array of pks and a n x 2 float64 array of (latitude, longitude) in radians
+    """
+    prefix = getattr(qs, 'coordinate_prefix', '')
+    rows = qs.exclude(**{f'{prefix}latitude':None}).values_list('pk', f'{prefix}latitude', f'{prefix}longitude')
+    rows = list(rows.order_by())
+    pks = np.array([row[0] for row in rows], dtype=np.int64)
+    points = np.radians(np.array([row[1:] for row in rows], dtype=np.float64).reshape(-1, 2))
+    return pks, points
+
+
+def haversine_matrix(a, b):
+    ''' Returns the len(a) x len(b) matrix of great circle distances (km) between two arrays of (lat, lon) radians '''
+    lat1, lon1 = a[:, 0:1], a[:, 1:2]
+    lat2, lon2 = b[:, 0], b[:, 1]
+    h = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.minimum(h, 1)))
+
+
+def iter_distance_chunks(a, b, max_bytes=DEFAULT_MAX_BYTES):
+    """Yields the haversine distance matrix of a and b in blocks of rows so the temporaries stay under max_bytes
+
+    Yields:
+        tuple: (start, block) the rows start:start + len(block) of the full matrix
+    """
+    # ~4 float64 temporaries the size of the block are alive at once
+    rows = max(1, int(max_bytes // (max(len(b), 1) * 8 * 4)))
+    for start in range(0, len(a), rows):
+        yield start, haversine_matrix(a[start:start + rows], b)
+
+
+def get_distance_matrix(qs_a, qs_b=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Returns the haversine distance matrix (km) between two querysets of Coordinates/Addresses
+
+    Args:
+        qs_a (QuerySet): the rows of the matrix
+        qs_b (QuerySet, optional): the columns of the matrix. Defaults to qs_a
+        max_bytes (int, optional): memory limit of the matrix (and of the temporaries used to compute it).
+            Defaults to 256MB. Use get_distance_pairs for larger point sets
+
+    Returns:
+        pd.DataFrame: distances indexed by the pks of qs_a with the pks of qs_b as columns
+    """
+    pks_a, a = get_coordinate_arrays(qs_a)
+    pks_b, b = (pks_a, a) if qs_b is None else get_coordinate_arrays(qs_b)
+    if len(a) * len(b) * 8 > max_bytes:
+        raise ValueError(f'A {len(a)} x {len(b)} matrix exceeds max_bytes={max_bytes:,}, use get_distance_pairs')
+    matrix = np.empty((len(a), len(b)), dtype=np.float64)
+    for start, block in iter_distance_chunks(a, b, max_bytes=max_bytes):
+        matrix[start:start + len(block)] = block
+    return pd.DataFrame(matrix, index=pd.Index(pks_a, name='pk'), columns=pks_b)
+
+
+def get_distance_pairs(qs_a, qs_b=None, max_km=None, max_bytes=DEFAULT_MAX_BYTES):
+    """Returns the pairs of points (within max_km) of two querysets of Coordinates/Addresses with their distance.
+        The matrix is computed in chunks so only the pairs kept are held in memory
+
+    Args:
+        qs_b (QuerySet, optional): Defaults to qs_a (pairs of a point with itself are dropped)
+        max_km (float, optional): only keep the pairs at most this far apart. Defaults to every pair
+
+    Returns:
+        pd.DataFrame: columns pk_a, pk_b, distance (km)
+    """
+    pks_a, a = get_coordinate_arrays(qs_a)
+    pks_b, b = (pks_a, a) if qs_b is None else get_coordinate_arrays(qs_b)
+    frames = []
+    for start, block in iter_distance_chunks(a, b, max_bytes=max_bytes):
+        mask = np.ones(block.shape, dtype=bool) if max_km is None else block <= max_km
+        if qs_b is None:
+            rows = np.arange(start, start + len(block))
+            mask[rows - start, rows] = False
+        i, j = np.nonzero(mask)
+        frames.append(pd.DataFrame({'pk_a':pks_a[start + i], 'pk_b':pks_b[j], 'distance':block[i, j]}))
+    if not frames:
+        return pd.DataFrame({'pk_a':pd.Series(dtype=np.int64), 'pk_b':pd.Series(dtype=np.int64), 'distance':pd.Series(dtype=np.float64)})
+    return pd.concat(frames, ignore_index=True)
+
+
+def to_unit_vectors(points):
+    ''' Returns the n x 3 unit vectors of an array of (lat, lon) radians '''
+    lat, lon = points[:, 0], points[:, 1]
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+class GridIndex:
+    """ A uniform grid over the 3D unit vectors of a set of points, used to find nearest neighbours without
+        computing the full distance matrix. Working in 3D avoids the special cases of the poles and the antimeridian:
+        a point more than r cells away (on any axis) is at least r * cell size (chord) away
+    """
+
+    def __init__(self, points, cell_km=50):
+        """
+        Args:
+            points (np.ndarray): n x 2 array of (lat, lon) radians
+            cell_km (float, optional): approximate size of the cells. Defaults to 50
+        """
+        self.points = points
+        self.size = min(cell_km / EARTH_RADIUS_KM, 2.0) # chord length of a cell
+        self.span = int(np.ceil(1 / self.size)) + 1 # cells per axis on each side of the origin
+        cells = np.floor(to_unit_vectors(points) / self.size).astype(np.int64)
+        keys = self.encode(cells)
+        self.order = np.argsort(keys, kind='stable')
+        cell_keys, self.starts, self.counts = np.unique(keys[self.order], return_index=True, return_counts=True)
+        self.cells = cells[self.order][self.starts] # the (x, y, z) of each occupied cell
+        self.slices = dict(zip(cell_keys.tolist(), zip(self.starts.tolist(), self.counts.tolist()))) # key: (start, count)
+
+    def encode(self, cxyz):
+        ''' Returns the int64 keys of an array of (x, y, z) cell coordinates '''
+        width = 2 * self.span + 1
+        shifted = cxyz + self.span
+        return (shifted[..., 0] * width + shifted[..., 1]) * width + shifted[..., 2]
+
+    def get_candidates(self, cell_xyz, radius):
+        ''' Returns the indices of the points in the occupied cells within radius (cells, on every axis) of cell_xyz.
+            Looks up the (2r+1)^3 neighbour cells, scans the occupied cells when there are fewer of them '''
+        if radius >= 2 * self.span or (2 * radius + 1) ** 3 >= len(self.cells):
+            pos = np.nonzero(np.abs(self.cells - cell_xyz).max(axis=1) <= radius)[0]
+            slices = zip(self.starts[pos], self.counts[pos])
+        else:
+            # clipped to the grid so that the keys do not wrap around
+            axes = [np.arange(max(c - radius, -self.span), min(c + radius, self.span) + 1) for c in cell_xyz]
+            neighbours = np.stack(np.meshgrid(*axes, indexing='ij'), axis=-1).reshape(-1, 3)
+            slices = [self.slices[key] for key in self.encode(neighbours).tolist() if key in self.slices]
+        parts = [self.order[s:s + c] for s, c in slices]
+        if not parts:
+            return np.empty(0, dtype=np.int64)
+        return np.concatenate(parts)
+
+    def nearest(self, queries):
+        """Returns the nearest indexed point of each query point
+
+        Args:
+            queries (np.ndarray): n x 2 array of (lat, lon) radians
+
+        Returns:
+            tuple: (indices, distances) int64 array of the indices (into points) and float64 array of the distances (km)
+        """
+        indices = np.full(len(queries), -1, dtype=np.int64)
+        distances = np.full(len(queries), np.inf)
+        if not len(self.points) or not len(queries):
+            return indices, distances
+        qxyz = to_unit_vectors(queries)
+        qcells = np.floor(qxyz / self.size).astype(np.int64)
+        qkeys = self.encode(qcells)
+        qorder = np.argsort(qkeys, kind='stable')
+        _, qstarts, qcounts = np.unique(qkeys[qorder], return_index=True, return_counts=True)
+        for start, count in zip(qstarts, qcounts):
+            members = qorder[start:start + count] # the query points of one cell
+            radius = 1
+            while len(members):
+                candidates = self.get_candidates(qcells[members[0]], radius)
+                covers_all = radius * self.size >= 2
+                if len(candidates):
+                    block = haversine_matrix(queries[members], self.points[candidates])
+                    best = block.argmin(axis=1)
+                    best_km = block[np.arange(len(members)), best]
+                    # points outside the searched cells are at least radius cells (chord) away
+                    bound_km = 2 * EARTH_RADIUS_KM * np.arcsin(min(radius * self.size / 2, 1))
+                    done = (best_km <= bound_km) | covers_all
+                    indices[members[done]] = candidates[best[done]]
+                    distances[members[done]] = best_km[done]
+                    members = members[~done]
+                elif covers_all:
+                    break
+                radius *= 2
+        return indices, distances
+
+
+def get_nearest(qs_a, qs_b, cell_km=50):
+    """Assigns each Coordinate/Address of qs_a its nearest Coordinate/Address of qs_b using a GridIndex
+
+    Args:
+        qs_a (QuerySet): the points to assign
+        qs_b (QuerySet): the candidate points
+        cell_km (float, optional): grid cell size, about the typical nearest distance works best. Defaults to 50
+
+    Returns:
+        pd.DataFrame: indexed by the pks of qs_a with columns nearest (pk in qs_b, missing if qs_b is empty) and distance (km)
+    """
+    pks_a, a = get_coordinate_arrays(qs_a)
+    pks_b, b = get_coordinate_arrays(qs_b)
+    indices, distances = GridIndex(b, cell_km=cell_km).nearest(a)
+    found = indices >= 0
+    nearest = pd.array([None] * len(pks_a), dtype='Int64')
+    nearest[found] = pks_b[indices[found]]
+    return pd.DataFrame(
+        {'nearest':nearest, 'distance':np.where(found, distances, np.nan)}, index=pd.Index(pks_a, name='pk'),
+    )
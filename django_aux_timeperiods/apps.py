@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class DjangoAuxTimeperiodConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'django_aux_timeperiods'
+
+    def ready(self):
+        # connects the signals that keep the period resolver current
+        from django_aux_timeperiods import resolver
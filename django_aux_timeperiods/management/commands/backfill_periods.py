@@ -0,0 +1,24 @@
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+
+from django_aux_timeperiods.mixins import PeriodFKMixin
+
+
+class Command(BaseCommand):
+    help = 'Backfills the period FKs of existing PeriodFKMixin rows with batched set-based UPDATEs'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='app_label.ModelName of the models to backfill. Defaults to all PeriodFKMixin subclasses')
+        parser.add_argument('--batch-size', type=int, default=10_000, help='Number of rows updated per statement')
+        parser.add_argument('--only-missing', action='store_true', help='Only update the rows with a missing period FK')
+
+    def handle(self, *args, **options):
+        if options['models']:
+            models = [apps.get_model(label) for label in options['models']]
+        else:
+            models = [m for m in apps.get_models() if issubclass(m, PeriodFKMixin)]
+        for model in models:
+            if not issubclass(model, PeriodFKMixin):
+                raise CommandError(f'{model._meta.label} is not a PeriodFKMixin model')
+            count = model.backfill_periods(batch_size=options['batch_size'], only_missing=options['only_missing'])
+            self.stdout.write(f'Backfilled {count} rows of {model._meta.label}')
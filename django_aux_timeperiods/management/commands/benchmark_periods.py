@@ -0,0 +1,79 @@
+import datetime as dt
+import timeit
+
+import pandas as pd
+from django.core.management.base import BaseCommand
+
+from django_aux_timeperiods.models import Year, Month, Week, Day
+
+
+def legacy_week_end_dates(year_num):
+    ''' Week.end_dates before the datetime implementation (a full year pd.date_range per call) '''
+    start = pd.to_datetime(dt.date(year_num,1,1)).to_period('W').start_time
+    end = pd.to_datetime(dt.date(year_num,12,31)).to_period('W').end_time
+    dates = pd.date_range(start, end, freq='W')
+    if start.week != 1:
+        dates = dates[1:]
+    if end.week < 52:
+        dates = dates[:-1]
+    return dates
+
+
+def legacy_period(instance):
+    ''' TimePeriodBase.period before the datetime implementation '''
+    cname = instance.__class__.__name__
+    if cname == 'Year':
+        return pd.Period(year=instance.year_num, freq='Y')
+    elif cname == 'Month':
+        return pd.Period(year=instance.year_num, month=instance.month_num, freq='M')
+    elif cname == 'Week':
+        edate = legacy_week_end_dates(instance.year_num)[instance.week_num-1]
+        return pd.Period(edate, freq='W')
+    elif cname == 'Day':
+        return pd.Period(instance.date, freq='D')
+
+
+def legacy_boundaries(instance):
+    ''' The start/end before the datetime implementation (period built twice, as get_rel_status did) '''
+    return legacy_period(instance).start_time, legacy_period(instance).end_time
+
+
+def datetime_boundaries(instance):
+    return instance.start_time, instance.end_time
+
+
+def benchmark_periods(number=1000):
+    """Times the start/end computation of unsaved Year/Month/Week/Day instances with the previous pandas
+        implementation (TimePeriodBase.period and Week.end_dates) and with the datetime implementation.
+        Raises an AssertionError if the two disagree
+
+    Returns:
+        dict: {model name: (pandas seconds, datetime seconds)} for number calls
+    """
+    date = dt.date(2021, 1, 3)
+    instances = [
+        Year(year_num=date.year), Month(year_num=date.year, month_num=date.month),
+        Week(year_num=2020, week_num=53), Day(date=date),
+    ]
+    results = {}
+    for instance in instances:
+        legacy_start, legacy_end = legacy_boundaries(instance)
+        if (legacy_start.to_pydatetime(), legacy_end.date()) != (instance.start_time, instance.end_time.date()):
+            raise AssertionError(f'{instance.__class__.__name__} boundaries differ from the pandas implementation')
+        pandas_time = timeit.timeit(lambda: legacy_boundaries(instance), number=number)
+        datetime_time = timeit.timeit(lambda: datetime_boundaries(instance), number=number)
+        results[instance.__class__.__name__] = (pandas_time, datetime_time)
+    return results
+
+
+class Command(BaseCommand):
+    help = 'Compares the previous pandas and the datetime implementations of the TimePeriod boundary math'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--number', type=int, default=1000, help='Number of calls per model')
+
+    def handle(self, *args, **options):
+        for name, (pandas_time, datetime_time) in benchmark_periods(options['number']).items():
+            self.stdout.write(
+                f'{name:<6} pandas {pandas_time:.4f}s | datetime {datetime_time:.4f}s | {pandas_time / datetime_time:.0f}x'
+            )
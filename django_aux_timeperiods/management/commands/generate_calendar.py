@@ -0,0 +1,24 @@
+import datetime as dt
+
+from django.core.management.base import BaseCommand
+
+from django_aux_timeperiods.models import DateDim
+from django_aux_timeperiods.utils import generate_calendar
+
+
+class Command(BaseCommand):
+    help = 'Bulk creates the Year, Month, Week and Day rows between two dates (existing rows are kept)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('start', type=dt.date.fromisoformat, help='First day (YYYY-MM-DD)')
+        parser.add_argument('end', type=dt.date.fromisoformat, help='Last day (YYYY-MM-DD)')
+        parser.add_argument('--batch-size', type=int, default=None, help='Rows per INSERT')
+        parser.add_argument('--date-dim', action='store_true', help='Also generate the DateDim rows')
+
+    def handle(self, *args, **options):
+        counts = generate_calendar(options['start'], options['end'], batch_size=options['batch_size'])
+        summary = ', '.join(f'{n} {name}s' for name, n in counts.items())
+        self.stdout.write(self.style.SUCCESS(f'Calendar covers {summary}'))
+        if options['date_dim']:
+            DateDim.generate(options['start'], options['end'], batch_size=options['batch_size'])
+            self.stdout.write(self.style.SUCCESS('DateDim generated'))
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+
+from django_aux_timeperiods.rollups import get_rollup_models
+
+
+class Command(BaseCommand):
+    help = 'Incrementally refreshes (or fully rebuilds) the rollup tables'
+
+    def add_arguments(self, parser):
+        parser.add_argument('models', nargs='*', help='app_label.ModelName of the rollups to refresh. Defaults to all RollupBase subclasses')
+        parser.add_argument('--full', action='store_true', help='Rebuild the whole tables instead of refreshing from the high water mark (picks up deletes, updates and rows committed too late for the rescan window)')
+
+    def handle(self, *args, **options):
+        for model in get_rollup_models(options['models']):
+            state = model.refresh(full=options['full'])
+            verb = 'Rebuilt' if state.full_refresh else 'Refreshed'
+            self.stdout.write(f'{verb} {model.get_rollup_label()}: {state.row_count} rows written, high water mark {state.high_water_mark}')
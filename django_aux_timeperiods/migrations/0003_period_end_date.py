@@ -0,0 +1,58 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_aux_timeperiods', '0002_alter_day_options_alter_month_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='day',
+            name='end_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='month',
+            name='end_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='week',
+            name='end_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='year',
+            name='end_date',
+            field=models.DateField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='day',
+            index=models.Index(fields=['date', 'end_date'], name='django_aux__date_95f59c_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='month',
+            index=models.Index(fields=['date', 'end_date'], name='django_aux__date_004104_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='week',
+            index=models.Index(fields=['date', 'end_date'], name='django_aux__date_8074c6_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='year',
+            index=models.Index(fields=['date', 'end_date'], name='django_aux__date_1f3c51_idx'),
+        ),
+        migrations.RunSQL(
+            sql=[
+                "UPDATE django_aux_timeperiods_day SET end_date = date",
+                "UPDATE django_aux_timeperiods_week SET end_date = date + 6",
+                "UPDATE django_aux_timeperiods_month SET end_date = (date + interval '1 month' - interval '1 day')::date",
+                "UPDATE django_aux_timeperiods_year SET end_date = (date + interval '1 year' - interval '1 day')::date",
+            ],
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
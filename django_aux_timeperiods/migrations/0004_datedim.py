@@ -0,0 +1,46 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_aux_timeperiods', '0003_period_end_date'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DateDim',
+            fields=[
+                ('date_key', models.IntegerField(primary_key=True, serialize=False)),
+                ('date', models.DateField(unique=True)),
+                ('year', models.PositiveSmallIntegerField()),
+                ('quarter', models.PositiveSmallIntegerField()),
+                ('month', models.PositiveSmallIntegerField()),
+                ('month_name', models.CharField(max_length=10)),
+                ('day', models.PositiveSmallIntegerField()),
+                ('day_of_year', models.PositiveSmallIntegerField()),
+                ('iso_year', models.PositiveSmallIntegerField()),
+                ('iso_week', models.PositiveSmallIntegerField()),
+                ('day_of_week', models.PositiveSmallIntegerField()),
+                ('day_name', models.CharField(max_length=10)),
+                ('year_quarter', models.IntegerField()),
+                ('year_month', models.IntegerField()),
+                ('iso_year_week', models.IntegerField()),
+                ('is_weekend', models.BooleanField()),
+                ('is_week_start', models.BooleanField()),
+                ('is_week_end', models.BooleanField()),
+                ('is_month_start', models.BooleanField()),
+                ('is_month_end', models.BooleanField()),
+                ('is_quarter_start', models.BooleanField()),
+                ('is_quarter_end', models.BooleanField()),
+                ('is_year_start', models.BooleanField()),
+                ('is_year_end', models.BooleanField()),
+            ],
+            options={
+                'ordering': ['date_key'],
+                'indexes': [models.Index(fields=['year_month', 'date_key'], name='django_aux__year_mo_47c044_idx'), models.Index(fields=['year_quarter', 'date_key'], name='django_aux__year_qu_15be29_idx'), models.Index(fields=['iso_year_week', 'date_key'], name='django_aux__iso_yea_337d4c_idx'), models.Index(fields=['year', 'date_key'], name='django_aux__year_63c8a4_idx')],
+            },
+        ),
+    ]
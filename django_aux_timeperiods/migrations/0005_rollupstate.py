@@ -0,0 +1,24 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('django_aux_timeperiods', '0004_datedim'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RollupState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rollup', models.CharField(max_length=200, unique=True)),
+                ('high_water_mark', models.TextField(blank=True, null=True)),
+                ('refreshed_at', models.DateTimeField(auto_now=True)),
+                ('full_refresh', models.BooleanField(default=False)),
+                ('row_count', models.PositiveIntegerField(null=True)),
+            ],
+        ),
+    ]
@@ -0,0 +1,120 @@
+import datetime as dt
+from zoneinfo import ZoneInfo
+
+from django.db import models, transaction
+from django.db.models import Min, Max, OuterRef, Subquery, Q, ExpressionWrapper
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from django_aux_timeperiods.models import Year, Month, Week, Day, to_date
+from django_aux_timeperiods.utils import generate_calendar
+
+PERIOD_MODELS = {'day':Day, 'week':Week, 'month':Month, 'year':Year}
+
+
+class PeriodFKQuerySet(models.QuerySet):
+    ''' QuerySet whose bulk_create populates the period FKs of PeriodFKMixin models (all objs resolved at once) '''
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        self.model.set_periods_bulk(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+
+class PeriodFKMixin(models.Model):
+    ''' Abstract model mixin that derives Day/Week/Month/Year FKs from a date/datetime field.
+        The FKs are set in save() and in bulk_create (through PeriodFKQuerySet, subclass it for custom querysets)
+        with the process wide period_resolver, so a whole batch is resolved in (at most) one round trip.
+        Existing rows are populated with backfill_periods (see the backfill_periods command)
+
+        i.e.
+        class Sale(PeriodFKMixin, models.Model):
+            dtg = models.DateTimeField()
+            day = models.ForeignKey(Day, on_delete=models.PROTECT, null=True)
+            month = models.ForeignKey(Month, on_delete=models.PROTECT, null=True)
+            period_source_field = 'dtg'
+            period_fields = {'day':'day', 'month':'month'}
+    '''
+    period_source_field = None # date/datetime field the periods are derived from
+    period_fields = {} # {level (day, week, month or year): FK field name}
+    period_timezone = None # aware datetimes are converted to this timezone first. Defaults to the current timezone
+
+    objects = PeriodFKQuerySet.as_manager()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def get_period_tzinfo(cls):
+        if isinstance(cls.period_timezone, str):
+            return ZoneInfo(cls.period_timezone)
+        return cls.period_timezone or timezone.get_current_timezone()
+
+    @classmethod
+    def set_periods_bulk(cls, objs):
+        ''' Classmethod sets the period FKs of objs (FKs are set to None where the source field is None) '''
+        from django_aux_timeperiods.resolver import period_resolver
+        tzinfo = cls.get_period_tzinfo()
+        dates = [to_date(getattr(obj, cls.period_source_field), tzinfo) for obj in objs]
+        known = [d for d in dates if d is not None]
+        resolved = dict(zip(known, period_resolver.resolve_many(known))) if known else {}
+        columns = ['day', 'week', 'month', 'year']
+        attnames = {level:cls._meta.get_field(name).attname for level, name in cls.period_fields.items()}
+        for obj, date in zip(objs, dates):
+            ids = resolved.get(date)
+            for level, attname in attnames.items():
+                setattr(obj, attname, ids[columns.index(level)] if ids else None)
+
+    def set_periods(self):
+        ''' Method sets the period FKs from the source field '''
+        self.set_periods_bulk([self])
+
+    def save(self, *args, **kwargs):
+        self.set_periods()
+        super().save(*args, **kwargs)
+
+    @classmethod
+    def get_period_subquery(cls, level):
+        ''' Returns a subquery of the pk of the period of level containing the (outer) source field '''
+        field = cls._meta.get_field(cls.period_source_field)
+        source = ExpressionWrapper(OuterRef(cls.period_source_field), output_field=field.__class__())
+        if isinstance(field, models.DateTimeField):
+            trunc = Trunc(source, level, output_field=models.DateField(), tzinfo=cls.get_period_tzinfo())
+        else:
+            trunc = Trunc(source, level, output_field=models.DateField())
+        return Subquery(PERIOD_MODELS[level].objects.filter(date=trunc).values('id')[:1])
+
+    @classmethod
+    def backfill_periods(cls, batch_size=10_000, only_missing=False):
+        """Classmethod sets the period FKs of the existing rows with one set-based UPDATE per batch of batch_size
+            rows (keyset paginated by pk, one transaction per batch). The calendar covering the rows is created first
+
+        Args:
+            batch_size (int, optional): Number of rows updated per statement. Defaults to 10_000
+            only_missing (bool, optional): Only update the rows with a missing period FK. Defaults to False
+
+        Returns:
+            int: number of rows updated
+        """
+        qs = cls._default_manager.exclude(**{cls.period_source_field:None})
+        if only_missing:
+            qs = qs.filter(Q(*[(name, None) for name in cls.period_fields.values()], _connector=Q.OR))
+        bounds = qs.aggregate(lo=Min(cls.period_source_field), hi=Max(cls.period_source_field))
+        if bounds['lo'] is None:
+            return 0
+        tzinfo = cls.get_period_tzinfo()
+        # a day of margin on each side, the DB converts the datetimes with its own timezone rules
+        generate_calendar(
+            to_date(bounds['lo'], tzinfo) - dt.timedelta(days=1), to_date(bounds['hi'], tzinfo) + dt.timedelta(days=1),
+        )
+        updates = {name:cls.get_period_subquery(level) for level, name in cls.period_fields.items()}
+        updated, last = 0, None
+        while True:
+            batch_qs = qs.order_by('pk') if last is None else qs.filter(pk__gt=last).order_by('pk')
+            pks = list(batch_qs.values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                break
+            with transaction.atomic():
+                updated += cls._default_manager.filter(pk__in=pks).update(**updates)
+            last = pks[-1]
+        return updated
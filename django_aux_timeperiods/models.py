@@ -1,5 +1,7 @@
-from django.db import models
-from django.db.models import Index
+from django.db import models, connections, router, transaction
+from django.db.models import Index, Case, When, Value, OuterRef, Subquery, ExpressionWrapper, F, Func
+from django.db.models.functions import TruncDate, Cast
+import calendar
 import datetime as dt
 from django.db.models import UniqueConstraint
 import pandas as pd
@@ -7,53 +9,207 @@ from zoneinfo import ZoneInfo
 
 
 
+def to_date(dtg, tzinfo=None):
+    ''' Returns the date of a date or datetime (aware datetimes are converted to tzinfo first) '''
+    if isinstance(dtg, dt.datetime):
+        if tzinfo and dtg.tzinfo:
+            dtg = dtg.astimezone(tzinfo)
+        return dtg.date()
+    return dtg
+
+
+def insert_on_conflict_do_nothing(obj, using=None):
+    ''' Inserts obj with INSERT ... ON CONFLICT DO NOTHING RETURNING, returns the new pk or None if a conflicting row exists.
+    using defaults to the database the router picks for writes of the model '''
+    opts = obj._meta
+    conn = connections[using or router.db_for_write(obj.__class__, instance=obj)]
+    qn = conn.ops.quote_name
+    fields = [f for f in opts.concrete_fields if f is not opts.pk]
+    sql = 'INSERT INTO %s (%s) VALUES (%s) ON CONFLICT DO NOTHING RETURNING %s' % (
+        qn(opts.db_table), ', '.join(qn(f.column) for f in fields), ', '.join(['%s'] * len(fields)), qn(opts.pk.column),
+    )
+    with conn.cursor() as cursor:
+        cursor.execute(sql, [f.get_db_prep_save(getattr(obj, f.attname), conn) for f in fields])
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+class FieldDateExpression(models.Expression):
+    ''' An expression built from the date of the field field_name once its type is known (when it is resolved against
+    the query): datetimes are truncated to their date in tzinfo, dates are used as is (AT TIME ZONE would shift them).
+    build receives the date expression and returns the expression used, outer refers to the field of the outer query
+    (for subqueries) '''
+
+    def __init__(self, field_name, build=None, tzinfo=None, outer=False):
+        super().__init__()
+        self.field_name = field_name
+        self.build = build or (lambda date: date)
+        self.tzinfo = tzinfo
+        self.outer = outer
+
+    def resolve_expression(self, query=None, allow_joins=True, reuse=None, summarize=False, for_save=False):
+        field = F(self.field_name).resolve_expression(query, allow_joins, reuse, summarize).output_field
+        ref = OuterRef(self.field_name) if self.outer else F(self.field_name)
+        if isinstance(field, models.DateTimeField):
+            date = TruncDate(ExpressionWrapper(ref, output_field=models.DateTimeField()), tzinfo=self.tzinfo)
+        else:
+            date = ExpressionWrapper(ref, output_field=models.DateField())
+        return self.build(date).resolve_expression(query, allow_joins, reuse, summarize, for_save)
+
+
+class TimePeriodQuerySet(models.QuerySet):
+    ''' QuerySet for the TimePeriod models, the boundaries are the date (first day) and end_date (last day) columns '''
+
+    def containing(self, dtg, tzinfo=None):
+        ''' Filters the periods that contain the date or datetime '''
+        date = to_date(dtg, tzinfo)
+        return self.filter(date__lte=date, end_date__gte=date)
+
+    def overlapping(self, start, end, tzinfo=None):
+        ''' Filters the periods that overlap the range start to end (inclusive) '''
+        return self.filter(date__lte=to_date(end, tzinfo), end_date__gte=to_date(start, tzinfo))
+
+    def relative_status(self, now=None, tzinfo=None):
+        ''' Annotates rel_status (past, present or future) relative to now (defaults to the current datetime) '''
+        date = to_date(now or dt.datetime.now(), tzinfo)
+        return self.annotate(rel_status=Case(
+            When(date__gt=date, then=Value('future')),
+            When(end_date__lt=date, then=Value('past')),
+            default=Value('present'), output_field=models.CharField(),
+        ))
+
+
 class TimePeriodBase(models.Model):
     ''' Base class to hold common methods for TimePeriod models '''
     id = models.BigAutoField(primary_key=True)
     freq_map = {'Year':'Y', 'Month':'M', 'Week':'W', 'Day':'D'}
     date = models.DateField(db_index=True, unique=True)
+    end_date = models.DateField(null=True, blank=True)
+
+    objects = TimePeriodQuerySet.as_manager()
+    _current_memo = {} # (model, tzinfo): (current period, start, end) see get_or_create_current_period
 
     class Meta:
         abstract = True
         ordering = ['date']
-        indexes = [Index(fields=['-date'])]
-        
+        indexes = [Index(fields=['-date']), Index(fields=['date', 'end_date'])]
+
 
     @property
     def period(self):
-        ''' property returns a pandas period object representing this instance '''
-        cname = self.__class__.__name__
-        if cname == 'Year':
-            return pd.Period(year=self.year_num, freq='Y')
-        elif cname == 'Month':
-            return pd.Period(year=self.year_num, month=self.month_num, freq='M')
-        elif cname == 'Week':
-            edate = self.end_dates[self.week_num-1]
-            return pd.Period(edate, freq='W')
-        elif cname == 'Day':
-            return pd.Period(self.date, freq='D')
+        ''' property returns a pandas period object representing this instance (only built on request,
+        the start/end/next/previous/contains methods do not use pandas) '''
+        return pd.Period(self.start_date, freq=self.freq_map[self.__class__.__name__])
+
+    @classmethod
+    def get_start_date_from(cls, date):
+        ''' Classmethod returns the first day of the period containing date (must be overwritten) '''
+        raise NotImplementedError
+
+    @classmethod
+    def shift_date(cls, date, n):
+        ''' Classmethod returns the first day of the period n periods from the one containing date (must be overwritten) '''
+        raise NotImplementedError
+
+    @classmethod
+    def get_lookup_kwargs(cls, date):
+        ''' Classmethod returns the get_or_create kwargs of the period containing date (must be overwritten) '''
+        raise NotImplementedError
+
+    @property
+    def start_date(self):
+        ''' property returns the first day of the period '''
+        raise NotImplementedError
+
+    def get_end_date(self):
+        ''' Method returns the last day of the period '''
+        return self.shift_date(self.start_date, 1) - dt.timedelta(days=1)
+
+    def set_end_date(self):
+        ''' Method sets the end_date attribute '''
+        self.end_date = self.get_end_date()
+
+    @classmethod
+    def get_containing_subquery(cls, field_name, tzinfo=None):
+        ''' Returns a Subquery of the pk of the period containing the date/datetime field field_name of the outer query,
+        i.e. Sale.objects.annotate(week_id=Week.get_containing_subquery('dtg')). tzinfo only applies to datetimes '''
+        return FieldDateExpression(
+            field_name, lambda date: Subquery(cls.objects.filter(date__lte=date, end_date__gte=date).values('pk')[:1]),
+            tzinfo=tzinfo, outer=True,
+        )
+
+    @property
+    def start_time(self):
+        ''' property returns the (naive) datetime the period starts '''
+        return dt.datetime.combine(self.start_date, dt.time.min)
+
+    @property
+    def end_time(self):
+        ''' property returns the (naive) last microsecond of the period '''
+        return dt.datetime.combine(self.get_end_date(), dt.time.max)
+
+    def contains(self, dtg):
+        ''' Method returns True if the date or datetime is inside the period '''
+        return self.start_date <= to_date(dtg) <= self.get_end_date()
+
+    def get_or_create_next(self, n=1):
+        ''' Method retreives the TimePeriod object n periods after this one '''
+        return self.get_or_create_from_date(self.shift_date(self.start_date, n))
+
+    def get_or_create_previous(self, n=1):
+        ''' Method retreives the TimePeriod object n periods before this one '''
+        return self.get_or_create_from_date(self.shift_date(self.start_date, -n))
+
+    def prepare(self):
+        ''' Method derives the attributes (and FKs) from the lookup attributes, called by save (must be overwritten) '''
+        raise NotImplementedError
+
+    def save(self, *args, **kwargs):
+        self.prepare()
+        return super().save(*args, **kwargs)
 
     @classmethod
     def get_or_create_from_date(cls, date):
-        ''' Classmethod will get or create a timeperiod object based on the passed date '''
-        cname = cls.__name__
-        sdtg = pd.Period(date, freq=cls.freq_map[cname]).start_time
-        if cname == 'Year':
-            return cls.objects.get_or_create(year_num=sdtg.year)
-        elif cname == 'Month':
-            return cls.objects.get_or_create(year_num=sdtg.year, month_num=sdtg.month)
-        elif cname == 'Week':
-            return cls.objects.get_or_create(year_num=sdtg.year, week_num=sdtg.week)
-        elif cname == 'Day':
-            return cls.objects.get_or_create(date=date)
+        ''' Classmethod will get or create a timeperiod object based on the passed date.
+        Safe under concurrent writers: a missing row is inserted with INSERT ... ON CONFLICT DO NOTHING
+        and read back if another writer inserted it first (no IntegrityError, no aborted transaction) '''
+        kwargs = cls.get_lookup_kwargs(to_date(date))
+        obj = cls.objects.filter(**kwargs).first()
+        if obj is not None:
+            return obj, False
+        obj = cls(**kwargs)
+        obj.prepare()
+        using = router.db_for_write(cls, instance=obj)
+        pk = insert_on_conflict_do_nothing(obj, using=using)
+        if pk is None:
+            return cls.objects.using(using).get(**kwargs), False
+        obj.pk = pk
+        obj._state.adding = False
+        obj._state.db = using
+        return obj, True
+
+    @classmethod
+    def clear_current_memo(cls):
+        ''' Classmethod empties the memo of get_or_create_current_period '''
+        TimePeriodBase._current_memo.clear()
 
     @classmethod
     def get_or_create_current_period(cls, tzinfo=None):
-        ''' Classmethod will create a timeperiod object that encompasses today '''
+        ''' Classmethod will create a timeperiod object that encompasses today. The object is memoized (per process)
+        until the period ends so most calls do not query the DB '''
         now = dt.datetime.now()
         if tzinfo:
             now = now.astimezone(tzinfo)
-        return cls.get_or_create_from_date(now.date())
+        key = (cls, str(tzinfo))
+        memo = TimePeriodBase._current_memo.get(key)
+        if memo and memo[1] <= now < memo[2]:
+            return memo[0], False
+        obj, created = cls.get_or_create_from_date(now.date())
+        start = obj.start_time.replace(tzinfo=now.tzinfo)
+        end = dt.datetime.combine(obj.get_end_date() + dt.timedelta(days=1), dt.time.min, tzinfo=now.tzinfo)
+        # Only memoize committed rows (a rolled back row must never be handed out)
+        transaction.on_commit(lambda: TimePeriodBase._current_memo.__setitem__(key, (obj, start, end)))
+        return obj, created
 
     @classmethod
     def get_or_create_n_from_current(cls, n=0, tzinfo=None):
@@ -61,29 +217,18 @@ class TimePeriodBase(models.Model):
         now = dt.datetime.now()
         if tzinfo:
             now = now.astimezone(tzinfo)
-        cperiod = pd.Period(now, freq=cls.freq_map[cls.__name__])
-        if n==0:
-            return cls.get_or_create_from_date(cperiod.start_time.date())
-        elif n < 0:
-            kwargs = {'end':cperiod}
-            i = 0
-        elif n > 0:
-            kwargs = {'start':cperiod}
-            i = -1
-        period = pd.period_range(**kwargs, periods=abs(n)+1)[i]
-        return cls.get_or_create_from_date(period.start_time.date())
-
+        return cls.get_or_create_from_date(cls.shift_date(now.date(), n))
 
     def get_rel_status(self, dtg=None):
         ''' Method returns the status of a TimePeriod (past, present, future) relative to the passed datetime '''
         if dtg==None:
             dtg = dt.datetime.now()
         tz = dtg.tzinfo
-        sdtg = self.period.start_time
-        edtg = self.period.end_time
+        sdtg = self.start_time
+        edtg = self.end_time
         if tz:
-            sdtg = sdtg.tz_localize(tz)
-            edtg = edtg.tz_localize(tz)
+            sdtg = sdtg.replace(tzinfo=tz)
+            edtg = edtg.replace(tzinfo=tz)
         if dtg < sdtg:
             return 'future'
         elif sdtg <= dtg <= edtg:
@@ -100,21 +245,37 @@ class Year(TimePeriodBase):
     year_num = models.PositiveSmallIntegerField(unique=True, db_index=True)
     is_leap_year = models.BooleanField()
 
+    @classmethod
+    def get_start_date_from(cls, date):
+        return dt.date(date.year, 1, 1)
+
+    @classmethod
+    def shift_date(cls, date, n):
+        return dt.date(date.year + n, 1, 1)
+
+    @classmethod
+    def get_lookup_kwargs(cls, date):
+        return {'year_num':date.year}
+
+    @property
+    def start_date(self):
+        return dt.date(self.year_num, 1, 1)
+
     def set_date(self):
         ''' Method to set the date attribute '''
-        self.date = dt.date(self.year_num, 1, 1)
+        self.date = self.start_date
 
     def set_leap_year(self):
         ''' Method to set the leap_year boolean '''
-        self.is_leap_year = self.period.is_leap_year
+        self.is_leap_year = calendar.isleap(self.year_num)
 
-    def save(self, *args, **kwargs):
+    def prepare(self):
         self.set_date()
+        self.set_end_date()
         self.set_leap_year()
-        return super().save(*args, **kwargs)
 
     def __str__(self):
-        return str(self.period)
+        return str(self.year_num)
 
 class Month(TimePeriodBase):
     ''' An instance of this model represents a month in the Gregorian Calendar.
@@ -142,9 +303,26 @@ class Month(TimePeriodBase):
         constraints = [UniqueConstraint(fields=['year_num', 'month_num'], name='unique_month')]
         indexes = TimePeriodBase.Meta.indexes + [Index(fields=['year_num', 'month_num'])] 
 
+    @classmethod
+    def get_start_date_from(cls, date):
+        return dt.date(date.year, date.month, 1)
+
+    @classmethod
+    def shift_date(cls, date, n):
+        year, month = divmod(date.year * 12 + date.month - 1 + n, 12)
+        return dt.date(year, month + 1, 1)
+
+    @classmethod
+    def get_lookup_kwargs(cls, date):
+        return {'year_num':date.year, 'month_num':date.month}
+
+    @property
+    def start_date(self):
+        return dt.date(self.year_num, self.month_num, 1)
+
     def set_date(self):
         ''' Method to derive the date attribute '''
-        self.date = dt.date(self.year_num, self.month_num, 1)
+        self.date = self.start_date
 
     def set_name(self):
         ''' Method sets the name attribute '''
@@ -152,21 +330,21 @@ class Month(TimePeriodBase):
 
     def set_abbr(self):
         ''' Method sets the abbr attribute '''
-        self.name = self.ABBR_CHOICES[self.month_num-1][0]      
+        self.abbr = self.ABBR_CHOICES[self.month_num-1][0]      
 
     def set_year(self):
         ''' Method sets the year FK attribute. Creates the instance if necessary '''
-        self.year, _ = Year.objects.get_or_create(year_num=self.year_num)
+        self.year, _ = Year.get_or_create_from_date(self.start_date)
 
-    def save(self, *args, **kwargs):
+    def prepare(self):
         self.set_date()
+        self.set_end_date()
         self.set_name()
         self.set_abbr()
         self.set_year()
-        return super().save(*args, **kwargs)
 
     def __str__(self):
-        return str(self.period)
+        return f'{self.year_num}-{str(self.month_num).zfill(2)}'
 
 class Week(TimePeriodBase):
     ''' An instance of this model represents a week in the Gregorian Calendar.
@@ -183,30 +361,42 @@ class Week(TimePeriodBase):
         constraints = [UniqueConstraint(fields=['year_num', 'week_num'], name='unique_week')]
         indexes = TimePeriodBase.Meta.indexes + [Index(fields=['year_num', 'week_num'])] 
 
+    @classmethod
+    def get_start_date_from(cls, date):
+        return date - dt.timedelta(days=date.weekday())
+
+    @classmethod
+    def shift_date(cls, date, n):
+        return cls.get_start_date_from(date) + dt.timedelta(weeks=n)
+
+    @classmethod
+    def get_lookup_kwargs(cls, date):
+        # ISO year, the days of week 1 can be in December and the days of week 52/53 in January
+        iso = date.isocalendar()
+        return {'year_num':iso[0], 'week_num':iso[1]}
+
     @property
-    def end_dates(self):
-        ''' property returns a list of week end dates for the year of this instance '''
-        start = pd.to_datetime(dt.date(self.year_num,1,1)).to_period('W').start_time
-        end = pd.to_datetime(dt.date(self.year_num,12,31)).to_period('W').end_time
-        dates = pd.date_range(start, end, freq='W')
-        if start.week != 1:
-            dates = dates[1:]
-        if end.week < 52:
-            dates = dates[:-1]
-        return dates
+    def start_date(self):
+        return dt.date.fromisocalendar(self.year_num, self.week_num, 1)
 
     def set_date(self):
         ''' Method to derive the date attribute '''
-        self.date = self.period.start_time.date()
+        self.date = self.start_date
+
+    @property
+    def year(self):
+        ''' property returns the Year of the ISO year, retrieved (or created) on first access rather than when the Week is created '''
+        if getattr(self, '_year', None) is None:
+            self.set_year()
+        return self._year
 
     def set_year(self):
-        ''' Method sets the year FK attribute. Creates the instance if necessary '''
-        self.year, _ = Year.objects.get_or_create(year_num=self.year_num)
+        ''' Method sets the year attribute (of the ISO year). Creates the instance if necessary '''
+        self._year, _ = Year.get_or_create_from_date(dt.date(self.year_num, 1, 1))
 
-    def save(self, *args, **kwargs):
+    def prepare(self):
         self.set_date()
-        self.set_year()
-        return super().save(*args, **kwargs)
+        self.set_end_date()
 
     def __str__(self):
         return f'{self.year_num} W{str(self.week_num).zfill(2)}'
@@ -219,18 +409,125 @@ class Day(TimePeriodBase):
     month = models.ForeignKey('Month', on_delete=models.SET_NULL, null=True)
     week = models.ForeignKey('Week', on_delete=models.SET_NULL, null=True)
 
+    @classmethod
+    def get_start_date_from(cls, date):
+        return date
+
+    @classmethod
+    def shift_date(cls, date, n):
+        return date + dt.timedelta(days=n)
+
+    @classmethod
+    def get_lookup_kwargs(cls, date):
+        return {'date':date}
+
+    @property
+    def start_date(self):
+        return self.date
+
     def set_month(self):
-        ''' Method sets the year FK attribute. Creates the instance if necessary '''
-        self.month, _ = Month.objects.get_or_create(year_num=self.date.year, month_num=self.date.month)
+        ''' Method sets the month FK attribute. Creates the instance if necessary '''
+        self.month, _ = Month.get_or_create_from_date(self.date)
 
     def set_week(self):
         ''' Method sets the week FK attribute. Creates the instance if necessary '''
         self.week, _ = Week.get_or_create_from_date(self.date)
 
-    def save(self, *args, **kwargs):
+    def prepare(self):
+        self.set_end_date()
         self.set_month()
         self.set_week()
-        return super().save(*args, **kwargs)
 
     def __str__(self):
-        return str(self.period)
\ No newline at end of file
+        return str(self.date)
+
+class DateDim(models.Model):
+    ''' An instance of this model is a row of the denormalized calendar dimension. The pk is the date as a
+        YYYYMMDD integer so fact tables can carry a small integer date key (see get_key/get_key_expression)
+        and roll up to any grain with a single join. Rows are created in bulk with DateDim.generate
+    '''
+    date_key = models.IntegerField(primary_key=True)
+    date = models.DateField(unique=True)
+    year = models.PositiveSmallIntegerField()
+    quarter = models.PositiveSmallIntegerField()
+    month = models.PositiveSmallIntegerField()
+    month_name = models.CharField(max_length=10)
+    day = models.PositiveSmallIntegerField()
+    day_of_year = models.PositiveSmallIntegerField()
+    iso_year = models.PositiveSmallIntegerField()
+    iso_week = models.PositiveSmallIntegerField()
+    day_of_week = models.PositiveSmallIntegerField() # ISO, Monday is 1
+    day_name = models.CharField(max_length=10)
+    year_quarter = models.IntegerField() # YYYYQ
+    year_month = models.IntegerField() # YYYYMM
+    iso_year_week = models.IntegerField() # YYYYWW
+    is_weekend = models.BooleanField()
+    is_week_start = models.BooleanField()
+    is_week_end = models.BooleanField()
+    is_month_start = models.BooleanField()
+    is_month_end = models.BooleanField()
+    is_quarter_start = models.BooleanField()
+    is_quarter_end = models.BooleanField()
+    is_year_start = models.BooleanField()
+    is_year_end = models.BooleanField()
+
+    class Meta:
+        ordering = ['date_key']
+        indexes = [
+            Index(fields=['year_month', 'date_key']), Index(fields=['year_quarter', 'date_key']),
+            Index(fields=['iso_year_week', 'date_key']), Index(fields=['year', 'date_key']),
+        ]
+
+    @staticmethod
+    def get_key(date):
+        ''' Returns the YYYYMMDD integer key of a date or datetime '''
+        return date.year * 10000 + date.month * 100 + date.day
+
+    @staticmethod
+    def get_key_expression(field_name, tzinfo=None):
+        ''' Returns an expression computing the YYYYMMDD key of a date/datetime field in the DB,
+        i.e. Sale.objects.annotate(date_key=DateDim.get_key_expression('dtg')). tzinfo only applies to datetimes '''
+        return FieldDateExpression(
+            field_name, lambda date: Cast(Func(date, Value('YYYYMMDD'), function='to_char'), models.IntegerField()),
+            tzinfo=tzinfo,
+        )
+
+    @classmethod
+    def from_date(cls, date):
+        ''' Returns an (unsaved) instance with every attribute derived from date '''
+        iso_year, iso_week, day_of_week = date.isocalendar()
+        quarter = (date.month - 1) // 3 + 1
+        month_end = calendar.monthrange(date.year, date.month)[1]
+        return cls(
+            date_key=cls.get_key(date), date=date, year=date.year, quarter=quarter, month=date.month,
+            month_name=calendar.month_name[date.month], day=date.day, day_of_year=date.timetuple().tm_yday,
+            iso_year=iso_year, iso_week=iso_week, day_of_week=day_of_week, day_name=calendar.day_name[date.weekday()],
+            year_quarter=date.year * 10 + quarter, year_month=date.year * 100 + date.month,
+            iso_year_week=iso_year * 100 + iso_week, is_weekend=day_of_week > 5,
+            is_week_start=day_of_week == 1, is_week_end=day_of_week == 7,
+            is_month_start=date.day == 1, is_month_end=date.day == month_end,
+            is_quarter_start=date.day == 1 and date.month % 3 == 1,
+            is_quarter_end=date.day == month_end and date.month % 3 == 0,
+            is_year_start=(date.month, date.day) == (1, 1), is_year_end=(date.month, date.day) == (12, 31),
+        )
+
+    @classmethod
+    def generate(cls, start, end, batch_size=None):
+        ''' Classmethod creates the rows from start to end (inclusive) with a single bulk insert (existing rows are kept) '''
+        days = [start + dt.timedelta(days=i) for i in range((end - start).days + 1)]
+        return cls.objects.bulk_create([cls.from_date(d) for d in days], batch_size=batch_size, ignore_conflicts=True)
+
+    def __str__(self):
+        return str(self.date)
+
+
+class RollupState(models.Model):
+    ''' Bookkeeping of the incremental refreshes of a rollup model (see django_aux_timeperiods.rollups.RollupBase) '''
+    rollup = models.CharField(max_length=200, unique=True) # app_label.ModelName of the rollup model
+    high_water_mark = models.TextField(null=True, blank=True) # last aggregated value of the source's high water mark field
+    refreshed_at = models.DateTimeField(auto_now=True)
+    full_refresh = models.BooleanField(default=False) # whether the last refresh was a full rebuild
+    row_count = models.PositiveIntegerField(null=True) # number of rollup rows written by the last refresh
+
+    def __str__(self):
+        return f'{self.rollup} | {self.high_water_mark}'
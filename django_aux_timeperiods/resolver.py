@@ -0,0 +1,119 @@
+import datetime as dt
+import threading
+
+import numpy as np
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from django_aux_timeperiods.models import TimePeriodBase, Year, Month, Week, Day
+from django_aux_timeperiods.utils import generate_calendar
+
+
+class PeriodResolver:
+    """ Process wide cache that answers date -> (day_id, week_id, month_id, year_id).
+        The ids of the whole calendar are loaded once into a numpy array indexed by date ordinal, missing
+        dates are created with generate_calendar (one bulk insert per model) and read back on first use.
+        Use the module level period_resolver instance. Ids cached inside a transaction that is
+        later rolled back stay cached, call clear() after a rollback.
+    """
+    columns = ['day_id', 'week_id', 'month_id', 'year_id']
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.clear()
+
+    def clear(self):
+        ''' Empties the cache, it is reloaded on the next lookup '''
+        with self.lock:
+            self.loaded = False
+            self.base = None # ordinal of the first row of ids
+            self.ids = np.zeros((0, 4), dtype=np.int64)
+
+    def store(self, rows):
+        ''' Stores rows of (date, day_id, week_id, month_id, year_id), growing the array when needed '''
+        rows = list(rows)
+        if not rows:
+            return
+        ordinals = np.array([row[0].toordinal() for row in rows], dtype=np.int64)
+        values = np.array([[v or 0 for v in row[1:]] for row in rows], dtype=np.int64)
+        with self.lock:
+            lo, hi = ordinals.min(), ordinals.max()
+            if self.base is None:
+                self.base, self.ids = lo, np.zeros((hi - lo + 1, 4), dtype=np.int64)
+            elif lo < self.base or hi >= self.base + len(self.ids):
+                base = min(lo, self.base)
+                ids = np.zeros((max(hi, self.base + len(self.ids) - 1) - base + 1, 4), dtype=np.int64)
+                ids[self.base - base:self.base - base + len(self.ids)] = self.ids
+                self.base, self.ids = base, ids
+            self.ids[ordinals - self.base] = values
+
+    def load(self, start=None, end=None):
+        ''' Loads the ids of the Days from start to end (defaults to every Day) '''
+        qs = Day.objects.all()
+        if start:
+            qs = qs.filter(date__gte=start)
+        if end:
+            qs = qs.filter(date__lte=end)
+        self.store(qs.values_list('date', 'id', 'week_id', 'month_id', 'month__year_id').order_by())
+        self.loaded = True
+
+    def lookup(self, ordinals):
+        ''' Returns the cached ids (n x 4 array, rows of zeros where missing) of an array of date ordinals '''
+        ids = np.zeros((len(ordinals), 4), dtype=np.int64)
+        if self.base is None:
+            return ids
+        idx = ordinals - self.base
+        found = (idx >= 0) & (idx < len(self.ids))
+        ids[found] = self.ids[idx[found]]
+        return ids
+
+    def resolve_ordinals(self, ordinals, create=True):
+        """Returns the (day_id, week_id, month_id, year_id) of each date ordinal as a n x 4 int64 array
+
+        Args:
+            ordinals (np.ndarray): date ordinals (see datetime.date.toordinal)
+            create (bool, optional): Create the missing periods. Defaults to True
+        """
+        ordinals = np.asarray(ordinals, dtype=np.int64)
+        with self.lock:
+            if not self.loaded:
+                self.load()
+            ids = self.lookup(ordinals)
+            missing = ordinals[ids[:, 0] == 0]
+            if len(missing) and create:
+                start, end = dt.date.fromordinal(int(missing.min())), dt.date.fromordinal(int(missing.max()))
+                generate_calendar(start, end)
+                self.load(start, end)
+                ids = self.lookup(ordinals)
+        return ids
+
+    def resolve_many(self, dates, create=True):
+        ''' Returns a list of (day_id, week_id, month_id, year_id) tuples (None where missing) for dates '''
+        ordinals = np.fromiter((d.toordinal() for d in dates), dtype=np.int64)
+        ids = self.resolve_ordinals(ordinals, create=create)
+        return [tuple(int(v) for v in row) if row[0] else None for row in ids]
+
+    def resolve(self, date, create=True):
+        ''' Returns the (day_id, week_id, month_id, year_id) of the date (or datetime) '''
+        return self.resolve_many([date], create=create)[0]
+
+
+period_resolver = PeriodResolver()
+
+
+@receiver(post_save, sender=Day)
+def update_period_resolver(sender, instance, **kwargs):
+    ''' Keeps the resolver current when Days are saved in this process '''
+    if period_resolver.loaded:
+        year_id = instance.month.year_id if instance.month_id else None
+        period_resolver.store([(instance.date, instance.id, instance.week_id, instance.month_id, year_id)])
+
+
+@receiver(post_delete, sender=Day)
+@receiver(post_delete, sender=Week)
+@receiver(post_delete, sender=Month)
+@receiver(post_delete, sender=Year)
+def clear_period_resolver(sender, **kwargs):
+    ''' Deleting periods (or nulling Day FKs) invalidates the resolver and the current period memo '''
+    period_resolver.clear()
+    TimePeriodBase.clear_current_memo()
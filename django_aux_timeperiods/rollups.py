@@ -0,0 +1,233 @@
+import datetime as dt
+from zoneinfo import ZoneInfo
+
+from django.apps import apps
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import F, Max
+from django.db.models.functions import Trunc
+from django.utils import timezone
+
+from django_aux_timeperiods.models import RollupState
+from django_aux_timeperiods.utils import generate_calendar
+
+
+class RollupBase(models.Model):
+    ''' Abstract base class of a rollup table: the rows of a (large) source model aggregated by time period
+        and dimensions. Subclasses declare a "period" FK (to Day, Week, Month or Year, which sets the grain),
+        a field per dimension and aggregate, and how they are computed from the source
+
+        i.e.
+        class SaleMonthRollup(RollupBase):
+            period = models.ForeignKey(Month, on_delete=models.CASCADE)
+            category = models.CharField(max_length=50)
+            total = models.FloatField(null=True)
+            n = models.IntegerField()
+
+            rollup_source = 'sales.Sale'
+            rollup_datetime_field = 'dtg'
+            rollup_dimensions = ['category']
+            rollup_aggregates = {'total':Sum('amount'), 'n':Count('id')}
+            rollup_count_field = 'n'
+
+        refresh() only re-aggregates the periods holding source rows past the high water mark (the pk, or
+        rollup_high_water_mark_field i.e. an auto_now timestamp), rebuild() recomputes the whole table.
+        Rows committed late with a lower mark (concurrent transactions) are caught as long as they are within
+        rollup_rescan_window of the previous mark, the rows in the window are re-aggregated on every refresh.
+        Updates are only picked up with an auto_now high water mark field. Deleted source rows, rows moved to
+        another period and rows committed later than the window allows need a rebuild (refresh_rollups --full).
+        The rollup is a regular model so the filters, tables and plot mixins can read from it directly
+    '''
+    rollup_source = None # model (or "app_label.ModelName") the rows are aggregated from
+    rollup_datetime_field = None # date/datetime field of the source that places a row in a period
+    rollup_dimensions = [] # source lookups grouped by, or a dict of {rollup field: source lookup}
+    rollup_aggregates = {} # {rollup field: aggregate expression over the source}
+    rollup_count_field = None # aggregate field holding the number of source rows (used as N by the plot mixins)
+    rollup_high_water_mark_field = None # monotonically increasing source field. Defaults to the pk
+    rollup_rescan_window = None # amount below the high water mark re-scanned by refresh. Defaults to 1000 pks or 15 minutes
+    rollup_period_field = 'period'
+    rollup_timezone = None # timezone the datetimes are bucketed in. Defaults to the current timezone
+    rollup_batch_size = 5000
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def get_rollup_label(cls):
+        return f'{cls._meta.app_label}.{cls.__name__}'
+
+    @classmethod
+    def get_source_model(cls):
+        if isinstance(cls.rollup_source, str):
+            return apps.get_model(cls.rollup_source)
+        return cls.rollup_source
+
+    @classmethod
+    def get_source_queryset(cls):
+        ''' Returns the queryset of the rows aggregated, override to filter the source '''
+        return cls.get_source_model()._default_manager.all()
+
+    @classmethod
+    def get_period_model(cls):
+        return cls._meta.get_field(cls.rollup_period_field).related_model
+
+    @classmethod
+    def get_dimensions(cls):
+        ''' Returns the dimensions as {rollup field: source lookup} '''
+        if isinstance(cls.rollup_dimensions, dict):
+            return dict(cls.rollup_dimensions)
+        return {lookup: lookup for lookup in cls.rollup_dimensions}
+
+    @classmethod
+    def get_tzinfo(cls):
+        if isinstance(cls.rollup_timezone, str):
+            return ZoneInfo(cls.rollup_timezone)
+        return cls.rollup_timezone or timezone.get_current_timezone()
+
+    @classmethod
+    def get_high_water_mark_field(cls):
+        source = cls.get_source_model()
+        return source._meta.get_field(cls.rollup_high_water_mark_field or source._meta.pk.name)
+
+    @classmethod
+    def get_rescan_window(cls):
+        ''' Returns the amount subtracted from the high water mark to get the lower bound of an incremental refresh '''
+        if cls.rollup_rescan_window is not None:
+            return cls.rollup_rescan_window
+        if isinstance(cls.get_high_water_mark_field(), models.DateField):
+            return dt.timedelta(minutes=15)
+        return 1000
+
+    @classmethod
+    def get_bucket_expression(cls):
+        ''' Returns the expression of the first day of the period a source row falls in (which is the period's date) '''
+        field = cls.get_source_model()._meta.get_field(cls.rollup_datetime_field)
+        kind = cls.get_period_model().__name__.lower()
+        if isinstance(field, models.DateTimeField):
+            return Trunc(cls.rollup_datetime_field, kind, output_field=models.DateField(), tzinfo=cls.get_tzinfo())
+        return Trunc(cls.rollup_datetime_field, kind, output_field=models.DateField())
+
+    @classmethod
+    def get_bucket_bounds(cls, buckets):
+        ''' Returns the (start, end) half-open range of the source field covering the periods starting on buckets '''
+        start, end = min(buckets), cls.get_period_model().shift_date(max(buckets), 1)
+        field = cls.get_source_model()._meta.get_field(cls.rollup_datetime_field)
+        if isinstance(field, models.DateTimeField):
+            start, end = dt.datetime.combine(start, dt.time.min), dt.datetime.combine(end, dt.time.min)
+            if settings.USE_TZ:
+                start, end = timezone.make_aware(start, cls.get_tzinfo()), timezone.make_aware(end, cls.get_tzinfo())
+        return start, end
+
+    @classmethod
+    def get_period_ids(cls, buckets):
+        ''' Returns {date: period pk} of the periods starting on buckets, missing periods are created with generate_calendar '''
+        period_model = cls.get_period_model()
+        start, end = min(buckets), max(buckets)
+        qs = period_model.objects.filter(date__gte=start, date__lte=end)
+        ids = dict(qs.values_list('date', 'id'))
+        if any(bucket not in ids for bucket in buckets):
+            generate_calendar(start, end)
+            ids = dict(qs.values_list('date', 'id'))
+        return ids
+
+    @classmethod
+    def get_rollup_queryset(cls, buckets=None):
+        """Returns the values queryset aggregating the source by period (_rollup_bucket) and dimensions
+
+        Args:
+            buckets (list, optional): only aggregate the periods starting on these dates. Defaults to every period
+        """
+        dimensions = cls.get_dimensions()
+        qs = cls.get_source_queryset().annotate(_rollup_bucket=cls.get_bucket_expression())
+        if buckets is not None:
+            start, end = cls.get_bucket_bounds(buckets)
+            qs = qs.filter(**{
+                f'{cls.rollup_datetime_field}__gte':start, f'{cls.rollup_datetime_field}__lt':end,
+                '_rollup_bucket__in':buckets,
+            })
+        return qs.values(
+            '_rollup_bucket', **{f'_rollup_dim_{name}':F(lookup) for name, lookup in dimensions.items()}
+        ).annotate(
+            **{f'_rollup_agg_{name}':agg for name, agg in cls.rollup_aggregates.items()}
+        ).order_by()
+
+    @classmethod
+    def write_rollup(cls, buckets, full=False):
+        """Replaces the rollup rows of the periods starting on buckets (every row if full) with freshly aggregated ones
+
+        Returns:
+            int: number of rollup rows written
+        """
+        period_attname = cls._meta.get_field(cls.rollup_period_field).attname
+        attnames = {name:cls._meta.get_field(name).attname for name in cls.get_dimensions()}
+        attnames.update({name:cls._meta.get_field(name).attname for name in cls.rollup_aggregates})
+        period_ids = cls.get_period_ids(buckets) if buckets else {}
+        existing = cls._default_manager.all()
+        if not full:
+            existing = existing.filter(**{f'{period_attname}__in':[period_ids[bucket] for bucket in buckets]})
+        existing.delete()
+        if not buckets:
+            return 0
+        written, batch = 0, []
+        for row in cls.get_rollup_queryset(buckets=buckets).iterator(chunk_size=cls.rollup_batch_size):
+            kwargs = {period_attname:period_ids[row['_rollup_bucket']]}
+            for name, attname in attnames.items():
+                kwargs[attname] = row.get(f'_rollup_dim_{name}', row.get(f'_rollup_agg_{name}'))
+            batch.append(cls(**kwargs))
+            if len(batch) >= cls.rollup_batch_size:
+                cls._default_manager.bulk_create(batch)
+                written += len(batch)
+                batch = []
+        cls._default_manager.bulk_create(batch)
+        return written + len(batch)
+
+    @classmethod
+    def refresh(cls, full=False):
+        """Brings the rollup up to date. Only the periods holding source rows past the high water mark (minus the
+            rescan window) are re-aggregated, unless full is set or the rollup was never built
+
+        Args:
+            full (bool, optional): rebuild the whole table. Defaults to False
+
+        Returns:
+            RollupState: the bookkeeping instance
+        """
+        hwm_field = cls.get_high_water_mark_field()
+        qs = cls.get_source_queryset()
+        with transaction.atomic():
+            state, _ = RollupState.objects.select_for_update().get_or_create(rollup=cls.get_rollup_label())
+            full = full or state.high_water_mark is None
+            if not full:
+                previous = hwm_field.to_python(state.high_water_mark)
+                qs = qs.filter(**{f'{hwm_field.name}__gt':previous - cls.get_rescan_window()})
+            high_water_mark = qs.aggregate(hwm=Max(hwm_field.name))['hwm']
+            if high_water_mark is None and not full:
+                return state
+            if high_water_mark is not None and not full:
+                qs = qs.filter(**{f'{hwm_field.name}__lte':high_water_mark})
+                high_water_mark = max(high_water_mark, previous) # rows in the window may have been deleted
+            buckets = sorted(set(
+                qs.annotate(_rollup_bucket=cls.get_bucket_expression()).values_list('_rollup_bucket', flat=True).distinct()
+            ) - {None})
+            state.row_count = cls.write_rollup(buckets, full=full)
+            state.full_refresh = full
+            if high_water_mark is not None:
+                state.high_water_mark = str(high_water_mark)
+            state.save()
+        return state
+
+    @classmethod
+    def rebuild(cls):
+        ''' Recomputes the whole rollup table '''
+        return cls.refresh(full=True)
+
+
+def get_rollup_models(model_labels=None):
+    """Returns the rollup models (or the models in model_labels)
+
+    Args:
+        model_labels (list, optional): list of "app_label.ModelName" strings. Defaults to every concrete RollupBase subclass
+    """
+    if model_labels:
+        return [apps.get_model(label) for label in model_labels]
+    return [m for m in apps.get_models() if issubclass(m, RollupBase)]
@@ -0,0 +1,190 @@
+import calendar
+import datetime as dt
+
+import numpy as np
+import pandas as pd
+from django.db import transaction
+
+from django_aux_timeperiods.models import Year, Month, Week, Day
+
+
+def get_calendar_rows(start, end):
+    """Computes (in memory) the Year, Month, Week and Day rows covering the dates from start to end (inclusive)
+
+    Args:
+        start (date): first day of the calendar
+        end (date): last day of the calendar
+
+    Returns:
+        dict: {'days':[date, ...], 'years':[year_num, ...], 'months':[(year_num, month_num), ...],
+            'weeks':[(iso year_num, week_num), ...]}
+    """
+    days = [start + dt.timedelta(days=i) for i in range((end - start).days + 1)]
+    return dict(
+        days=days,
+        years=sorted({d.year for d in days}),
+        months=sorted({(d.year, d.month) for d in days}),
+        weeks=sorted({tuple(d.isocalendar())[:2] for d in days}),
+    )
+
+
+def generate_calendar(start, end, batch_size=None):
+    """Creates every Year, Month, Week and Day from start to end (inclusive) with one bulk insert per model
+        and one read-back per level to resolve the FKs. Existing rows are left untouched (ignore_conflicts)
+        so it can be re-run over a partial calendar.
+
+    Args:
+        start (date): first day of the calendar
+        end (date): last day of the calendar
+        batch_size (int, optional): passed to bulk_create
+
+    Returns:
+        dict: number of rows covering the range for each model, i.e. {'Year':2, 'Month':13, 'Week':54, 'Day':367}
+    """
+    if isinstance(start, dt.datetime):
+        start = start.date()
+    if isinstance(end, dt.datetime):
+        end = end.date()
+    rows = get_calendar_rows(start, end)
+    with transaction.atomic():
+        Year.objects.bulk_create([
+            Year(year_num=y, date=dt.date(y, 1, 1), end_date=dt.date(y, 12, 31), is_leap_year=calendar.isleap(y))
+            for y in rows['years']
+        ], batch_size=batch_size, ignore_conflicts=True)
+        year_ids = dict(Year.objects.filter(year_num__in=rows['years']).values_list('year_num', 'id'))
+
+        Month.objects.bulk_create([
+            Month(
+                year_num=y, month_num=m, date=dt.date(y, m, 1), end_date=dt.date(y, m, calendar.monthrange(y, m)[1]),
+                year_id=year_ids[y],
+                name=Month.NAME_CHOICES[m-1][0], abbr=Month.ABBR_CHOICES[m-1][0],
+            ) for y, m in rows['months']
+        ], batch_size=batch_size, ignore_conflicts=True)
+        month_ids = {
+            (y, m):pk for y, m, pk in Month.objects.filter(
+                date__gte=start.replace(day=1), date__lte=end,
+            ).values_list('year_num', 'month_num', 'id')
+        }
+
+        Week.objects.bulk_create([
+            Week(
+                year_num=y, week_num=w, date=dt.date.fromisocalendar(y, w, 1), end_date=dt.date.fromisocalendar(y, w, 7),
+            ) for y, w in rows['weeks']
+        ], batch_size=batch_size, ignore_conflicts=True)
+        week_ids = {
+            (y, w):pk for y, w, pk in Week.objects.filter(
+                date__gte=start - dt.timedelta(days=start.weekday()), date__lte=end,
+            ).values_list('year_num', 'week_num', 'id')
+        }
+
+        Day.objects.bulk_create([
+            Day(
+                date=d, end_date=d, month_id=month_ids[(d.year, d.month)], week_id=week_ids[tuple(d.isocalendar())[:2]],
+            ) for d in rows['days']
+        ], batch_size=batch_size, ignore_conflicts=True)
+    return {'Year':len(rows['years']), 'Month':len(rows['months']), 'Week':len(rows['weeks']), 'Day':len(rows['days'])}
+
+
+PERIOD_LEVELS = ['day', 'week', 'month', 'year']
+
+
+def get_period_keys(ser, timezone=None):
+    """Computes (vectorized) the calendar keys of a datetime Series
+
+    Args:
+        ser (pd.Series): datetimes (tz-aware or naive, naive values are taken to be in timezone already)
+        timezone (str or tzinfo, optional): aware values are converted to this timezone first
+
+    Returns:
+        tuple: (keys, nat) keys is a dict of int64 arrays: day (days since 1970-01-01), week (day key of the
+            ISO week's Monday), month (months since 1970-01), year (year number). nat is the mask of missing values
+    """
+    ser = pd.to_datetime(ser)
+    if ser.dt.tz is not None:
+        if timezone:
+            ser = ser.dt.tz_convert(timezone)
+        ser = ser.dt.tz_localize(None)
+    nat = ser.isna().to_numpy()
+    days = ser.to_numpy().astype('datetime64[D]')
+    days[nat] = np.datetime64('1970-01-01')
+    day_keys = days.astype(np.int64)
+    # 1970-01-01 was a Thursday, Monday based weekday = (days + 3) % 7
+    week_keys = day_keys - (day_keys + 3) % 7
+    month_keys = days.astype('datetime64[M]').astype(np.int64)
+    year_keys = days.astype('datetime64[Y]').astype(np.int64) + 1970
+    return dict(day=day_keys, week=week_keys, month=month_keys, year=year_keys), nat
+
+
+def get_period_lookup(level, lo, hi):
+    ''' Returns an array of the pks of the periods of level with keys lo to hi (0 where missing), one query '''
+    epoch = dt.date(1970, 1, 1)
+    lut = np.zeros(hi - lo + 1, dtype=np.int64)
+    if level == 'year':
+        rows = Year.objects.filter(year_num__gte=lo, year_num__lte=hi).values_list('year_num', 'id')
+    else:
+        model = {'day':Day, 'week':Week, 'month':Month}[level]
+        if level == 'month':
+            start = dt.date(1970 + lo // 12, lo % 12 + 1, 1)
+            end = dt.date(1970 + hi // 12, hi % 12 + 1, 1)
+        else:
+            start, end = epoch + dt.timedelta(days=int(lo)), epoch + dt.timedelta(days=int(hi))
+        qs = model.objects.filter(date__gte=start, date__lte=end).values_list('date', 'id')
+        if level == 'month':
+            rows = [((d.year - 1970) * 12 + d.month - 1, pk) for d, pk in qs]
+        else:
+            rows = [((d - epoch).days, pk) for d, pk in qs]
+    for key, pk in rows:
+        lut[key - lo] = pk
+    return lut
+
+
+def map_periods(ser, timezone=None, levels=PERIOD_LEVELS, create=True):
+    """Maps a datetime Series to the pks of its Day, Week, Month and Year. The calendar keys are computed
+        with numpy and each level is resolved with a single query into a lookup array,
+        so the cost does not grow with the number of rows beyond a few vectorized passes.
+
+    Args:
+        ser (pd.Series): datetimes (tz-aware or naive, naive values are taken to be in timezone already)
+        timezone (str or tzinfo, optional): aware values are converted to this timezone first
+        levels (list, optional): any of day, week, month, year. Defaults to all
+        create (bool, optional): create the missing periods with generate_calendar. Defaults to True
+
+    Returns:
+        pd.DataFrame: <level>_id columns (int64, Int64 when there are missing values) with the index of ser
+    """
+    keys, nat = get_period_keys(ser, timezone=timezone)
+    df = pd.DataFrame(index=ser.index)
+    if nat.all():
+        for level in levels:
+            df[f'{level}_id'] = pd.array([None] * len(ser), dtype='Int64')
+        return df
+    valid = ~nat
+    bounds = {level:(int(keys[level][valid].min()), int(keys[level][valid].max())) for level in levels}
+    luts = {level:get_period_lookup(level, *bounds[level]) for level in levels}
+    missing = any((luts[level][keys[level][valid] - bounds[level][0]] == 0).any() for level in levels)
+    if missing and create:
+        epoch = dt.date(1970, 1, 1)
+        day_keys = keys['day'][valid]
+        generate_calendar(
+            epoch + dt.timedelta(days=int(day_keys.min())), epoch + dt.timedelta(days=int(day_keys.max())),
+        )
+        luts = {level:get_period_lookup(level, *bounds[level]) for level in levels}
+    for level in levels:
+        ids = luts[level][np.where(valid, keys[level] - bounds[level][0], 0)]
+        found = valid & (ids > 0)
+        df[f'{level}_id'] = ids if found.all() else pd.arrays.IntegerArray(ids, ~found)
+    return df
+
+
+def get_date_keys(ser, timezone=None):
+    """Returns the YYYYMMDD DateDim keys of a datetime Series (int64, Int64 when there are missing values)
+
+    Args:
+        ser (pd.Series): datetimes (tz-aware or naive, naive values are taken to be in timezone already)
+        timezone (str or tzinfo, optional): aware values are converted to this timezone first
+    """
+    ser = pd.to_datetime(ser)
+    if ser.dt.tz is not None and timezone:
+        ser = ser.dt.tz_convert(timezone)
+    keys = ser.dt.year * 10000 + ser.dt.month * 100 + ser.dt.day
+    return keys.astype('Int64') if keys.isna().any() else keys.astype(np.int64)
@@ -6,7 +6,7 @@ from django_filters.views import FilterView
 from django_tables2.export.views import ExportMixin
 from django_tables2 import SingleTableMixin
 from django.http import HttpResponseRedirect
-from django_aux.views import SaveFilterMixin, RedirectPrevMixin, InlineFormsetMixin, PlotlyMixin, DeleteProtectedView
+from django_aux.views import SaveFilterMixin, RedirectPrevMixin, InlineFormsetMixin, PlotlyMixin, DeleteProtectedView, BulkActionMixin
 from main.tables import *
 from main.filters import *
 from main.models import *
@@ -140,35 +140,19 @@ class SaleLookup(SaleBase, ExportMixin, SaveFilterMixin, FilterView):
         return context
 
 
-class SaleLookupButtons(SaleBase, ExportMixin, SaveFilterMixin, FilterView):
+class SaleLookupButtons(SaleBase, BulkActionMixin, ExportMixin, SaveFilterMixin, FilterView):
     template_name = 'django_aux/form-table.html'
-
-    def get_submit_buttons(self):
-        return [
-            {'name':'delete', 'display':'Delete Selected Objects'},
-            {'name':'make_misc', 'display':'Change Category to Misc'},
-        ]
+    bulk_actions = {
+        'delete': {'display':'Delete Selected Objects', 'delete':True},
+        'make_misc': {'display':'Change Category to Misc', 'update':{'category':'misc'}},
+    }
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         context['sub_header'] = 'Sale Lookup'
         context['export_csv'] = True
-        context['checkbox_col_name'] = 'checked_id'
-        context['submit_buttons'] = self.get_submit_buttons()
         return context
 
-    def post(self, request, *args, **kwargs):
-        qs = Sale.objects.filter(id__in=request.POST.getlist('checked_id'))
-        if 'delete' in request.POST:
-            qs.delete()
-            
-        if 'make_misc' in request.POST:
-            for obj in qs.exclude(category='misc'):
-                obj.category = 'misc'
-                obj.save()
-
-        return HttpResponseRedirect(reverse('sale-lookup-buttons'))
-
 
 
 class SaleLookupWithForm(SaleBase, ExportMixin, SaveFilterMixin, FilterView):
@@ -0,0 +1,181 @@
+# Generated by Django 4.2.30 on 2026-10-19 13:40
+
+from django.conf import settings
+import django.contrib.postgres.constraints
+import django.contrib.postgres.fields.ranges
+from django.db import migrations, models
+import django.db.models.deletion
+import django_aux.models
+import simple_history.models
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('django_aux_timeperiods', '0005_rollupstate'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AwardCeremony',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HistoricalProject',
+            fields=[
+                ('id', models.BigIntegerField(auto_created=True, blank=True, db_index=True, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('status', models.CharField(default='open', max_length=20)),
+                ('history_id', models.AutoField(primary_key=True, serialize=False)),
+                ('history_date', models.DateTimeField(db_index=True)),
+                ('history_change_reason', models.CharField(max_length=100, null=True)),
+                ('history_type', models.CharField(choices=[('+', 'Created'), ('~', 'Changed'), ('-', 'Deleted')], max_length=1)),
+            ],
+            options={
+                'verbose_name': 'historical project',
+                'verbose_name_plural': 'historical projects',
+                'ordering': ('-history_date', '-history_id'),
+                'get_latest_by': ('history_date', 'history_id'),
+            },
+            bases=(simple_history.models.HistoricalChanges, models.Model),
+        ),
+        migrations.CreateModel(
+            name='Person',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('uuid', models.UUIDField(default=uuid.uuid4, editable=False)),
+                ('last_name', models.CharField(max_length=100, null=True)),
+                ('first_name', models.CharField(max_length=100, null=True)),
+                ('middle_name', models.CharField(blank=True, max_length=100, null=True)),
+                ('salary', models.FloatField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PersonAward',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='PersonNote',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.CharField(max_length=100)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Project',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('status', models.CharField(default='open', max_length=20)),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='RoomBooking',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+            ],
+            bases=(django_aux.models.CheckOverlapMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='Shift',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('start', models.DateTimeField()),
+                ('end', models.DateTimeField()),
+                ('person', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tests.person')),
+            ],
+            bases=(django_aux.models.CheckOverlapMixin, models.Model),
+        ),
+        migrations.CreateModel(
+            name='SaleMonthRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total', models.FloatField(null=True)),
+                ('n', models.IntegerField()),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='django_aux_timeperiods.month')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='SaleDayRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('category', models.CharField(max_length=50)),
+                ('total', models.FloatField(null=True)),
+                ('n', models.IntegerField()),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='django_aux_timeperiods.day')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='Sale',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('dtg', models.DateTimeField(null=True)),
+                ('category', models.CharField(max_length=50)),
+                ('amount', models.FloatField()),
+                ('day', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='django_aux_timeperiods.day')),
+                ('month', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='django_aux_timeperiods.month')),
+                ('week', models.ForeignKey(null=True, on_delete=django.db.models.deletion.PROTECT, to='django_aux_timeperiods.week')),
+            ],
+            options={
+                'abstract': False,
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='roombooking',
+            constraint=models.CheckConstraint(check=models.Q(('end__gt', models.F('start'))), name='check_range_tests_roombooking', violation_error_message='end must be larger than start'),
+        ),
+        migrations.AddConstraint(
+            model_name='roombooking',
+            constraint=django.contrib.postgres.constraints.ExclusionConstraint(expressions=[(models.Func(models.F('start'), models.F('end'), django.contrib.postgres.fields.ranges.RangeBoundary(inclusive_upper=False), function='TSTZRANGE', output_field=django.contrib.postgres.fields.ranges.DateTimeRangeField()), '&&')], name='exclude_overlap_tests_roombooking'),
+        ),
+        migrations.AddField(
+            model_name='personnote',
+            name='person',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='tests.person'),
+        ),
+        migrations.AddField(
+            model_name='personaward',
+            name='person',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='tests.person'),
+        ),
+        migrations.AddField(
+            model_name='historicalproject',
+            name='history_relation',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='log', to='tests.project'),
+        ),
+        migrations.AddField(
+            model_name='historicalproject',
+            name='history_user',
+            field=models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AddField(
+            model_name='awardceremony',
+            name='award',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='tests.personaward'),
+        ),
+        migrations.AddConstraint(
+            model_name='shift',
+            constraint=models.CheckConstraint(check=models.Q(('end__gt', models.F('start'))), name='check_range_tests_shift', violation_error_message='end must be larger than start'),
+        ),
+        migrations.AddConstraint(
+            model_name='saledayrollup',
+            constraint=models.UniqueConstraint(fields=('period', 'category'), name='unique_sale_day_rollup'),
+        ),
+    ]
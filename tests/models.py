@@ -1,4 +1,9 @@
 from django.db import models
+from django.db.models import Count, Sum
+from django_aux.models import CheckOverlapMixin, ModelBase, get_range_constraint, get_overlap_constraint
+from django_aux_timeperiods.models import Day, Week, Month
+from django_aux_timeperiods.mixins import PeriodFKMixin
+from django_aux_timeperiods.rollups import RollupBase
 import uuid
 import names
 import random
@@ -63,3 +68,98 @@ class Person(models.Model):
 
     def __str__(self):
         return self.full_name
+
+
+
+class PersonAward(models.Model):
+    ''' An award given to a Person (deleted along with the Person) '''
+    person = models.ForeignKey('Person', on_delete=models.CASCADE)
+    name = models.CharField(max_length=100)
+
+
+class AwardCeremony(models.Model):
+    ''' A ceremony where an award was presented (protects the award from deletion) '''
+    award = models.ForeignKey('PersonAward', on_delete=models.PROTECT)
+
+
+class PersonNote(models.Model):
+    ''' A note about a Person that protects the Person from deletion '''
+    person = models.ForeignKey('Person', on_delete=models.PROTECT)
+    text = models.CharField(max_length=100)
+
+
+class Shift(CheckOverlapMixin, models.Model):
+    ''' A work shift of a Person (shifts of the same Person cannot overlap) '''
+    person = models.ForeignKey('Person', on_delete=models.CASCADE)
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    start_attr = 'start'
+    end_attr = 'end'
+    extra_filter_attrs = ['person']
+    clean_during_save = False
+
+    class Meta:
+        constraints = [get_range_constraint('check_range_tests_shift', 'start', 'end')]
+
+    def __str__(self):
+        return f'{self.person_id} | {self.start} - {self.end}'
+
+
+class RoomBooking(CheckOverlapMixin, models.Model):
+    ''' A booking of the (single) meeting room, overlaps are excluded by the DB '''
+    start = models.DateTimeField()
+    end = models.DateTimeField()
+    start_attr = 'start'
+    end_attr = 'end'
+    include_end_boundary = False
+    clean_during_save = False
+
+    class Meta:
+        constraints = [
+            get_range_constraint('check_range_tests_roombooking', 'start', 'end'),
+            get_overlap_constraint('exclude_overlap_tests_roombooking', 'start', 'end', include_end_boundary=False),
+        ]
+
+
+class Project(ModelBase):
+    ''' A project (with history) '''
+    name = models.CharField(max_length=100)
+    status = models.CharField(max_length=20, default='open')
+
+
+class Sale(PeriodFKMixin, models.Model):
+    ''' A sale (the fact table of the rollup and period FK tests) '''
+    dtg = models.DateTimeField(null=True)
+    category = models.CharField(max_length=50)
+    amount = models.FloatField()
+    day = models.ForeignKey(Day, on_delete=models.PROTECT, null=True)
+    week = models.ForeignKey(Week, on_delete=models.PROTECT, null=True)
+    month = models.ForeignKey(Month, on_delete=models.PROTECT, null=True)
+    period_source_field = 'dtg'
+    period_fields = {'day':'day', 'week':'week', 'month':'month'}
+
+
+class SaleDayRollup(RollupBase):
+    ''' Sales aggregated by Day and category '''
+    period = models.ForeignKey(Day, on_delete=models.CASCADE)
+    category = models.CharField(max_length=50)
+    total = models.FloatField(null=True)
+    n = models.IntegerField()
+    rollup_source = 'tests.Sale'
+    rollup_datetime_field = 'dtg'
+    rollup_dimensions = ['category']
+    rollup_aggregates = {'total':Sum('amount'), 'n':Count('id')}
+    rollup_count_field = 'n'
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['period', 'category'], name='unique_sale_day_rollup')]
+
+
+class SaleMonthRollup(RollupBase):
+    ''' Sales aggregated by Month '''
+    period = models.ForeignKey(Month, on_delete=models.CASCADE)
+    total = models.FloatField(null=True)
+    n = models.IntegerField()
+    rollup_source = Sale
+    rollup_datetime_field = 'dtg'
+    rollup_aggregates = {'total':Sum('amount'), 'n':Count('id')}
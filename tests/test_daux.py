@@ -1,8 +1,27 @@
 from django.test import TestCase, RequestFactory, Client
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
 from django_aux.models import *
 from django_aux.views import *
-from django_aux.utils import PasswordUtils
-from .models import Person
+from django_aux.utils import PasswordUtils, get_delete_dependents, get_protected_dependents
+from django_aux.indexes import get_trigram_report, get_trigram_index_sql, TRIGRAM_INDEX_RE
+from django_aux.db_views import ViewRegistry, get_view_model, get_view_model_source
+from django_aux.history import get_history_models, prune_history
+from django.core.management import call_command
+import tempfile
+from django.utils import timezone
+import os
+from django_aux.models import ViewRefresh
+from django_aux.utils import create_view_from_qs, get_relkind, get_dependent_views
+from django_aux.utils import df_tz_convert, strftime_to_pg, strftime_cached, db_tz_format, db_tz_convert
+from django.db import connection
+from django.db.models import DateTimeField, Value, Count
+from django.db import models
+from django.db.models.functions import Cast
+from zoneinfo import ZoneInfo
+import datetime as dt
+import pandas as pd
+from .models import Person, PersonAward, AwardCeremony, PersonNote, Shift, RoomBooking, Project
 from .views import PersonLookup, PersonCreate, PersonCreateWithRequest
 from .filters import PersonFilter
 from django.contrib.auth.models import User
@@ -202,4 +221,410 @@ class TestInlineFormsetMixin(TestCase):
             ifm.request = FakeRequest(GET = {'extra':td.get('extra')})
             context = {}
             ifm.add_removelines_url_to_context(context)
-            self.assertEqual(context['removelines_url'], f"?extra={td.get('target')}")
\ No newline at end of file
+            self.assertEqual(context['removelines_url'], f"?extra={td.get('target')}")
+
+
+class TestDeleteProtectedView(TestCase):
+    ''' Test Case for DeleteProtectedView and the delete dependents preflight '''
+
+    def setUp(self):
+        self.client = Client()
+        self.person = Person.objects.create(first_name='jordan', last_name='hyatt')
+        self.award = PersonAward.objects.create(person=self.person, name='MVP')
+        PersonAward.objects.create(person=self.person, name='GOAT')
+
+    def test_get_delete_dependents(self):
+        deps = get_delete_dependents(self.person)
+        self.assertEqual(len(deps), 1)
+        self.assertEqual(deps[0]['model'], PersonAward)
+        self.assertEqual(deps[0]['count'], 2)
+        self.assertEqual(get_protected_dependents(self.person), [])
+        # Protected rows one CASCADE level down are found too
+        AwardCeremony.objects.create(award=self.award)
+        protected = get_protected_dependents(self.person)
+        self.assertEqual(len(protected), 1)
+        self.assertEqual(protected[0]['model'], AwardCeremony)
+        self.assertEqual(protected[0]['depth'], 2)
+        self.assertEqual(get_protected_dependents(self.person, max_depth=1), [])
+
+    def test_post_protected(self):
+        for i in range(3):
+            PersonNote.objects.create(person=self.person, text=f'note {i}')
+        with self.assertNumQueries(5):
+            response = self.client.post(f'/person-delete/{self.person.pk}')
+        self.assertEqual(response.status_code, 302)
+        self.assertTrue(Person.objects.filter(pk=self.person.pk).exists())
+        msgs = [str(m) for m in response.wsgi_request._messages]
+        self.assertIn('blocked by 3 person notes', msgs[0])
+
+    def test_post_unprotected(self):
+        response = self.client.post(f'/person-delete/{self.person.pk}')
+        self.assertEqual(response.status_code, 302)
+        self.assertFalse(Person.objects.filter(pk=self.person.pk).exists())
+        self.assertFalse(PersonAward.objects.exists())
+
+
+
+class TestTzFormatting(TestCase):
+    ''' Test Case for the python and database side datetime conversion/formatting utils '''
+
+    def setUp(self):
+        self.dtg = dt.datetime(2023, 7, 4, 18, 5, 9, tzinfo=ZoneInfo('UTC'))
+
+    def test_strftime_to_pg(self):
+        self.assertEqual(strftime_to_pg('%Y-%m-%d %H:%M'), 'YYYY"-"MM"-"DD" "HH24":"MI')
+        self.assertEqual(strftime_to_pg('%I%p %Z', timezone='UTC'), 'HH12AM" UTC"')
+        self.assertRaises(ValueError, strftime_to_pg, '%U')
+
+    def test_strftime_cached(self):
+        ser = pd.Series([self.dtg, None, self.dtg, self.dtg + dt.timedelta(days=1)], dtype='datetime64[ns, UTC]')
+        fmt = '%a %d %b %Y, %I:%M%p %Z'
+        pd.testing.assert_series_equal(strftime_cached(ser, fmt), ser.dt.strftime(fmt).astype(object))
+        df = pd.DataFrame({'dtg':ser})
+        cached = df_tz_convert(df.copy(), timezone='America/New_York', method='cached')
+        python = df_tz_convert(df.copy(), timezone='America/New_York')
+        pd.testing.assert_frame_equal(cached, python.astype(object))
+        skipped = df_tz_convert(df.copy(), timezone='America/New_York', col_methods={'dtg':None})
+        pd.testing.assert_frame_equal(skipped, df)
+
+    def test_db_tz_format(self):
+        Person.objects.create(first_name='jordan', last_name='hyatt')
+        qs = Person.objects.annotate(dtg=Cast(Value(self.dtg), DateTimeField()))
+        fmt = '%a %d %b %Y, %I:%M%p'
+        row = qs.annotate(
+            local=db_tz_convert('dtg', timezone='America/New_York'),
+            formatted=db_tz_format('dtg', timezone='America/New_York', format_str=fmt),
+        ).values('local', 'formatted').get()
+        local = self.dtg.astimezone(ZoneInfo('America/New_York'))
+        self.assertEqual(row['local'], local.replace(tzinfo=None))
+        self.assertEqual(row['formatted'], local.strftime(fmt))
+
+
+
+class TestViewRegistry(TestCase):
+    ''' Test Case for the materialized view registry '''
+
+    def setUp(self):
+        for i in range(3):
+            Person.objects.create(first_name='jordan', last_name=f'hyatt{i}')
+        self.registry = ViewRegistry()
+        self.registry.register(
+            'test_person_summary', lambda: Person.objects.values('last_name'),
+            depends_on=['test_person_names'], source_tables=['tests_person'],
+        )
+        self.registry.register('test_person_names', Person.objects.values('id', 'last_name'), ufields=['id'])
+        self.registry.register('test_person_plain', Person.objects.values('id'), materialized=False)
+        self.registry.create()
+
+    def test_get_ordered_views(self):
+        names = [v.name for v in self.registry.get_ordered_views()]
+        self.assertLess(names.index('test_person_names'), names.index('test_person_summary'))
+        names = [v.name for v in self.registry.get_ordered_views(['test_person_names'])]
+        self.assertEqual(names, ['test_person_names', 'test_person_summary'])
+        names = [v.name for v in self.registry.get_ordered_views(['test_person_names'], include_dependents=False)]
+        self.assertEqual(names, ['test_person_names'])
+        self.assertRaises(KeyError, self.registry.get_ordered_views, ['not_a_view'])
+
+    def test_source_tables(self):
+        self.assertEqual(self.registry.get_view('test_person_names').source_tables, ['tests_person'])
+
+    def test_swap_dependents(self):
+        self.registry.register(
+            'test_person_names_view', lambda: get_view_model('test_person_names', 'tests').objects.values('last_name'),
+            materialized=False, depends_on=['test_person_names'],
+        )
+        self.registry.create(['test_person_names_view'])
+        Person.objects.create(first_name='jordan', last_name='hyatt3')
+        self.registry.create(['test_person_names'], swap=True)
+        self.assertEqual(get_dependent_views('test_person_names'), ['test_person_names_view'])
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT count(*) FROM test_person_names_view')
+            self.assertEqual(cursor.fetchone()[0], 4)
+        for leftover in ['test_person_names_backup', 'test_person_names_swap', 'test_person_names_view_swap']:
+            self.assertIsNone(get_relkind(leftover))
+
+    def test_refresh(self):
+        refreshes = self.registry.refresh()
+        self.assertEqual([r.view_name for r in refreshes], ['test_person_names', 'test_person_summary'])
+        self.assertTrue(refreshes[0].concurrently)
+        self.assertFalse(refreshes[1].concurrently)
+        self.assertEqual(refreshes[0].row_count, 3)
+        self.assertEqual(ViewRefresh.get_last('test_person_names'), refreshes[0])
+        last = refreshes[0]
+        refreshes = self.registry.refresh(skip_unchanged=True)
+        self.assertTrue(all(r.skipped for r in refreshes))
+        self.assertEqual(ViewRefresh.get_last('test_person_names'), last)
+
+
+
+class TestCreateViewFromQs(TestCase):
+    ''' Test Case for create_view_from_qs '''
+
+    def setUp(self):
+        for i in range(3):
+            Person.objects.create(first_name='jordan', last_name=f'hyatt{i}')
+
+    def get_count(self, view_name):
+        with connection.cursor() as cursor:
+            cursor.execute(f'SELECT count(*) FROM "{view_name}"')
+            return cursor.fetchone()[0]
+
+    def test_swap(self):
+        create_view_from_qs(Person.objects.values('id', 'last_name'), 'test_swap_view', ufields=['id'])
+        self.assertEqual(self.get_count('test_swap_view'), 3)
+        Person.objects.create(first_name='jordan', last_name='hyatt3')
+        create_view_from_qs(Person.objects.values('id', 'last_name'), 'test_swap_view', ufields=['id'], swap=True)
+        self.assertEqual(self.get_count('test_swap_view'), 4)
+        self.assertEqual(get_relkind('test_swap_view'), 'm')
+        self.assertEqual(get_relkind('unique_test_swap_view'), 'i')
+        for leftover in ['test_swap_view_swap', 'test_swap_view_backup', 'unique_test_swap_view_backup']:
+            self.assertIsNone(get_relkind(leftover))
+        # swapping a regular view for a materialized one (and back) works too
+        create_view_from_qs(Person.objects.values('id'), 'test_swap_view', materialized=False, swap=True)
+        self.assertEqual(get_relkind('test_swap_view'), 'v')
+        self.assertIsNone(get_relkind('unique_test_swap_view'))
+
+    def test_swap_dependents(self):
+        create_view_from_qs(Person.objects.values('id', 'last_name'), 'test_swap_base', ufields=['id'])
+        with connection.cursor() as cursor:
+            cursor.execute('CREATE VIEW test_swap_dependent AS SELECT id FROM test_swap_base')
+            # a leftover backup is kept until the swap succeeds
+            cursor.execute('CREATE VIEW test_swap_base_backup AS SELECT 1 AS id')
+        self.assertEqual(get_dependent_views('test_swap_base'), ['test_swap_dependent'])
+        with self.assertRaises(ValueError):
+            create_view_from_qs(Person.objects.values('id', 'last_name'), 'test_swap_base', ufields=['id'], swap=True)
+        self.assertEqual(get_relkind('test_swap_base_backup'), 'v')
+        self.assertIsNone(get_relkind('test_swap_base_swap'))
+        with connection.cursor() as cursor:
+            cursor.execute('DROP VIEW test_swap_dependent')
+        Person.objects.create(first_name='jordan', last_name='hyatt3')
+        create_view_from_qs(Person.objects.values('id', 'last_name'), 'test_swap_base', ufields=['id'], swap=True)
+        self.assertEqual(self.get_count('test_swap_base'), 4)
+        self.assertIsNone(get_relkind('test_swap_base_backup'))
+
+
+    def test_get_view_model(self):
+        qs = Person.objects.values('last_name').annotate(n=Count('id'), total=models.Sum('salary'))
+        create_view_from_qs(qs, 'test_person_rollup', ufields=['last_name'])
+        model = get_view_model('test_person_rollup', 'tests')
+        self.assertIs(model, get_view_model('test_person_rollup', 'tests'))
+        self.assertFalse(model._meta.managed)
+        self.assertEqual(model._meta.pk.name, 'last_name')
+        self.assertIsInstance(model._meta.get_field('n'), models.BigIntegerField)
+        self.assertEqual(model.objects.count(), 3)
+        self.assertEqual(model.objects.get(last_name='hyatt1').n, 1)
+        source = get_view_model_source('test_person_rollup')
+        self.assertIn('class TestPersonRollup(models.Model):', source)
+        self.assertIn("last_name = models.CharField(max_length=100, primary_key=True)", source)
+        self.assertIn("db_table = 'test_person_rollup'", source)
+
+
+
+class TestTrigramLookups(TestCase):
+    ''' Test Case for the ILIKE lookups used by FilterSetBase and the trigram index advisor '''
+
+    def setUp(self):
+        Person.objects.create(first_name='jordan', last_name='Hyatt')
+        Person.objects.create(first_name='bill', last_name='100% Hyatt')
+
+    def test_filter_uses_ilike(self):
+        fs = PersonFilter(data={'last_name__icontains':'hyatt'}, queryset=Person.objects.all())
+        self.assertEqual(fs.filters['last_name__icontains'].lookup_expr, 'ilike_contains')
+        self.assertIn('ILIKE', str(fs.qs.query))
+        self.assertEqual(fs.qs.count(), 2)
+        fs = PersonFilter(data={'last_name__icontains':'0% h'}, queryset=Person.objects.all())
+        self.assertEqual(fs.qs.count(), 1)
+        self.assertEqual(Person.objects.filter(last_name__ilike_startswith='hy').count(), 1)
+        self.assertEqual(Person.objects.filter(first_name__ilike_startswith='J').count(), 1)
+
+    def test_trigram_labels(self):
+        labels = {name:str(field.label) for name, field in PersonFilter().form.fields.items()}
+        PersonFilter.trigram_lookups = False
+        try:
+            self.assertEqual({name:str(field.label) for name, field in PersonFilter().form.fields.items()}, labels)
+        finally:
+            PersonFilter.trigram_lookups = True
+        self.assertEqual(labels['last_name__icontains'], 'Last name contains')
+
+    def test_trigram_report(self):
+        report = get_trigram_report([PersonFilter])
+        self.assertEqual({c['column'] for c in report}, {'last_name', 'first_name'})
+        self.assertFalse(any(c['indexed'] for c in report))
+        create, drop = get_trigram_index_sql('tests_person', 'last_name')
+        self.assertIn('CREATE INDEX CONCURRENTLY IF NOT EXISTS', create)
+        self.assertIn('USING gin ("last_name" gin_trgm_ops)', create)
+        indexdef = 'CREATE INDEX x ON public.tests_person USING gin (last_name gin_trgm_ops)'
+        self.assertEqual(TRIGRAM_INDEX_RE.findall(indexdef), ['last_name'])
+
+
+
+class TestCheckOverlapBulk(TestCase):
+    ''' Test Case for the bulk overlap validation and exclusion constraint of CheckOverlapMixin '''
+
+    def setUp(self):
+        self.p1 = Person.objects.create(first_name='jordan', last_name='Hyatt')
+        self.p2 = Person.objects.create(first_name='bill', last_name='Hyatt')
+        self.t0 = dt.datetime(2023, 1, 1, 8)
+        Shift.objects.create(person=self.p1, start=self.t0, end=self.t0 + dt.timedelta(hours=8))
+
+    def hours(self, n):
+        return self.t0 + dt.timedelta(hours=n)
+
+    def test_bulk_overlaps(self):
+        objs = [
+            Shift(person=self.p1, start=self.hours(24), end=self.hours(32)),
+            Shift(person=self.p1, start=self.hours(30), end=self.hours(34)), # overlaps the previous obj
+            Shift(person=self.p1, start=self.hours(4), end=self.hours(6)), # overlaps the existing shift
+            Shift(person=self.p2, start=self.hours(4), end=self.hours(6)), # other person
+        ]
+        with self.assertNumQueries(2):
+            overlaps = Shift.get_bulk_overlaps(objs)
+        self.assertEqual(len(overlaps), 2)
+        self.assertIn((objs[1], objs[0]), overlaps)
+        self.assertEqual(overlaps[0][0], objs[2])
+        self.assertEqual(overlaps[0][1].pk, Shift.objects.first().pk)
+        with self.assertRaises(ValidationError):
+            Shift.bulk_create_checked(objs)
+        Shift.bulk_create_checked([objs[0], objs[3]])
+        self.assertEqual(Shift.objects.count(), 3)
+        # Changed instances are not compared with their own row
+        first, second = Shift.objects.filter(person=self.p1).order_by('start')
+        first.end = self.hours(9)
+        self.assertEqual(Shift.get_bulk_overlaps([first]), [])
+        first.end = self.hours(25)
+        self.assertEqual(Shift.get_bulk_overlaps([first]), [(first, second)])
+        # Touching ranges overlap when the boundaries are included
+        self.assertEqual(len(Shift.get_bulk_overlaps([Shift(person=self.p1, start=self.hours(8), end=self.hours(9))])), 1)
+
+    def test_exclusion_constraint(self):
+        constraint = RoomBooking.get_exclusion_constraint()
+        self.assertIn(constraint, RoomBooking._meta.constraints)
+        self.assertEqual([c.name for c in Shift._meta.constraints], ['check_range_tests_shift'])
+        self.assertEqual(constraint.expressions[0][1], '&&')
+        RoomBooking.objects.create(start=self.hours(0), end=self.hours(1))
+        RoomBooking.objects.create(start=self.hours(1), end=self.hours(2)) # end boundary is excluded
+        self.assertEqual(RoomBooking.get_bulk_overlaps([RoomBooking(start=self.hours(2), end=self.hours(3))]), [])
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RoomBooking.objects.create(start=self.hours(1.5), end=self.hours(3))
+
+    def test_asymmetric_boundaries(self):
+        # bulk and single instance validation agree when only one boundary is included
+        RoomBooking.objects.create(start=self.hours(3), end=self.hours(5))
+        for start, end in [(1, 3), (5, 7), (2, 4), (0, 1)]:
+            obj = RoomBooking(start=self.hours(start), end=self.hours(end))
+            try:
+                obj.check_overlap()
+                single = False
+            except ValidationError:
+                single = True
+            self.assertEqual(bool(RoomBooking.get_bulk_overlaps([obj])), single, msg=(start, end))
+        # between objs it does not matter which one is saved first
+        a, b = RoomBooking(start=self.hours(10), end=self.hours(12)), RoomBooking(start=self.hours(12), end=self.hours(14))
+        self.assertEqual(RoomBooking.get_bulk_overlaps([a, b]), [(b, a)])
+        self.assertEqual(RoomBooking.get_bulk_overlaps([b, a]), [(b, a)])
+
+
+
+class TestCheckRangeMixin(TestCase):
+    ''' Test Case for the range CheckConstraint of CheckRangeMixin '''
+
+    def test_check_constraint(self):
+        person = Person.objects.create(first_name='jordan', last_name='Hyatt')
+        t0 = dt.datetime(2023, 1, 1, 8)
+        self.assertIn(Shift.get_check_constraint(), Shift._meta.constraints)
+        self.assertTrue(CheckRangeMixin.clean_during_save) # python validation on save stays the default
+        shift = Shift(person=person, start=t0, end=t0 - dt.timedelta(hours=1))
+        with self.assertRaises(ValidationError):
+            shift.check_range()
+        with self.assertRaises(ValidationError):
+            shift.full_clean()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Shift.objects.bulk_create([shift])
+        shift.end = t0 + dt.timedelta(hours=1)
+        shift.save()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            Shift.objects.update(end=t0)
+        # RoomBooking does not allow zero length bookings either
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            RoomBooking.objects.create(start=t0, end=t0)
+
+
+
+class TestBulkHistory(TestCase):
+    ''' Test Case for the bulk history wrappers of ModelBase and history pruning '''
+
+    def test_bulk_history(self):
+        with self.assertNumQueries(2):
+            objs = Project.bulk_create_with_history([Project(name=f'project {i}') for i in range(5)])
+        self.assertEqual(Project.history.filter(history_type='+').count(), 5)
+        for obj in objs:
+            obj.status = 'active'
+        Project.bulk_update_with_history(objs, ['status'], default_change_reason='activate')
+        self.assertEqual(Project.history.filter(history_change_reason='activate', status='active').count(), 5)
+        with self.assertNumQueries(9):
+            rows = Project.objects.filter(name__in=['project 0', 'project 1', 'project 2']).update_with_history(
+                chunk_size=2, status='closed',
+            )
+        self.assertEqual(rows, 3)
+        self.assertEqual(Project.objects.filter(status='closed').count(), 3)
+        self.assertEqual(Project.history.filter(history_type='~', status='closed').count(), 3)
+        self.assertEqual(objs[0].log.count(), 3)
+
+    def test_prune_history(self):
+        objs = Project.bulk_create_with_history([Project(name=f'project {i}') for i in range(3)])
+        Project.objects.update_with_history(status='closed')
+        old = timezone.now() - dt.timedelta(days=400)
+        Project.history.filter(history_type='+').update(history_date=old)
+        Project.history.filter(history_type='~').update(history_date=old + dt.timedelta(days=1))
+        Project.objects.filter(pk=objs[0].pk).update_with_history(status='open')
+        history_model = Project.history.model
+        self.assertIn(history_model, get_history_models())
+        self.assertEqual(prune_history(history_model, 365, dry_run=True), 4)
+        with tempfile.TemporaryDirectory() as archive_dir:
+            self.assertEqual(prune_history(history_model, 365, batch_size=3, archive_dir=archive_dir), 4)
+            df = pd.read_csv(os.path.join(archive_dir, 'tests_historicalproject.csv.gz'))
+        self.assertEqual(len(df), 4)
+        # The latest history row of each object is kept
+        self.assertEqual(Project.history.count(), 3)
+        self.assertEqual(objs[1].log.get().status, 'closed')
+        call_command('prune_history', 'tests.Project', '--days=365', '--prune-latest', stdout=open(os.devnull, 'w'))
+        self.assertEqual(Project.history.count(), 1)
+
+
+
+class TestBulkActionMixin(TestCase):
+    ''' Test Case for BulkActionMixin '''
+
+    def setUp(self):
+        for i in range(5):
+            Person.objects.create(first_name=f'first{i}', last_name='Hyatt' if i < 4 else 'Smith', salary=10)
+        self.client = Client()
+
+    def test_checked_ids(self):
+        pks = list(Person.objects.filter(last_name='Hyatt').values_list('pk', flat=True)[:3])
+        response = self.client.post('/person-bulk', {'raise':'', 'checked_id':pks})
+        self.assertEqual(response.status_code, 302)
+        self.assertEqual(Person.objects.filter(salary=100).count(), 3)
+        msgs = [str(m) for m in response.wsgi_request._messages]
+        self.assertEqual(msgs, ['3 persons updated'])
+        # rows that already have the values are not updated again
+        response = self.client.post('/person-bulk', {'raise':'', 'checked_id':pks})
+        self.assertEqual([str(m) for m in response.wsgi_request._messages][-1], '0 persons updated')
+
+    def test_unchanged_history(self):
+        objs = Project.bulk_create_with_history([Project(name='a'), Project(name='b', status='closed')])
+        action = {'update':{'status':'closed'}}
+        self.assertEqual(BulkActionMixin().run_bulk_action(action, Project.objects.all()), 1)
+        self.assertEqual(objs[1].log.count(), 1)
+        self.assertEqual(objs[0].log.count(), 2)
+
+    def test_filtered_queryset(self):
+        with self.assertNumQueries(5):
+            # select of the pks + 2 chunks of 2 (+ savepoint/release)
+            response = self.client.post('/person-bulk?last_name__icontains=hyatt', {'raise':'', 'bulk_all':'1'})
+        self.assertEqual(Person.objects.filter(salary=100).count(), 4)
+        self.assertEqual(response.url, '/person-bulk?last_name__icontains=hyatt')
+        response = self.client.post('/person-bulk?last_name__icontains=smith', {'delete':'', 'bulk_all':'1'})
+        self.assertEqual(Person.objects.count(), 4)
+        msgs = [str(m) for m in response.wsgi_request._messages]
+        self.assertEqual(msgs[-1], '1 person deleted')
@@ -1,5 +1,15 @@
 from django.test import TestCase
 from django_aux_geo.models import *
+from django_aux_geo.cache import geo_cache
+from django_aux_geo.filters import CountryFilter, AddressFilter
+from io import StringIO
+import pandas as pd
+import numpy as np
+from django_aux_geo import geohash
+from django_aux_geo.utils import get_distance_matrix, get_distance_pairs, get_nearest, GridIndex, to_unit_vectors
+from django_aux_geo.fingerprint import get_fingerprint
+from django_aux_geo.importers import import_addresses
+from django.core.management import call_command
 
 #------------GEO TESTS------------
 
@@ -10,6 +20,297 @@ class TestCountry(TestCase):
     ''' TestCase for the Country model '''
 
     def test_create_objs(self):
+        with self.assertNumQueries(1):
+            Country.create_objs()
+        for alpha2 in ['AD','CA','FR','US','NA']:
+            self.assertTrue(Country.objects.filter(alpha2=alpha2).exists())
+        Country.objects.filter(alpha3='USA').update(name='changed')
         Country.create_objs()
-        for alpha2 in ['AD','CA','FR','US']:
-            self.assertTrue(Country.objects.filter(alpha2=alpha2).exists())
\ No newline at end of file
+        self.assertEqual(Country.objects.get(alpha3='USA').name, 'changed')
+        Country.create_objs(update=True)
+        self.assertEqual(Country.objects.get(alpha3='USA').name, 'United States')
+
+
+class TestSubdivision(TestCase):
+    ''' TestCase for the Subdivision model '''
+
+    def test_create_objs(self):
+        Country.create_objs()
+        with self.assertNumQueries(2):
+            Subdivision.create_objs()
+        self.assertEqual(Subdivision.objects.get(iso_code='US-VA').country.alpha2, 'US')
+        self.assertTrue(Subdivision.objects.filter(country__alpha2='FR').count() > 10)
+
+    def test_load_command(self):
+        out = StringIO()
+        call_command('load_iso3166', stdout=out)
+        call_command('load_iso3166', '--update', stdout=out)
+        self.assertEqual(Country.objects.count(), len(Country.get_bundled_df()))
+        self.assertEqual(Subdivision.objects.count(), len(Subdivision.get_bundled_df()))
+
+class TestGeoCache(TestCase):
+    ''' TestCase for the geo_cache '''
+
+    def setUp(self):
+        Country.create_objs()
+        Subdivision.create_objs()
+        geo_cache.clear()
+
+    def test_lookups(self):
+        us = Country.objects.get(alpha3='USA')
+        va = Subdivision.objects.get(iso_code='US-VA')
+        n_countries = Country.objects.count()
+        geo_cache.load()
+        with self.assertNumQueries(0):
+            for value in ['US', 'usa', 840, '840', ' united states ', us]:
+                self.assertEqual(geo_cache.get_country_id(value), us.id, msg=value)
+            self.assertEqual(geo_cache.get_country('NA').alpha3, 'NAM')
+            self.assertIsNone(geo_cache.get_country('nowhere'))
+            self.assertEqual(geo_cache.get_subdivision('us-va'), va)
+            self.assertEqual(geo_cache.get_subdivision_id('VA', country='US'), va.id)
+            self.assertEqual(geo_cache.get_subdivision_id('virginia', country='USA'), va.id)
+            self.assertIsNone(geo_cache.get_subdivision_id('virginia'))
+            ids = geo_cache.map_country_ids(pd.Series(['US', 'fra', None, 'xx']))
+            self.assertEqual(ids[0], us.id)
+            self.assertTrue(ids[2:].isna().all())
+            subs = geo_cache.map_subdivision_ids(pd.Series(['VA', 'US-VA', None]), pd.Series(['US', None, 'US']))
+            self.assertEqual(subs[:2].tolist(), [va.id, va.id])
+            self.assertTrue(pd.isna(subs[2]))
+            choices = geo_cache.get_country_choices('alpha3', 'name')
+            self.assertEqual(len(choices), n_countries)
+            self.assertIn(('US-VA', 'Virginia'), geo_cache.get_subdivision_choices('US', 'iso_code', 'name'))
+
+    def test_invalidation(self):
+        self.assertEqual(geo_cache.get_country('US').name, 'United States')
+        Country.objects.filter(alpha3='USA').get().save(update_fields=['name'])
+        self.assertFalse(geo_cache.loaded)
+        country = Country.objects.create(alpha2='QZ', alpha3='QZZ', num=999, name='Testland')
+        self.assertEqual(geo_cache.get_country('qzz'), country)
+        country.delete()
+        self.assertIsNone(geo_cache.get_country('qzz'))
+
+    def test_reload_snapshot(self):
+        index = geo_cache.get_index()
+        n_countries = len(index.countries)
+        geo_cache.clear()
+        geo_cache.load()
+        # a reload publishes a new index and leaves the one a reader holds intact
+        self.assertIsNot(geo_cache.get_index(), index)
+        self.assertEqual(len(index.countries), n_countries)
+        self.assertEqual(index.countries[index.get_country_id('US')].alpha3, 'USA')
+
+    def test_filter_choices(self):
+        f = CountryFilter({'alpha2':'US'}, queryset=Country.objects.all())
+        self.assertEqual(list(f.qs.values_list('alpha3', flat=True)), ['USA'])
+        self.assertIn(('FR', 'FR'), list(f.form.fields['alpha2'].choices))
+
+
+class TestCoordinate(TestCase):
+    ''' TestCase for the geohash indexed spatial queries '''
+
+    def setUp(self):
+        rng = np.random.default_rng(0)
+        lats, lons = rng.uniform(38, 40, 400), rng.uniform(-78, -76, 400)
+        Coordinate.objects.bulk_create([
+            Coordinate(latitude=round(lat, 6), longitude=round(lon, 6)) for lat, lon in zip(lats, lons)
+        ])
+        Coordinate.objects.bulk_create([
+            Coordinate(latitude=-16.5, longitude=179.9), Coordinate(latitude=-16.5, longitude=-179.9),
+        ])
+        self.df = pd.DataFrame.from_records(Coordinate.objects.values('id', 'latitude', 'longitude', 'geohash'))
+        self.df[['latitude', 'longitude']] = self.df[['latitude', 'longitude']].astype(float)
+
+    def get_distances(self, lat, lon):
+        ''' brute force haversine (km) in numpy '''
+        lat1, lon1, lat2, lon2 = map(np.radians, [lat, lon, self.df.latitude, self.df.longitude])
+        a = np.sin((lat2 - lat1) / 2)**2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2)**2
+        return pd.Series(2 * geohash.EARTH_RADIUS_KM * np.arcsin(np.sqrt(a)).values, index=self.df.id)
+
+    def test_geohash(self):
+        self.assertEqual(geohash.encode(57.64911, 10.40744, 11), 'u4pruydqqvj')
+        self.assertTrue(self.df.geohash.notna().all())
+        coord = Coordinate.objects.create(latitude=57.64911, longitude=10.40744)
+        self.assertTrue(coord.geohash.startswith('u4pruydqqvj'))
+        coord.latitude, coord.longitude = 38.8977, -77.0365
+        coord.save(update_fields=['latitude', 'longitude'])
+        coord.refresh_from_db()
+        self.assertEqual(coord.geohash[:7], geohash.encode(38.8977, -77.0365, 7))
+
+    def test_bbox(self):
+        ids = set(Coordinate.objects.within_bbox(38.5, -77.5, 39, -76.8).values_list('id', flat=True))
+        df = self.df
+        expected = df[df.latitude.between(38.5, 39) & df.longitude.between(-77.5, -76.8)].id
+        self.assertEqual(ids, set(expected))
+        # across the antimeridian
+        self.assertEqual(Coordinate.objects.within_bbox(-17, 179, -16, -179).count(), 2)
+
+    def test_radius_and_nearest(self):
+        distances = self.get_distances(39, -77)
+        qs = Coordinate.objects.within_radius(39, -77, 25)
+        self.assertEqual(set(qs.values_list('id', flat=True)), set(distances[distances <= 25].index))
+        for obj in qs:
+            self.assertAlmostEqual(obj.distance, distances[obj.id], places=6)
+        nearest = list(Coordinate.objects.nearest(39, -77, k=7).values_list('id', flat=True))
+        self.assertEqual(nearest, list(distances.sort_values().index[:7]))
+        self.assertEqual(len(Coordinate.objects.nearest(39, -77, k=5, max_km=0.001)), 0)
+        # the two points ~21km apart across the antimeridian
+        self.assertEqual(Coordinate.objects.within_radius(-16.5, 179.99, 15).count(), 2)
+
+    def test_address_nearest(self):
+        coords = list(Coordinate.objects.order_by('id')[:3])
+        for i, coord in enumerate(coords):
+            Address.objects.create(name=f'address {i}', coordinate=coord)
+        address = Address.objects.nearest(coords[1].latitude, coords[1].longitude, k=1).get()
+        self.assertEqual(address.name, 'address 1')
+        self.assertAlmostEqual(address.distance, 0, places=6)
+
+
+class TestDistanceUtils(TestCase):
+    ''' TestCase for the vectorized distance utilities '''
+
+    def setUp(self):
+        rng = np.random.default_rng(1)
+        points = [(rng.uniform(-89, 89), rng.uniform(-180, 180)) for i in range(150)]
+        points += [(89.9, 0), (89.9, 180), (-10, 179.99), (-10, -179.99)]
+        Coordinate.objects.bulk_create([Coordinate(latitude=round(lat, 6), longitude=round(lon, 6)) for lat, lon in points])
+        self.qs = Coordinate.objects.all()
+
+    def test_distance_matrix(self):
+        df = get_distance_matrix(self.qs, max_bytes=200_000) # computed in chunks of 40 rows
+        self.assertEqual(df.shape, (154, 154))
+        a = Coordinate.objects.get(latitude=-10, longitude=179.99)
+        b = Coordinate.objects.get(latitude=-10, longitude=-179.99)
+        self.assertAlmostEqual(df.loc[a.id, b.id], 2.19, places=2)
+        self.assertTrue(np.allclose(np.diag(df.values), 0))
+        self.assertTrue(np.allclose(df.values, df.values.T))
+        with self.assertRaises(ValueError):
+            get_distance_matrix(self.qs, max_bytes=100_000)
+        pairs = get_distance_pairs(self.qs, max_km=500, max_bytes=10_000)
+        expected = df.where(df <= 500).stack()
+        self.assertEqual(len(pairs), len(expected) - 154)
+        self.assertTrue(np.allclose(pairs.distance, [df.loc[a, b] for a, b in zip(pairs.pk_a, pairs.pk_b)]))
+
+    def test_nearest(self):
+        addresses = Address.objects.bulk_create([Address(name=str(c.id), coordinate=c) for c in self.qs.order_by('id')[:40]])
+        targets = self.qs.exclude(address__in=addresses)
+        for cell_km in [5, 500, 20_000]:
+            nearest = get_nearest(Address.objects.all(), targets, cell_km=cell_km)
+            df = get_distance_matrix(Address.objects.all(), targets)
+            self.assertEqual(nearest.nearest.tolist(), df.idxmin(axis=1).loc[nearest.index].tolist(), msg=cell_km)
+            self.assertTrue(np.allclose(nearest.distance, df.min(axis=1).loc[nearest.index]))
+        empty = get_nearest(Address.objects.all(), Coordinate.objects.none())
+        self.assertTrue(empty.nearest.isna().all())
+
+    def test_grid_candidates(self):
+        rng = np.random.default_rng(0)
+        points = np.radians(np.column_stack([rng.uniform(38, 40, 2000), rng.uniform(-78, -76, 2000)]))
+        index = GridIndex(points, cell_km=5)
+        for cell in index.cells[:20]:
+            for radius in [1, 2, 4]:
+                # the neighbour key lookup finds the same points as a scan of the occupied cells
+                near = np.abs(to_unit_vectors(points) // index.size - cell).max(axis=1) <= radius
+                candidates = index.get_candidates(cell, radius)
+                self.assertLess((2 * radius + 1) ** 3, len(index.cells))
+                self.assertEqual(sorted(candidates.tolist()), np.nonzero(near)[0].tolist())
+
+
+class TestAddressImport(TestCase):
+    ''' TestCase for the address fingerprints and the bulk import '''
+
+    def setUp(self):
+        Country.create_objs()
+        Subdivision.create_objs()
+
+    def test_fingerprint(self):
+        a = get_fingerprint('123 North Main Street', 'Suite 4', None, 'Springfield ', '22150-1234', 'USA')
+        b = get_fingerprint('123  n. main st.', 'STE 4', '', 'springfield', '221501234', 'usa')
+        self.assertEqual(a, b)
+        self.assertNotEqual(a, get_fingerprint('123 South Main Street', 'Suite 4', None, 'Springfield', '22150-1234', 'USA'))
+        us = Country.objects.get(alpha3='USA')
+        address = Address.objects.create(street1='1 Elm Street', city='Reston', country=us)
+        self.assertEqual(address.fingerprint, get_fingerprint('1 elm st', city='RESTON', country='USA'))
+
+    def test_import(self):
+        Address.objects.create(street1='1 Elm Street', city='Reston', postal_code='20190', country=Country.objects.get(alpha2='US'))
+        rows = [
+            dict(street1='1 elm st.', city='reston', postal_code='20190', country='us'), # existing
+            dict(street1='2 Oak Avenue', city='Paris', country='France', latitude=48.8566, longitude=2.3522),
+            dict(street1='2 oak ave', city='PARIS', country='FRA', latitude=48.8566, longitude=2.3522), # duplicate in the data
+            dict(street1='10 Downing Street', city='London', subdivision='GB-WSM', country='GB', latitude=51.5034, longitude=-0.1276),
+            dict(street1='5 Pine Road', city='Fairfax', subdivision='VA', country='USA'),
+        ]
+        geo_cache.load()
+        with self.assertNumQueries(2 * 6): # per batch: savepoint, dedupe, coordinates insert + read back, addresses insert, release
+            result = import_addresses(iter(rows), batch_size=3)
+        self.assertEqual(result.created.tolist(), [False, True, False, True, True])
+        self.assertEqual(result.address_id[1], result.address_id[2])
+        self.assertEqual(Address.objects.count(), 4)
+        paris = Address.objects.get(pk=result.address_id[1])
+        self.assertEqual((paris.country.alpha2, float(paris.coordinate.latitude)), ('FR', 48.8566))
+        self.assertEqual(Address.objects.get(pk=result.address_id[4]).subdivision.iso_code, 'US-VA')
+        self.assertEqual(Address.objects.get(pk=result.address_id[3]).subdivision.iso_code, 'GB-WSM')
+        # re-importing creates nothing
+        again = import_addresses(pd.DataFrame(rows))
+        self.assertFalse(again.created.any())
+        self.assertEqual(again.address_id.tolist(), result.address_id.tolist())
+        self.assertEqual(Coordinate.objects.count(), 2)
+
+    def test_import_without_fingerprint(self):
+        self.assertIsNone(get_fingerprint(None, ' ', city='', country='USA'))
+        rows = [dict(name=name, latitude=lat, longitude=lat) for name, lat in [('Warehouse A', 10), ('Warehouse B', 20), ('Depot C', 30)]]
+        result = import_addresses(rows)
+        self.assertTrue(result.created.all())
+        self.assertEqual(result.address_id.nunique(), 3)
+        names = dict(Address.objects.values_list('id', 'name'))
+        self.assertEqual([names[pk] for pk in result.address_id], ['Warehouse A', 'Warehouse B', 'Depot C'])
+        self.assertIsNone(Address.objects.create(name='Depot C').fingerprint)
+        self.assertEqual(Address.objects.count(), 4)
+
+
+class TestAddressSearch(TestCase):
+    ''' TestCase for the address full text search '''
+
+    def setUp(self):
+        Country.create_objs()
+        Subdivision.create_objs()
+        geo_cache.clear()
+        us = Country.objects.get(alpha2='US')
+        self.main = Address.objects.create(name='Main Office', street1='100 Market Street', city='Springfield', country=us,
+            subdivision=Subdivision.objects.get(iso_code='US-VA'))
+        self.market = Address.objects.create(street1='1 Main Street', city='Market', country=us)
+        self.paris = Address.objects.create(name='Cafe', street1='2 Rue de Rivoli', city='Paris', country=Country.objects.get(alpha2='FR'))
+
+    def test_search(self):
+        self.assertEqual(list(Address.objects.search('main')), [self.main, self.market]) # name outranks street
+        self.assertEqual(list(Address.objects.search('market')), [self.main, self.market]) # street outranks city
+        self.assertEqual(list(Address.objects.search('virginia')), [self.main])
+        self.assertEqual(list(Address.objects.search('france rivoli')), [self.paris])
+        self.assertEqual(list(Address.objects.search('main -market')), [])
+        self.assertEqual(list(Address.objects.search('spring rivo', prefix=True)), [])
+        self.assertEqual(list(Address.objects.search('rivo fra', prefix=True)), [self.paris])
+        self.assertEqual(list(Address.objects.search('', prefix=True)), [])
+        self.assertTrue(Address.objects.search('paris').first().rank > 0)
+
+    def test_maintenance(self):
+        self.paris.city = 'Lyon'
+        self.paris.save(update_fields=['city'])
+        self.assertEqual(list(Address.objects.search('lyon')), [self.paris])
+        self.assertEqual(list(Address.objects.search('paris')), [])
+        result = import_addresses([dict(street1='9 Harbour Road', city='Sydney', country='AU')])
+        self.assertEqual(Address.objects.search('sydney australia').get().pk, result.address_id[0])
+        # renames and queryset updates are picked up by a reindex
+        Country.objects.filter(alpha2='FR').update(name='Republique Francaise')
+        Address.objects.filter(pk=self.market.pk).update(search_vector=None)
+        self.assertEqual(list(Address.objects.search('market')), [self.main])
+        out = StringIO()
+        call_command('reindex_addresses', '--only-missing', stdout=out)
+        self.assertIn('Reindexed 1 addresses', out.getvalue())
+        self.assertEqual(list(Address.objects.search('market')), [self.main, self.market])
+        self.assertEqual(Address.objects.reindex_search(batch_size=2), 4)
+        self.assertEqual(list(Address.objects.search('republique')), [self.paris])
+
+    def test_filter(self):
+        f = AddressFilter({'q':'spring'}, queryset=Address.objects.all())
+        self.assertEqual(list(f.qs), [self.main])
+        f = AddressFilter({'q':'main', 'country':Country.objects.get(alpha2='US').id}, queryset=Address.objects.all())
+        self.assertEqual(list(f.qs), [self.main, self.market])
@@ -1,8 +1,19 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from django_aux_timeperiods.models import *
+from django_aux_timeperiods.models import insert_on_conflict_do_nothing
 import pandas as pd
 import datetime as dt
 import itertools
+from unittest import mock
+from io import StringIO
+from django.core.management import call_command
+from django_aux_timeperiods.utils import generate_calendar, map_periods, get_date_keys
+import numpy as np
+from zoneinfo import ZoneInfo
+from .models import Person, Shift, Sale, SaleDayRollup, SaleMonthRollup
+from django_aux_timeperiods.resolver import period_resolver
+from django_aux.views import PlotlyMixin
+from django_aux_timeperiods.management.commands.benchmark_periods import benchmark_periods
 
 #------------TIME PERIOD TESTS------------
 class CommonTimePeriodSetup(TestCase):
@@ -121,3 +132,327 @@ class TestDay(TestCase):
     def test_set_week(self):
         day,_ = Day.get_or_create_current_period()
         self.assertEqual(pd.Period.now('W'), day.week.period)
+
+class TestGenerateCalendar(TestCase):
+    ''' A Test Class for generate_calendar '''
+
+    def test_generate_calendar(self):
+        start, end = dt.date(2019,12,25), dt.date(2021,1,5)
+        Day(date=dt.date(2020,6,15)).save()
+        with self.assertNumQueries(9):
+            counts = generate_calendar(start, end)
+        self.assertEqual(counts, {'Year':3, 'Month':14, 'Week':55, 'Day':378})
+        self.assertEqual(Day.objects.count(), 378)
+        self.assertEqual(Week.objects.count(), 55)
+        # Rows match the ones created by save
+        for date in [dt.date(2019,12,30), dt.date(2020,6,15), dt.date(2021,1,3)]:
+            day = Day.objects.get(date=date)
+            self.assertEqual(day.period, pd.Period(date, freq='D'))
+            self.assertEqual(day.week.period, pd.Period(date, freq='W'))
+            self.assertEqual(day.month.period, pd.Period(date, freq='M'))
+            self.assertEqual(day.month.year.year_num, date.year)
+        self.assertEqual(Month.objects.get(year_num=2020, month_num=2).abbr, 'Feb')
+        self.assertTrue(Year.objects.get(year_num=2020).is_leap_year)
+        # Idempotent
+        call_command('generate_calendar', '2019-12-25', '2021-01-05', stdout=StringIO())
+        self.assertEqual(Day.objects.count(), 378)
+        self.assertEqual(Month.objects.count(), 14)
+
+class TestPeriodResolver(TestCase):
+    ''' A Test Class for the process wide period resolver '''
+
+    def setUp(self):
+        period_resolver.clear()
+
+    def test_resolve(self):
+        generate_calendar(dt.date(2020,1,1), dt.date(2020,12,31))
+        date = dt.date(2020,3,15)
+        day = Day.objects.get(date=date)
+        expected = (day.id, day.week_id, day.month_id, day.month.year_id)
+        self.assertEqual(period_resolver.resolve(date), expected)
+        with self.assertNumQueries(0):
+            self.assertEqual(period_resolver.resolve(dt.datetime(2020,3,15,23)), expected)
+            self.assertEqual(len(set(period_resolver.resolve_many([dt.date(2020,1,1) + dt.timedelta(i) for i in range(366)]))), 366)
+        # Misses are created in bulk
+        dates = [dt.date(2021,1,5), dt.date(2019,12,30)]
+        self.assertIsNone(period_resolver.resolve(dates[0], create=False))
+        ids = period_resolver.resolve_many(dates)
+        self.assertEqual(Day.objects.get(date=dates[0]).id, ids[0][0])
+        self.assertEqual(Day.objects.get(date=dates[1]).week.year_num, 2020)
+        # Saved days are picked up
+        day = Day(date=dt.date(2022,1,1))
+        day.save()
+        with self.assertNumQueries(0):
+            self.assertEqual(period_resolver.resolve(day.date)[:3], (day.id, day.week_id, day.month_id))
+        day.delete()
+        self.assertFalse(period_resolver.loaded)
+
+class TestMapPeriods(TestCase):
+    ''' A Test Class for the vectorized map_periods '''
+
+    def test_map_periods(self):
+        generate_calendar(dt.date(2020,1,1), dt.date(2020,12,31))
+        dtgs = pd.Series(pd.date_range('2020-01-01', '2020-12-31 23:00', freq='h', tz='UTC'))
+        with self.assertNumQueries(4):
+            df = map_periods(dtgs, timezone='UTC')
+        self.assertEqual(list(df.columns), ['day_id', 'week_id', 'month_id', 'year_id'])
+        self.assertEqual(df.dtypes.tolist(), [np.int64] * 4)
+        for i in [0, 1000, 5000, len(dtgs) - 1]:
+            day = Day.objects.get(date=dtgs[i].date())
+            self.assertEqual(df.iloc[i].tolist(), [day.id, day.week_id, day.month_id, day.month.year_id])
+        # Timezone conversion, missing values and period creation
+        ser = pd.Series([pd.Timestamp('2021-01-01 03:00', tz='UTC'), pd.NaT, pd.Timestamp('2020-01-01 12:00', tz='UTC')])
+        df = map_periods(ser, timezone='America/New_York')
+        self.assertEqual(df.loc[0, 'day_id'], Day.objects.get(date=dt.date(2020,12,31)).id)
+        self.assertTrue(pd.isna(df.loc[1, 'week_id']))
+        self.assertEqual(df.loc[2, 'year_id'], Year.objects.get(year_num=2020).id)
+        df = map_periods(pd.Series([dt.date(2021,1,6)]), levels=['week'])
+        self.assertEqual(df.loc[0, 'week_id'], Week.objects.get(year_num=2021, week_num=1).id)
+        self.assertEqual(Day.objects.filter(date__year=2021).count(), 1)
+
+class TestPeriodMath(TestCase):
+    ''' A Test Class for the datetime based boundary math (compared against pandas Periods) '''
+
+    def test_boundaries(self):
+        dates = [dt.date(2020,12,31), dt.date(2021,1,3), dt.date(2024,12,30), dt.date(2024,2,29), dt.date(2026,1,1)]
+        for date, model in itertools.product(dates, [Year, Month, Week, Day]):
+            obj,_ = model.get_or_create_from_date(date)
+            period = pd.Period(date, freq=model.freq_map[model.__name__])
+            self.assertEqual(obj.start_date, period.start_time.date(), msg=f'{model} {date}')
+            self.assertEqual(obj.end_date, period.end_time.date(), msg=f'{model} {date}')
+            self.assertEqual(obj.period, period)
+            self.assertTrue(obj.contains(date))
+            self.assertFalse(obj.contains(period.end_time + pd.Timedelta(days=1)))
+            self.assertEqual(obj.get_or_create_next()[0].period, period + 1)
+            self.assertEqual(obj.get_or_create_previous(2)[0].period, period - 2)
+
+    def test_iso_week_year(self):
+        week,_ = Week.get_or_create_from_date(dt.date(2024,12,30))
+        self.assertEqual((week.year_num, week.week_num, week.date), (2025, 1, dt.date(2024,12,30)))
+        week,_ = Week.get_or_create_from_date(dt.date(2021,1,3))
+        self.assertEqual((week.year_num, week.week_num), (2020, 53))
+        self.assertEqual(str(week), '2020 W53')
+        self.assertEqual(str(Month.get_or_create_from_date(dt.date(2021,1,3))[0]), '2021-01')
+
+    def test_benchmark(self):
+        results = benchmark_periods(number=10)
+        self.assertEqual(list(results), ['Year', 'Month', 'Week', 'Day'])
+
+class TestPeriodQuerySet(TestCase):
+    ''' A Test Class for the stored boundaries and the TimePeriodQuerySet methods '''
+
+    def setUp(self):
+        generate_calendar(dt.date(2020,12,1), dt.date(2021,2,28))
+
+    def test_containing_overlapping(self):
+        dtg = dt.datetime(2021,1,3,23,30, tzinfo=ZoneInfo('UTC'))
+        self.assertEqual(Week.objects.containing(dtg).get().week_num, 53)
+        self.assertEqual(Week.objects.containing(dtg, tzinfo=ZoneInfo('Asia/Tokyo')).get().week_num, 1)
+        self.assertEqual(Month.objects.containing(dt.date(2021,1,31)).get().month_num, 1)
+        self.assertEqual(Month.objects.overlapping(dt.date(2020,12,31), dt.date(2021,2,1)).count(), 3)
+        self.assertEqual(Day.objects.overlapping(dt.date(2021,1,1), dt.datetime(2021,1,7,12)).count(), 7)
+        week,_ = Week.get_or_create_from_date(dt.date(2022,1,1))
+        self.assertEqual(week.end_date, dt.date(2022,1,2))
+
+    def test_relative_status(self):
+        qs = Month.objects.relative_status(dt.datetime(2021,1,15))
+        self.assertEqual(list(qs.values_list('rel_status', flat=True)), ['past', 'present', 'future'])
+        for month in qs:
+            self.assertEqual(month.rel_status, month.get_rel_status(dt.datetime(2021,1,15)))
+
+    def test_containing_subquery(self):
+        person = Person.objects.create(first_name='jordan', last_name='Hyatt')
+        shift = Shift.objects.create(person=person, start=dt.datetime(2021,1,4,8), end=dt.datetime(2021,1,4,16))
+        shift = Shift.objects.annotate(week_id=Week.get_containing_subquery('start')).get(pk=shift.pk)
+        self.assertEqual(shift.week_id, Week.objects.get(year_num=2021, week_num=1).id)
+
+    @override_settings(USE_TZ=True)
+    def test_containing_subquery_date_field(self):
+        # dates are compared as is, only datetimes are converted to tzinfo
+        DateDim.generate(dt.date(2021,1,4), dt.date(2021,1,4))
+        for tzinfo in [ZoneInfo('America/New_York'), ZoneInfo('Asia/Tokyo')]:
+            row = DateDim.objects.annotate(week_id=Week.get_containing_subquery('date', tzinfo=tzinfo)).get()
+            self.assertEqual(row.week_id, Week.objects.get(year_num=2021, week_num=1).id)
+
+class TestDateDim(TestCase):
+    ''' A Test Class for the integer keyed calendar dimension '''
+
+    def test_generate(self):
+        with self.assertNumQueries(1):
+            DateDim.generate(dt.date(2020,12,28), dt.date(2021,4,1))
+        DateDim.generate(dt.date(2021,3,1), dt.date(2021,4,1)) # idempotent
+        self.assertEqual(DateDim.objects.count(), 95)
+        row = DateDim.objects.get(pk=20210103)
+        self.assertEqual((row.iso_year, row.iso_week, row.iso_year_week, row.day_of_week), (2020, 53, 202053, 7))
+        self.assertTrue(row.is_weekend and row.is_week_end)
+        row = DateDim.objects.get(date=dt.date(2021,3,31))
+        self.assertEqual((row.quarter, row.year_quarter, row.year_month), (1, 20211, 202103))
+        self.assertTrue(row.is_quarter_end and row.is_month_end and not row.is_year_end)
+        self.assertEqual(DateDim.objects.filter(is_quarter_start=True).count(), 2)
+
+    def test_keys(self):
+        DateDim.generate(dt.date(2021,1,1), dt.date(2021,1,31))
+        person = Person.objects.create(first_name='jordan', last_name='Hyatt')
+        Shift.objects.create(person=person, start=dt.datetime(2021,1,4,23), end=dt.datetime(2021,1,5,7))
+        shift = Shift.objects.annotate(date_key=DateDim.get_key_expression('start')).get()
+        self.assertEqual(shift.date_key, 20210104)
+        self.assertEqual(DateDim.objects.get(pk=shift.date_key).day_name, 'Monday')
+        ser = pd.Series([pd.Timestamp('2021-01-05 03:00', tz='UTC'), pd.NaT])
+        keys = get_date_keys(ser, timezone='America/New_York')
+        self.assertEqual(keys[0], 20210104)
+        self.assertTrue(pd.isna(keys[1]))
+
+    @override_settings(USE_TZ=True)
+    def test_keys_date_field(self):
+        DateDim.generate(dt.date(2021,1,4), dt.date(2021,1,4))
+        for tzinfo in [ZoneInfo('America/New_York'), ZoneInfo('Asia/Tokyo')]:
+            row = DateDim.objects.annotate(key=DateDim.get_key_expression('date', tzinfo=tzinfo)).get()
+            self.assertEqual(row.key, 20210104)
+
+class TestUpsert(TestCase):
+    ''' A Test Class for the contention safe get_or_create and the current period memo '''
+
+    def setUp(self):
+        TimePeriodBase.clear_current_memo()
+
+    def test_get_or_create_from_date(self):
+        date = dt.date(2021,1,3)
+        with self.assertNumQueries(8):
+            # select + insert for the Day, Month, Year (2021) and Week (its ISO Year is only resolved on access)
+            day, created = Day.get_or_create_from_date(date)
+        self.assertTrue(created)
+        self.assertEqual((day.month.year.year_num, day.week.week_num), (2021, 53))
+        self.assertFalse(Year.objects.filter(year_num=2020).exists())
+        self.assertEqual(day.week.year.year_num, 2020)
+        self.assertEqual(day, Day.objects.get(date=date))
+        with self.assertNumQueries(1):
+            self.assertEqual(Day.get_or_create_from_date(date), (day, False))
+        # A row inserted by another writer after the select is read back
+        week = Week(year_num=2021, week_num=10)
+        week.prepare()
+        self.assertIsNotNone(insert_on_conflict_do_nothing(week))
+        self.assertIsNone(insert_on_conflict_do_nothing(week))
+        self.assertEqual(Week.objects.filter(year_num=2021, week_num=10).count(), 1)
+
+    def test_current_period_memo(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            month, created = Month.get_or_create_current_period()
+        with self.assertNumQueries(0):
+            self.assertEqual(Month.get_or_create_current_period(), (month, False))
+        self.assertTrue(month.contains(dt.date.today()))
+        # Memo entries expire at the end of the period
+        key = (Month, 'None')
+        obj, start, end = TimePeriodBase._current_memo[key]
+        TimePeriodBase._current_memo[key] = (obj, start - dt.timedelta(days=400), start)
+        with self.assertNumQueries(1):
+            self.assertEqual(Month.get_or_create_current_period(), (month, False))
+        month.delete()
+        self.assertEqual(TimePeriodBase._current_memo, {})
+
+class TestRollup(TestCase):
+    ''' A Test Class for the incremental rollup tables '''
+
+    def setUp(self):
+        period_resolver.clear()
+        Sale.objects.bulk_create([
+            Sale(dtg=dt.datetime(2021,1,1,9), category='a', amount=1),
+            Sale(dtg=dt.datetime(2021,1,1,17), category='a', amount=2),
+            Sale(dtg=dt.datetime(2021,1,1,18), category='b', amount=4),
+            Sale(dtg=dt.datetime(2021,2,3,12), category='a', amount=8),
+        ])
+
+    @mock.patch.object(SaleDayRollup, 'rollup_rescan_window', 0)
+    def test_refresh(self):
+        state = SaleDayRollup.refresh()
+        self.assertTrue(state.full_refresh)
+        self.assertEqual(state.row_count, 3)
+        self.assertEqual(int(state.high_water_mark), Sale.objects.order_by('-id').first().id)
+        row = SaleDayRollup.objects.get(period__date=dt.date(2021,1,1), category='a')
+        self.assertEqual((row.total, row.n), (3, 2))
+        jan = SaleDayRollup.objects.get(period__date=dt.date(2021,1,1), category='b')
+        # Nothing past the high water mark
+        self.assertEqual(SaleDayRollup.refresh().row_count, 3)
+        # Only the Day of the new sale is re-aggregated
+        Sale.objects.create(dtg=dt.datetime(2021,2,3,13), category='a', amount=16)
+        state = SaleDayRollup.refresh()
+        self.assertFalse(state.full_refresh)
+        self.assertEqual(state.row_count, 1)
+        self.assertEqual(SaleDayRollup.objects.get(period__date=dt.date(2021,2,3)).total, 24)
+        self.assertEqual(SaleDayRollup.objects.get(period__date=dt.date(2021,1,1), category='b').pk, jan.pk)
+        # Deletes are picked up by a rebuild
+        Sale.objects.filter(category='b').delete()
+        out = StringIO()
+        call_command('refresh_rollups', 'tests.SaleDayRollup', '--full', stdout=out)
+        self.assertIn('Rebuilt tests.SaleDayRollup: 2 rows written', out.getvalue())
+        self.assertEqual(SaleDayRollup.objects.count(), 2)
+
+    @mock.patch.object(SaleDayRollup, 'rollup_rescan_window', 2)
+    def test_late_rows(self):
+        last = Sale.objects.order_by('-id').first().id
+        SaleDayRollup.refresh()
+        Sale.objects.create(id=last + 10, dtg=dt.datetime(2021,2,3,13), category='a', amount=16)
+        SaleDayRollup.refresh()
+        # committed after the refresh with a lower pk (but within the rescan window)
+        Sale.objects.create(id=last + 9, dtg=dt.datetime(2021,1,1,19), category='b', amount=32)
+        state = SaleDayRollup.refresh()
+        self.assertEqual(int(state.high_water_mark), last + 10)
+        self.assertEqual(SaleDayRollup.objects.get(period__date=dt.date(2021,1,1), category='b').total, 36)
+        # too late for the window, only a rebuild picks it up
+        Sale.objects.create(id=last + 5, dtg=dt.datetime(2021,1,2,20), category='b', amount=64)
+        SaleDayRollup.refresh()
+        self.assertFalse(SaleDayRollup.objects.filter(period__date=dt.date(2021,1,2)).exists())
+        SaleDayRollup.rebuild()
+        self.assertEqual(SaleDayRollup.objects.get(period__date=dt.date(2021,1,2)).total, 64)
+        self.assertEqual(SaleDayRollup.get_rescan_window(), 2)
+
+    def test_month_rollup(self):
+        self.assertEqual(SaleMonthRollup.get_rescan_window(), 1000) # pks
+        SaleMonthRollup.rebuild()
+        self.assertEqual(
+            list(SaleMonthRollup.objects.order_by('period__date').values_list('period__month_num', 'total', 'n')),
+            [(1, 7, 3), (2, 8, 1)]
+        )
+
+    def test_plot_n(self):
+        SaleDayRollup.refresh()
+        view = PlotlyMixin()
+        view.object_list = SaleDayRollup.objects.all()
+        # N is the number of source rows, not of rollup rows
+        self.assertEqual(view.object_list.aggregate(N=view.get_n_expr())['N'], 4)
+
+class TestPeriodFKMixin(TestCase):
+    ''' A Test Class for the PeriodFKMixin '''
+
+    def setUp(self):
+        period_resolver.clear()
+
+    def test_save(self):
+        sale = Sale.objects.create(dtg=dt.datetime(2021,1,3,12), category='a', amount=1)
+        self.assertEqual(sale.day.date, dt.date(2021,1,3))
+        self.assertEqual((sale.week.year_num, sale.week.week_num), (2020, 53))
+        self.assertEqual((sale.month.year_num, sale.month.month_num), (2021, 1))
+        sale.dtg = None
+        sale.save()
+        self.assertIsNone(sale.day_id)
+
+    def test_bulk_create(self):
+        generate_calendar(dt.date(2021,1,1), dt.date(2021,3,31))
+        period_resolver.load()
+        with self.assertNumQueries(1):
+            sales = Sale.objects.bulk_create([
+                Sale(dtg=dt.datetime(2021,1,1) + dt.timedelta(hours=7*i), category='a', amount=i) for i in range(200)
+            ])
+        self.assertTrue(all(s.day.date == s.dtg.date() and s.month.contains(s.dtg) for s in Sale.objects.all()))
+        self.assertEqual(len(sales), 200)
+
+    def test_backfill(self):
+        Sale.objects.bulk_create([
+            Sale(dtg=dt.datetime(2021,1,1) + dt.timedelta(hours=13*i), category='a', amount=i) for i in range(50)
+        ] + [Sale(dtg=None, category='b', amount=0)])
+        expected = list(Sale.objects.order_by('id').values_list('day_id', 'week_id', 'month_id'))
+        Sale.objects.update(day=None, week=None, month=None)
+        self.assertEqual(Sale.backfill_periods(batch_size=20, only_missing=True), 50)
+        self.assertEqual(list(Sale.objects.order_by('id').values_list('day_id', 'week_id', 'month_id')), expected)
+        out = StringIO()
+        call_command('backfill_periods', 'tests.Sale', '--batch-size', '7', stdout=out)
+        self.assertIn('Backfilled 50 rows of tests.Sale', out.getvalue())
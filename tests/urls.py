@@ -5,4 +5,6 @@ urlpatterns = [
     path("person-lookup", PersonLookup.as_view(), name="person-lookup"),
     path("person-create-request", PersonCreateWithRequest.as_view(), name="person-create-request"),
     path("person-create", PersonCreate.as_view(), name="person-create"),
+    path("person-bulk", PersonBulk.as_view(), name="person-bulk"),
+    path("person-delete/<int:pk>", PersonDelete.as_view(), name="person-delete"),
 ]
@@ -1,6 +1,7 @@
 from django_filters.views import FilterView
-from django_aux.views import SaveFilterMixin, RedirectPrevMixin
+from django_aux.views import SaveFilterMixin, RedirectPrevMixin, DeleteProtectedView, BulkActionMixin
 from django.views.generic import CreateView
+from django.urls import reverse_lazy
 from .tables import *
 from .filters import *
 from .models import *
@@ -27,3 +28,21 @@ class PersonCreateWithRequest(RedirectPrevMixin, CreateView):
     
 
 
+
+
+class PersonDelete(DeleteProtectedView):
+    model = Person
+    success_url = reverse_lazy('person-lookup')
+    template_name = "test.html"
+
+
+class PersonBulk(BulkActionMixin, SaveFilterMixin, FilterView):
+    model = Person
+    table_class = PersonTable
+    filterset_class = PersonFilter
+    template_name = "test.html"
+    bulk_chunk_size = 2
+    bulk_actions = {
+        'raise': {'display':'Set Salary', 'update':{'salary':100}},
+        'delete': {'display':'Delete', 'delete':True},
+    }